@@ -14,3 +14,8 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
 
 application = get_asgi_application()
+
+# Build the item autocomplete index in the background as the server starts, so the first request doesn't read every item
+# (here rather than in the app's ready(), which also runs for migrations, importers, tests, and runserver's autoreloader)
+from nutrition.utils.autocomplete_utils import itemNameIndex
+itemNameIndex.startBuild()
@@ -92,6 +92,31 @@ DATABASES = {
     }
 }
 
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+
+# Local memory cache (least recently used entries are culled once MAX_ENTRIES is reached)
+# It isn't shared between processes, so changes made by the import commands or other server workers only show in cached
+# responses once those expire (after five minutes, see version_utils)
+# Set REDIS_URL (e.g., redis://localhost:6379/0, needs the redis package) to share the cache between processes,
+# so cached responses and lookups are replaced everywhere after a change instead of only in the process that made it
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        },
+    }
+}
+if config("REDIS_URL", default=""):
+    CACHES['default'] = {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': config("REDIS_URL"),
+    }
+
+# Directory of the optional item nutrient vectors (see rebuild_nutrient_vectors)
+NUTRIENT_VECTOR_DIR = BASE_DIR / 'data' / 'nutrient_vectors'
+
 # Authentication user model
 AUTH_USER_MODEL = 'nutrition.User'
 
@@ -139,7 +164,7 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 # Pagination allows you to control how many objects per page are returned.
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'nutrition.api.authentication.CachedTokenAuthentication',
         'rest_framework.authentication.SessionAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': ['rest_framework.permissions.IsAuthenticated'],
@@ -1,5 +1,6 @@
 from django.contrib import admin
-from .models import User, Unit, ServingSize, Nutrient, Item, CombinedItem, Consumed, CombinedItemElement, ItemNutrient, ItemBioactive, FavoriteItem, GoalTemplate, GoalTemplateNutrient, UserGoal, UserGoalNutrient
+from .models import User, Unit, ServingSize, Nutrient, Item, CombinedItem, Consumed, CombinedItemElement, DailyNutrientTotal, ItemNutrient, ItemBioactive, FavoriteItem, GoalTemplate, GoalTemplateNutrient, UserGoal, UserGoalNutrient
+from .utils.ledger_utils import consumedOfItems, ledgerUpdate
 
 
 class FavoriteItemInline(admin.TabularInline):
@@ -34,6 +35,22 @@ class ItemAdmin(admin.ModelAdmin):
     list_display = ('name', 'barcode', 'calories', 'servingSize', 'user', 'isCustom')
     list_filter = ('isCustom',)
     inlines = [ItemNutrientInline, ItemBioactiveInline]
+
+    # An item's calories and nutrients count towards past consumption, so keep the daily nutrient ledger in sync
+    # The whole form is wrapped since the nutrient inlines are saved after the item
+    def changeform_view(self, request, object_id=None, form_url='', extra_context=None):
+        if object_id is None or request.method != 'POST':
+            return super().changeform_view(request, object_id, form_url, extra_context)
+        with ledgerUpdate(consumedOfItems([object_id])):
+            return super().changeform_view(request, object_id, form_url, extra_context)
+
+    def delete_model(self, request, obj):
+        with ledgerUpdate(consumedOfItems([obj.id])):
+            super().delete_model(request, obj)
+
+    def delete_queryset(self, request, queryset):
+        with ledgerUpdate(consumedOfItems(list(queryset.values_list('id', flat=True)))):
+            super().delete_queryset(request, queryset)
     
 @admin.register(CombinedItem)
 class CombinedItemAdmin(admin.ModelAdmin):
@@ -56,6 +73,11 @@ class ConsumedAdmin(admin.ModelAdmin):
 class CombinedItemElementAdmin(admin.ModelAdmin):
     list_display = ('combinedItem', 'item', 'portion')
 
+@admin.register(DailyNutrientTotal)
+class DailyNutrientTotalAdmin(admin.ModelAdmin):
+    list_display = ('user', 'date', 'nutrient', 'amount')
+    list_filter = ('user', 'date')
+
 @admin.register(FavoriteItem)
 class FavoriteItemAdmin(admin.ModelAdmin):
     list_display = ('user', 'item')
@@ -0,0 +1,49 @@
+import hashlib
+
+from django.core.cache import cache
+from django.db import router
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import AuthenticationFailed
+
+from nutrition.models import User
+from nutrition.utils.version_utils import sharedCache
+
+# How long (in seconds) a token's user is cached; kept short since other processes only see invalidations through a shared cache
+TOKEN_TIMEOUT = 60
+
+# Get the cache key of a token (hashed so token keys aren't stored in the cache)
+def tokenCacheKey(key):
+    return f'auth-token:{hashlib.sha256(key.encode()).hexdigest()}'
+
+def invalidateToken(key):
+    cache.delete(tokenCacheKey(key))
+
+# The user's fields that are cached with their token: all of them except the password hash, which is loaded from the database
+# if a request needs it
+def cachedUserFields(user):
+    return {field.attname: getattr(user, field.attname) for field in User._meta.concrete_fields if field.attname != 'password'}
+
+
+# Token authentication that caches each token with its user, so authenticated requests don't query for them
+# Cached tokens are dropped by signals when the token is deleted (logout) or its user changes (e.g., password or profile updates)
+# Those signals only reach other server processes through a shared cache, so with a local memory cache every request
+# checks the token in the database like TokenAuthentication
+class CachedTokenAuthentication(TokenAuthentication):
+
+    def authenticate_credentials(self, key):
+        if not sharedCache():
+            return super().authenticate_credentials(key)
+
+        cached = cache.get(tokenCacheKey(key))
+        if cached is None:
+            user, token = super().authenticate_credentials(key)
+            cache.set(tokenCacheKey(key), {'created': token.created, 'user': cachedUserFields(user)}, TOKEN_TIMEOUT)
+            return (user, token)
+
+        fields = cached['user']
+        user = User.from_db(router.db_for_read(User), list(fields), list(fields.values()))
+        if not user.is_active:
+            raise AuthenticationFailed('User inactive or deleted.')
+
+        return (user, Token(key=key, user=user, created=cached['created']))
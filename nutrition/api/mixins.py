@@ -0,0 +1,73 @@
+import functools
+
+from django.core.cache import cache
+from django.utils import timezone
+from rest_framework.response import Response
+
+from nutrition.utils.version_utils import cacheTimeout, getVersions, lastModifiedTime, makeEtag, notModifiedResponse, setValidators, sharedCache, userVersion
+
+# How long (in seconds) to keep cached responses; they are replaced sooner whenever their version changes
+# (and kept for at most LOCAL_CACHE_TIMEOUT in a local memory cache, see version_utils)
+RESPONSE_TIMEOUT = 60 * 60 * 24
+
+
+# Cache the list and retrieve responses of a viewset whose data rarely changes, with ETag and Last-Modified validators
+# Responses are keyed by the viewset's versions (see version_utils), so writes replace them: right away with a shared cache,
+# and within LOCAL_CACHE_TIMEOUT for writes from other processes (e.g., the import commands) with a local memory cache
+class CachedResponseMixin:
+    # Names of the versions the responses depend on, bumped by signals in signals.py
+    cacheVersions = []
+
+    def cachedResponse(self, request, getResponse):
+        version, changedAt = getVersions(self.cacheVersions)
+        etag = makeEtag(version, request.get_full_path(), request.META.get('HTTP_ACCEPT', ''))
+        lastModified = lastModifiedTime(changedAt)
+
+        notModified = notModifiedResponse(request, etag, lastModified)
+        if notModified is not None:
+            return notModified
+
+        key = f'response:{etag}'
+        data = cache.get(key)
+        if data is not None:
+            return setValidators(Response(data), etag, lastModified)
+
+        response = getResponse()
+        if response.status_code == 200:
+            cache.set(key, response.data, cacheTimeout(RESPONSE_TIMEOUT))
+            setValidators(response, etag, lastModified)
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.cachedResponse(request, lambda: super(CachedResponseMixin, self).list(request, *args, **kwargs))
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cachedResponse(request, lambda: super(CachedResponseMixin, self).retrieve(request, *args, **kwargs))
+
+
+# Decorate a view's get (or list) method to answer with 304 Not Modified, without running the view, while the user's data
+# hasn't changed since the client's ETag
+# Today's date is part of the ETag since views list today's data by default
+# Users poll their own data right after changing it, so this needs a shared cache: with a local memory cache the version is
+# only replaced in the process that handled the change, and the others would keep answering 304
+def userVersioned(view):
+    @functools.wraps(view)
+    def wrapper(self, request, *args, **kwargs):
+        if not sharedCache():
+            return view(self, request, *args, **kwargs)
+
+        version, changedAt = getVersions([userVersion(request.user.id)])
+        etag = makeEtag(version, request.get_full_path(), request.META.get('HTTP_ACCEPT', ''), timezone.localdate())
+        # A new day changes the ETag but not the version, so Last-Modified can't be earlier than the day's start
+        lastModified = lastModifiedTime(max(changedAt, int(timezone.localtime().replace(hour=0, minute=0, second=0, microsecond=0).timestamp())))
+
+        notModified = notModifiedResponse(request, etag, lastModified)
+        if notModified is not None:
+            return notModified
+
+        response = view(self, request, *args, **kwargs)
+        if response.status_code == 200:
+            setValidators(response, etag, lastModified)
+        return response
+
+    return wrapper
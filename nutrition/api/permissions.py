@@ -4,4 +4,11 @@ from rest_framework.permissions import IsAdminUser, SAFE_METHODS
 class IsAdminUserOrReadOnly(IsAdminUser):
     def has_permission(self, request, view):
         is_admin = super().has_permission(request, view)
-        return request.method in SAFE_METHODS or is_admin
\ No newline at end of file
+        return request.method in SAFE_METHODS or is_admin
+
+# Allow any authenticated user to view and create, but only admin users to edit or delete
+class IsAdminUserOrCreateOnly(IsAdminUser):
+    def has_permission(self, request, view):
+        is_admin = super().has_permission(request, view)
+        is_authenticated = bool(request.user and request.user.is_authenticated)
+        return (is_authenticated and request.method in SAFE_METHODS + ('POST',)) or is_admin
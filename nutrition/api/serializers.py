@@ -1,4 +1,5 @@
 from django.contrib.auth.models import Group
+from django.utils import timezone
 from rest_framework import serializers
 from nutrition.models import User, Unit, Nutrient, ServingSize, Item, CombinedItem, Consumed, CombinedItemElement, ItemNutrient, ItemBioactive, FavoriteItem, GoalTemplate, GoalTemplateNutrient, UserGoal, UserGoalNutrient
 
@@ -70,12 +71,53 @@ class NutrientStatusSerializer(serializers.Serializer):
     target_value = serializers.DecimalField(max_digits=8, decimal_places=2)
     total_consumed = serializers.DecimalField(max_digits=8, decimal_places=2)
 
+# Date Range Serializer
+
+class DateRangeSerializer(serializers.Serializer):
+    date = serializers.DateField(required=False)
+    start = serializers.DateField(required=False)
+    end = serializers.DateField(required=False)
+
+    # Resolve the query to an inclusive start and end date (today if no dates are given)
+    def validate(self, data):
+        day = data.get('date')
+        start = data.get('start')
+        end = data.get('end')
+
+        if day and (start or end):
+            raise serializers.ValidationError("Provide either a date or a start and end date, not both.")
+
+        if day:
+            start = end = day
+        else:
+            end = end or timezone.localdate()
+            start = start or end
+
+        if start > end:
+            raise serializers.ValidationError("Start date must be on or before end date.")
+
+        return {'start': start, 'end': end}
+
+# Nutrient Trend Serializers
+
+class NutrientTrendQuerySerializer(DateRangeSerializer):
+    period = serializers.ChoiceField(choices=['day', 'week'], default='day')
+    nutrients = serializers.ListField(child=serializers.IntegerField(), required=False, max_length=50)
+
+    def validate(self, data):
+        return {**super().validate(data), 'period': data['period'], 'nutrients': data.get('nutrients', [])}
+
+class NutrientTrendSerializer(serializers.Serializer):
+    start = serializers.DateField()
+    calories = serializers.DecimalField(max_digits=20, decimal_places=2)
+    nutrients = serializers.DictField(child=serializers.DecimalField(max_digits=20, decimal_places=2))
+
 # Consume Serializer
 
 class ConsumedCreateSerializer(serializers.ModelSerializer):
     class Meta:
         model = Consumed
-        fields = ['item', 'combinedItem', 'portion']
+        fields = ['item', 'combinedItem', 'portion', 'consumedAt']
 
     def validate(self, data):
         portion = data.get('portion')
@@ -92,6 +134,30 @@ class ConsumedCreateSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError("You may provide either an item or combined item, not both.")
 
         return data
+
+# Entries in a consumption batch take item and combined item IDs, which ConsumedBatchSerializer checks for every entry at once
+class ConsumedBatchEntrySerializer(ConsumedCreateSerializer):
+    item = serializers.IntegerField(required=False, allow_null=True)
+    combinedItem = serializers.IntegerField(required=False, allow_null=True)
+
+class ConsumedBatchSerializer(serializers.Serializer):
+    entries = ConsumedBatchEntrySerializer(many=True, allow_empty=False, max_length=500)
+
+    def validate(self, data):
+        itemIds = {entry['item'] for entry in data['entries'] if entry.get('item')}
+        combinedItemIds = {entry['combinedItem'] for entry in data['entries'] if entry.get('combinedItem')}
+
+        errors = {}
+        missingItems = sorted(itemIds - set(Item.objects.filter(id__in=itemIds).values_list('id', flat=True)))
+        if missingItems:
+            errors['item'] = f"Items do not exist: {missingItems}."
+        missingCombinedItems = sorted(combinedItemIds - set(CombinedItem.objects.filter(id__in=combinedItemIds).values_list('id', flat=True)))
+        if missingCombinedItems:
+            errors['combinedItem'] = f"Combined items do not exist: {missingCombinedItems}."
+        if errors:
+            raise serializers.ValidationError(errors)
+
+        return data
     
 # Item Serializers
 
@@ -116,6 +182,40 @@ class ItemCreateSerializer(serializers.Serializer):
 
         return data
 
+    def validate_nutrients(self, nutrients):
+        try:
+            return {int(nutrientId): amount for nutrientId, amount in nutrients.items()}
+        except ValueError:
+            raise serializers.ValidationError("Nutrient IDs must be integers.")
+
+# Items in a bulk create take unit IDs, which ItemBulkCreateSerializer resolves for every item in one query
+class ItemBulkCreateItemSerializer(ItemCreateSerializer):
+    serving_unit = serializers.IntegerField()
+
+class ItemBulkCreateSerializer(serializers.Serializer):
+    items = ItemBulkCreateItemSerializer(many=True, allow_empty=False, max_length=500)
+
+    def validate(self, data):
+        units = Unit.objects.in_bulk({item['serving_unit'] for item in data['items']})
+        missing = sorted({item['serving_unit'] for item in data['items']} - set(units))
+        if missing:
+            raise serializers.ValidationError(f"Units do not exist: {missing}.")
+
+        for item in data['items']:
+            item['serving_unit'] = units[item['serving_unit']]
+
+        return data
+
+# Nutrients of a newly created item, with the nutrient (and its unit) already loaded
+class CreatedItemNutrientSerializer(serializers.Serializer):
+    id = serializers.IntegerField(source='nutrient.id')
+    name = serializers.CharField(source='nutrient.name')
+    unit = serializers.CharField(source='nutrient.unit.abbreviation')
+    amount = serializers.DecimalField(max_digits=8, decimal_places=2)
+
+class BarcodeListSerializer(serializers.Serializer):
+    barcodes = serializers.ListField(child=serializers.CharField(max_length=50), allow_empty=False, max_length=500)
+
 # "Regular" Model Serializers
 
 class UserSerializer(serializers.ModelSerializer):
@@ -186,6 +286,13 @@ class ServingSizeSerializer(serializers.ModelSerializer):
         if amount is not None and amount < 0.01:
             raise serializers.ValidationError("Amount must be at least 0.01.")
 
+        # Creating an existing serving size returns it (see ServingSizeViewSet), but changing one into another isn't allowed
+        if self.instance is not None:
+            amount = data.get('amount', self.instance.amount)
+            unit = data.get('unit', self.instance.unit)
+            if ServingSize.objects.filter(amount=amount, unit=unit).exclude(id=self.instance.id).exists():
+                raise serializers.ValidationError("A serving size with this amount and unit already exists.")
+
         return data
 
 class ItemSerializer(serializers.ModelSerializer):
@@ -203,9 +310,19 @@ class ItemSerializer(serializers.ModelSerializer):
         return data
 
 class CombinedItemSerializer(serializers.ModelSerializer):
+    # Totals of all the elements, from the stored CombinedItemTotal rows (calories have a null nutrient)
+    calories = serializers.SerializerMethodField()
+    nutrients = serializers.SerializerMethodField()
+
     class Meta:
         model = CombinedItem
-        fields = '__all__'
+        fields = ['id', 'user', 'name', 'calories', 'nutrients']
+
+    def get_calories(self, obj):
+        return next((total.amount for total in obj.combineditemtotal_set.all() if total.nutrient_id is None), 0)
+
+    def get_nutrients(self, obj):
+        return [{'nutrient': total.nutrient_id, 'amount': total.amount} for total in obj.combineditemtotal_set.all() if total.nutrient_id is not None]
 
 class ConsumedSerializer(serializers.ModelSerializer):
     class Meta:
@@ -29,14 +29,20 @@ urlpatterns = [
     path('user-create/', views.UserCreateView.as_view(), name='user_create'),
     path('user/', views.UserRetrieveUpdateView.as_view(), name='user_update'),
     path('change-password/', views.ChangePasswordView.as_view(), name='change_password'),
+    path('logout/', views.LogoutView.as_view(), name='logout'),
     path('goal-generate/', views.UserGoalGenerateView.as_view(), name='goal-generate'),
     path('goal/<int:pk>/', views.UserGoalRetrieveUpdateView.as_view(), name='goal-update'),
     path('user-goals/', views.UserGoalIDListView.as_view(), name='user-goals'),
     path('active-goal/', views.UserActiveGoalIDView.as_view(), name='active-goal'),
     path('goal-nutrient-status/', views.GoalNutrientStatusView.as_view(), name='goal-nutrient-status'),
+    path('nutrient-trend/', views.NutrientTrendView.as_view(), name='nutrient-trend'),
     path('consumed-create/', views.ConsumedCreateView.as_view(), name='consumed-create'),
+    path('consumed-batch-create/', views.ConsumedBatchCreateView.as_view(), name='consumed-batch-create'),
     path('consumed-items/', views.UserConsumedItemsView.as_view(), name='consumed-items'),
     path('toggle-favorite/<int:item_id>/', views.ToggleFavoriteView.as_view(), name='toggle-favorite'),
     path('favorites/', views.FavoriteItemIDListView.as_view(), name='favorites'),
-    path('item-create/', views.ItemCreateView.as_view(), name='item-create')
+    path('item-create/', views.ItemCreateView.as_view(), name='item-create'),
+    path('item-bulk-create/', views.ItemBulkCreateView.as_view(), name='item-bulk-create'),
+    path('item-barcodes/', views.ItemBarcodeBatchView.as_view(), name='item-barcodes'),
+    path('item-autocomplete/', views.ItemAutocompleteView.as_view(), name='item-autocomplete'),
 ]
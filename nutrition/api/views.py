@@ -1,20 +1,32 @@
-from datetime import date
+from datetime import timedelta
 
 from django.contrib import auth
 from django.core.exceptions import ValidationError as DjangoValidationError
-from django.db.models import Count, Exists, F, functions, OuterRef, Sum, Q
+from django.db import IntegrityError, transaction
+from django.db.models import Case, Exists, OuterRef, Q, TextField, Value, When
+from django.db.models.functions import Coalesce, TruncDay, TruncWeek
+from django.utils import timezone
 
 from rest_framework import status, viewsets
+from rest_framework.authtoken.models import Token
 from rest_framework.exceptions import ValidationError, NotFound
-from rest_framework.generics import CreateAPIView, ListAPIView, RetrieveAPIView, RetrieveUpdateAPIView
+from rest_framework.generics import CreateAPIView, GenericAPIView, ListAPIView, RetrieveAPIView, RetrieveUpdateAPIView
 from rest_framework.permissions import AllowAny, IsAuthenticated, IsAdminUser
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
 from nutrition.models import User, Unit, Nutrient, ServingSize, Item, CombinedItem, Consumed, CombinedItemElement, ItemNutrient, ItemBioactive, FavoriteItem, GoalTemplate, GoalTemplateNutrient, UserGoal, UserGoalNutrient
-from nutrition.utils.nutrition_utils import calculateCalories, calculateMacronutrients, serializeNutrients
+from nutrition.utils.autocomplete_utils import itemNameIndex
+from nutrition.utils.cache_utils import getItemsByBarcode, getItemsByBarcodes
+from nutrition.utils.item_utils import createItems
+from nutrition.utils.ledger_utils import applyToLedger, consumedOfItems, ledgerUpdate
+from nutrition.utils.nutrition_utils import CALORIES_ID, calculateCalories, calculateMacronutrients, consumedOnDays, getMacronutrients, nutrientTotalsQuery, serializeNutrients, setGoalNutrientTargets
+from nutrition.utils.search_utils import searchItems
+from nutrition.utils.template_utils import goalTemplateResolver
+from nutrition.utils.version_utils import bumpVersion, userVersion
 
 from . import permissions, serializers
+from .mixins import CachedResponseMixin, userVersioned
 
 
 class UserCreateView(CreateAPIView):
@@ -92,6 +104,15 @@ class ChangePasswordView(APIView):
         return Response({'error': 'Old password entered incorrectly'}, status=status.HTTP_400_BAD_REQUEST)
 
 
+class LogoutView(APIView):
+
+    def post(self, request):  # Don't remove 'request'
+        # Delete the authenticated user's token so it can't be used again (a new one is made at the next login)
+        Token.objects.filter(user=self.request.user).delete()
+
+        return Response({'message': 'Logged out successfully'}, status=status.HTTP_200_OK)
+
+
 class UserGoalGenerateView(CreateAPIView):
     serializer_class = serializers.UserGoalSerializer
     queryset = UserGoal.objects.all()
@@ -106,8 +127,8 @@ class UserGoalGenerateView(CreateAPIView):
         isPregnant = user.is_pregnant or False
         isLactating = user.is_lactating or False
 
-        # Get the template that matches the user's info
-        template = GoalTemplate.objects.filter(sex=sex, isPregnant=isPregnant, isLactating=isLactating, ageMin__lte=age, ageMax__gte=age).first()
+        # Get the template that matches the user's info and its recommended values from the in-memory templates
+        template, targets = goalTemplateResolver.resolve(sex, isPregnant, isLactating, age)
         if not template:
             return Response({'detail': 'No goal templates fit this user'}, status=status.HTTP_400_BAD_REQUEST)
 
@@ -130,25 +151,12 @@ class UserGoalGenerateView(CreateAPIView):
             goal.calories = calories
             goal.save()
 
-        # Add new UserGoalNutrients for each GoalTemplateNutrient from the the GoalTemplate, setting the goal target values equal to the template recommended values
-        templateNutrients = template.goaltemplatenutrient_set.all()
-        for nutrient in templateNutrients:
-            goalNutrient, created = UserGoalNutrient.objects.get_or_create(goal=goal, nutrient=nutrient.nutrient, defaults={'targetValue': nutrient.recommendedValue})
-
-            # If the nutrient was not created because it already exists, update its targetValue
-            if not created:
-                goalNutrient.targetValue = nutrient.recommendedValue
-                goalNutrient.save()
+        # Set the goal target values equal to the template recommended values, then override them with the macronutrient targets
+        for nutrientName, nutrient in getMacronutrients(list(macronutrients)).items():
+            targets[nutrient.id] = macronutrients[nutrientName]
 
-        # Add a new goal nutrient for each of the three macronutrients
-        for nutrientName, targetValue in macronutrients.items():
-            nutrient = Nutrient.objects.get_or_create(name=nutrientName)[0]
-            goalNutrient, created = UserGoalNutrient.objects.get_or_create(goal=goal, nutrient=nutrient, defaults={'targetValue': targetValue})
-
-            # If the goal nutrient was not created (that is, it already exists), update the targetValue for that macronutrient
-            if not created:
-                goalNutrient.targetValue = targetValue
-                goalNutrient.save()
+        # Create or update all of the goal's nutrients at once
+        setGoalNutrientTargets(goal, targets)
 
         # Serialize the new goal
         serializer = self.get_serializer(goal)
@@ -211,14 +219,8 @@ class UserGoalRetrieveUpdateView(RetrieveUpdateAPIView):
             # If user age is defined, update the macronutrient distribution based on the new calories
             if user.age:
                 macronutrients = calculateMacronutrients(calories, user.age)
-                for nutrientName, targetValue in macronutrients.items():
-                    nutrient = Nutrient.objects.get_or_create(name=nutrientName)[0] # [0] prevents return of boolean
-                    goalNutrient, created = UserGoalNutrient.objects.get_or_create(goal=goal, nutrient=nutrient, defaults={'targetValue': targetValue})
-
-                    # If the UserGoalNutrient was not created (i.e., already exists), update the targetValue
-                    if not created:
-                        goalNutrient.targetValue = targetValue
-                        goalNutrient.save()
+                targets = {nutrient.id: macronutrients[nutrientName] for nutrientName, nutrient in getMacronutrients(list(macronutrients)).items()}
+                setGoalNutrientTargets(goal, targets)
 
         if 'isActive' in request.data:
             # Check if this goal is being set as the active goal
@@ -243,6 +245,10 @@ class UserGoalRetrieveUpdateView(RetrieveUpdateAPIView):
 class UserGoalIDListView(ListAPIView):
     serializer_class = serializers.UserGoalIDSerializer
 
+    @userVersioned
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
     # Retrieve a list of the user's goals
     def get_queryset(self):
         goals = self.request.user.usergoal_set.all()
@@ -268,6 +274,7 @@ class UserActiveGoalIDView(RetrieveAPIView):
 
 class GoalNutrientStatusView(APIView):
 
+    @userVersioned
     def get(self, request):  # Don't remove 'request'
         # Get authenticated user and their active goal
         user = self.request.user
@@ -276,45 +283,32 @@ class GoalNutrientStatusView(APIView):
         if not activeGoal:
             return Response({'message': 'No active goal found'}, status=status.HTTP_404_NOT_FOUND)
 
-        # Make a list of all the nutrients in the active goal
-        goalNutrients = activeGoal.usergoalnutrient_set.all()
-        
-        # Get everything the user ate today and separate into list of items and combined items
-        consumed = user.consumed_set.filter(consumedAt__date=date.today())
-        consumedItems = consumed.filter(item__isnull=False)
-        consumedCombinedItems = consumed.filter(combinedItem__isnull=False)
-        
-        # Calculate how many calories have been consumed in items and combined items
-        caloriesConsumedItems = consumedItems.aggregate(totalCalories=Sum(F('item__calories') * F('portion')))['totalCalories'] or 0
-        caloriesConsumedCombinedItems = consumedCombinedItems.aggregate(totalCalories=Sum(F('combinedItem__combineditemelement__item__calories') * F('portion')))['totalCalories'] or 0
+        # Make a list of all the nutrients in the active goal, loading their units up front
+        goalNutrients = activeGoal.usergoalnutrient_set.select_related('nutrient__unit')
+
+        # Read today's calorie and nutrient totals from the daily ledger (calories are stored with a null nutrient)
+        dailyTotals = user.dailynutrienttotal_set.filter(date=timezone.localdate()).values_list('nutrient', 'amount')
+        totals = {nutrientId or CALORIES_ID: amount for nutrientId, amount in dailyTotals}
 
         # Create a list to hold the status of each nutrient and add calories
         nutrientStatus = [
             {
-                "nutrient_id": -1,  # Arbitrary ID for calories
+                "nutrient_id": CALORIES_ID,
                 "nutrient_name": "Calories",
                 "nutrient_unit": "kcal",
                 "target_value": activeGoal.calories,
-                "total_consumed": caloriesConsumedItems + caloriesConsumedCombinedItems,
+                "total_consumed": totals.get(CALORIES_ID, 0),
             }
         ]
 
         for goalNutrient in goalNutrients:
-            # Make a list of of consumed items and combined items that contain the current goal nutrient
-            itemsWithNutrient = consumedItems.filter(item__itemnutrient__nutrient=goalNutrient.nutrient)
-            combindItemsWithNutrient = consumedCombinedItems.filter(combinedItem__combineditemelement__item__itemnutrient__nutrient=goalNutrient.nutrient)
-
-            # Calculate how much of the current nutrient has been consumed in items and combined items
-            nutrientConsumedItems = itemsWithNutrient.aggregate(totalNutrient=Sum(F('portion') * F('item__itemnutrient__amount')))['totalNutrient'] or 0
-            nutrientConsumedCombinedItems = combindItemsWithNutrient.aggregate(totalNutrient=Sum(F('portion') * F('combinedItem__combineditemelement__item__itemnutrient__amount')))['totalNutrient'] or 0
-
             # Add the status of the current nutrient to the status list
             nutrientStatus.append({
                 "nutrient_id": goalNutrient.nutrient.id,
                 "nutrient_name": goalNutrient.nutrient.name,
                 "nutrient_unit": goalNutrient.nutrient.unit.abbreviation,
                 "target_value": goalNutrient.targetValue,
-                "total_consumed": nutrientConsumedItems + nutrientConsumedCombinedItems,
+                "total_consumed": totals.get(goalNutrient.nutrient.id, 0),
             })
 
         # Serialize the list of nutrient statuses
@@ -323,6 +317,44 @@ class GoalNutrientStatusView(APIView):
         return Response(serializer.data, status=status.HTTP_200_OK)
 
 
+class NutrientTrendView(GenericAPIView):
+
+    @userVersioned
+    def get(self, request): # Don't remove 'request'
+        query = serializers.NutrientTrendQuerySerializer(data=self.request.query_params)
+        query.is_valid(raise_exception=True)
+        start, end, period, nutrientIds = (query.validated_data[key] for key in ('start', 'end', 'period', 'nutrients'))
+
+        # List the start date of every day or week (starting on Monday) in the range, and take one page of them
+        step = timedelta(days=7 if period == 'week' else 1)
+        first = start - timedelta(days=start.weekday()) if period == 'week' else start
+        periodStarts = self.paginate_queryset([first + step * i for i in range((end - first) // step + 1)])
+
+        # Total the page's periods in one grouped query, so memory use doesn't grow with the length of the range
+        pageStart = max(start, periodStarts[0])
+        pageEnd = min(end, periodStarts[-1] + step - timedelta(days=1))
+        truncate = TruncWeek if period == 'week' else TruncDay
+        totals = {periodStart: {} for periodStart in periodStarts}
+        for row in nutrientTotalsQuery(consumedOnDays(self.request.user.consumed_set, pageStart, pageEnd), nutrientIds, period=truncate('consumedAt')):
+            # Items without any nutrients produce an empty row
+            if row['nutrientId'] is None or row['total'] is None:
+                continue
+            periodTotals = totals[timezone.localtime(row['period']).date()]
+            periodTotals[row['nutrientId']] = periodTotals.get(row['nutrientId'], 0) + row['total']
+
+        trend = [
+            {
+                "start": periodStart,
+                "calories": periodTotals.get(CALORIES_ID, 0),
+                "nutrients": {nutrientId: periodTotals.get(nutrientId, 0) for nutrientId in nutrientIds},
+            }
+            for periodStart, periodTotals in totals.items()
+        ]
+        serializer = serializers.NutrientTrendSerializer(trend, many=True)
+
+        return self.get_paginated_response(serializer.data)
+
+
 class ConsumedCreateView(CreateAPIView):
     serializer_class = serializers.ConsumedCreateSerializer
 
@@ -331,39 +363,67 @@ class ConsumedCreateView(CreateAPIView):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
 
-        # If data is valid, create consumed item for authenticated user
-        serializer.save(user=self.request.user)
+        # If data is valid, create consumed item for authenticated user and add it to their daily totals
+        with transaction.atomic():
+            consumed = serializer.save(user=self.request.user)
+            applyToLedger(Consumed.objects.filter(pk=consumed.pk))
 
         return Response({'message': 'Consumption recorded successfully'}, status=status.HTTP_201_CREATED)
 
+class ConsumedBatchCreateView(CreateAPIView):
+    serializer_class = serializers.ConsumedBatchSerializer
+
+    def create(self, request):
+        # Validate the entries, checking every item and combined item exists in one query each
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        # Create every entry in one insert and add them all to the daily totals
+        # bulk_create skips the save signals and entries without any nutrients (like an empty combined item) don't change the
+        # ledger, so mark the user's data changed here
+        consumed = [
+            Consumed(user=self.request.user, item_id=entry.get('item'), combinedItem_id=entry.get('combinedItem'), portion=entry['portion'], consumedAt=entry.get('consumedAt') or timezone.now())
+            for entry in serializer.validated_data['entries']
+        ]
+        with transaction.atomic():
+            Consumed.objects.bulk_create(consumed)
+            applyToLedger(Consumed.objects.filter(pk__in=[entry.pk for entry in consumed]))
+            bumpVersion(userVersion(self.request.user.id))
+
+        return Response({'message': 'Consumption recorded successfully', 'consumed': [entry.pk for entry in consumed]}, status=status.HTTP_201_CREATED)
+
 
 class UserConsumedItemsView(APIView):
 
+    @userVersioned
     def get(self, request): # Don't remove 'request'
-        # Get all items consumed on current date by authenticated user
-        consumedItems = self.request.user.consumed_set.filter(consumedAt__date=date.today())
-
-        # Create a list to store serialized consumed items
-        consumedItemsList = []
+        # Get the date range to list (today by default)
+        dateRange = serializers.DateRangeSerializer(data=self.request.query_params)
+        dateRange.is_valid(raise_exception=True)
+        start, end = dateRange.validated_data['start'], dateRange.validated_data['end']
+
+        # Get everything consumed in the range by the authenticated user, taking the id and name from whichever of item or combined item is set
+        consumedItems = consumedOnDays(self.request.user.consumed_set, start, end).order_by('consumedAt', 'id').values_list(
+            'id',
+            Coalesce('item', 'combinedItem'),
+            Case(When(item__isnull=False, then=Value('Item')), default=Value('CombinedItem')),
+            Coalesce('item__name', 'combinedItem__name', output_field=TextField()),
+            'portion',
+            'consumedAt',
+        )
 
         # Serialize the consumed items
-        for consumedItem in consumedItems:
-            if consumedItem.item:
-                consumedItemsList.append({
-                    "id": consumedItem.id,
-                    "item_id": consumedItem.item.id,
-                    "type": "Item",
-                    "name": consumedItem.item.name,
-                    "portion": consumedItem.portion,
-                })
-            elif consumedItem.combinedItem:
-                consumedItemsList.append({
-                    "id": consumedItem.id,
-                    "item_id": consumedItem.combinedItem.id,
-                    "type": "CombinedItem",
-                    "name": consumedItem.combinedItem.name,
-                    "portion": consumedItem.portion,
-                })
+        consumedItemsList = [
+            {
+                "id": id,
+                "item_id": itemId,
+                "type": itemType,
+                "name": name,
+                "portion": portion,
+                "consumedAt": consumedAt,
+            }
+            for id, itemId, itemType, name, portion, consumedAt in consumedItems
+        ]
 
         return Response(consumedItemsList, status=status.HTTP_200_OK)
 
@@ -392,6 +452,10 @@ class ToggleFavoriteView(APIView):
 class FavoriteItemIDListView(ListAPIView):
     serializer_class = serializers.FavoriteItemIDSerializer
 
+    @userVersioned
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
     # Retrieve a list of the authenticated user's favorites
     def get_queryset(self):
         favorites = self.request.user.favoriteitem_set.all()
@@ -401,6 +465,36 @@ class FavoriteItemIDListView(ListAPIView):
 
         return favorites
 
+class ItemBarcodeBatchView(APIView):
+
+    def post(self, request): # Don't remove 'request'
+        # Validate the list of barcodes
+        serializer = serializers.BarcodeListSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        barcodes = list(dict.fromkeys(serializer.validated_data['barcodes']))
+
+        # Resolve every barcode at once (cached barcodes are not queried again)
+        itemsByBarcode = getItemsByBarcodes(barcodes)
+        items = [item for barcode in barcodes for item in itemsByBarcode[barcode]]
+        notFound = [barcode for barcode in barcodes if not itemsByBarcode[barcode]]
+
+        # Add the user's favorite flags for the whole set in one query
+        favoriteIds = set(self.request.user.favoriteitem_set.filter(item__in=[item['id'] for item in items]).values_list('item', flat=True))
+        items = [{**item, 'isFavorite': item['id'] in favoriteIds} for item in items]
+
+        return Response({'items': items, 'not_found': notFound}, status=status.HTTP_200_OK)
+
+
+class ItemAutocompleteView(APIView):
+
+    def get(self, request): # Don't remove 'request'
+        # Suggest the top ten items with a word starting with each word of the query from the in-memory name index
+        name = self.request.query_params.get('name', '')
+        suggestions = itemNameIndex.suggest(name)
+
+        return Response(suggestions, status=status.HTTP_200_OK)
+
+
 class ItemCreateView(CreateAPIView):
     serializer_class = serializers.ItemCreateSerializer
 
@@ -408,42 +502,53 @@ class ItemCreateView(CreateAPIView):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
 
-        # Create the item
-        item = Item.objects.create(
-            name=serializer.data['name'],
-            calories=serializer.validated_data['calories'],
-            servingSize=ServingSize.objects.create(amount=serializer.validated_data['serving_amount'], unit=serializer.validated_data['serving_unit']),
-            user=self.request.user,
-            isCustom=True
-        )
+        # Verify every nutrient exists before creating anything
+        nutrients = Nutrient.objects.select_related('unit').in_bulk(serializer.validated_data['nutrients'])
+        if len(nutrients) < len(serializer.validated_data['nutrients']):
+            return Response({'error': 'Nutrient does not exist'}, status=status.HTTP_404_NOT_FOUND)
 
-        # Add each of the item's nutrients
-        createdNutrients = []
-        for id, amount in serializer.data['nutrients'].items():
-            # Verify nutrient exists
-            nutrientToAdd = Nutrient.objects.filter(id=id).first()
-            if not nutrientToAdd:
-                return Response({'error': 'Nutrient does not exist'}, status=status.HTTP_404_NOT_FOUND)
-            
-            # Link the item and the nutrient
-            itemNutrient = ItemNutrient.objects.create(item=item, nutrient=nutrientToAdd, amount=amount)
-            nutrientData = {
-                'id': nutrientToAdd.id,
-                'name': nutrientToAdd.name,
-                'unit': nutrientToAdd.unit.abbreviation,
-                'amount': itemNutrient.amount
-            }
-            createdNutrients.append(nutrientData)
+        # Create the item and link its nutrients
+        [(item, itemNutrients)] = createItems(self.request.user, [serializer.validated_data], nutrients)
 
         # Prepare the response
         createdItem = serializers.ItemSerializer(item)
         itemAndNutrients = {
             'item': createdItem.data,
-            'nutrients': createdNutrients
+            'nutrients': serializers.CreatedItemNutrientSerializer(itemNutrients, many=True).data
         }
 
         return Response(itemAndNutrients, status=status.HTTP_201_CREATED)
 
+
+class ItemBulkCreateView(CreateAPIView):
+    serializer_class = serializers.ItemBulkCreateSerializer
+
+    def create(self, request):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        itemsData = serializer.validated_data['items']
+
+        # Verify the nutrients of every item in one query, so either all items are created or none
+        nutrientIds = {nutrientId for data in itemsData for nutrientId in data['nutrients']}
+        nutrients = Nutrient.objects.select_related('unit').in_bulk(nutrientIds)
+        missing = sorted(nutrientIds - set(nutrients))
+        if missing:
+            return Response({'error': 'Nutrient does not exist', 'nutrients': missing}, status=status.HTTP_404_NOT_FOUND)
+
+        created = createItems(self.request.user, itemsData, nutrients)
+
+        # Read the items back with their nutrient IDs in two queries, and return them in the order they were sent
+        items = Item.objects.prefetch_related('nutrients').in_bulk([item.id for item, itemNutrients in created])
+        itemsAndNutrients = [
+            {
+                'item': serializers.ItemSerializer(items[item.id]).data,
+                'nutrients': serializers.CreatedItemNutrientSerializer(itemNutrients, many=True).data
+            }
+            for item, itemNutrients in created
+        ]
+
+        return Response({'items': itemsAndNutrients}, status=status.HTTP_201_CREATED)
+
  
 class UserViewSet(viewsets.ModelViewSet):
     queryset = User.objects.all().order_by('-date_joined')
@@ -455,72 +560,172 @@ class GroupViewSet(viewsets.ModelViewSet):
     serializer_class = serializers.GroupSerializer
     permission_classes = [IsAdminUser]
 
-class UnitViewSet(viewsets.ModelViewSet):
+class UnitViewSet(CachedResponseMixin, viewsets.ModelViewSet):
     queryset = Unit.objects.all()
+    cacheVersions = ['units']
     serializer_class = serializers.UnitSerializer
     permission_classes = [permissions.IsAdminUserOrReadOnly]
 
-class NutrientViewSet(viewsets.ModelViewSet):
+class NutrientViewSet(CachedResponseMixin, viewsets.ModelViewSet):
     queryset = Nutrient.objects.all()
+    cacheVersions = ['nutrients']
     serializer_class = serializers.NutrientSerializer
     permission_classes = [permissions.IsAdminUserOrReadOnly]
 
 class ServingSizeViewSet(viewsets.ModelViewSet):
     queryset = ServingSize.objects.all()
     serializer_class = serializers.ServingSizeSerializer
-    permission_classes = [IsAuthenticated]
+    # Serving sizes are shared by every item with the same amount and unit, so only admins may change or delete them
+    permission_classes = [permissions.IsAdminUserOrCreateOnly]
+
+    # Creating a serving size that already exists returns the existing row
+    def perform_create(self, serializer):
+        serializer.instance, created = ServingSize.objects.get_or_create(**serializer.validated_data)
+
+    # The serializer rejects an amount and unit that already exist, but another request may add them meanwhile
+    def perform_update(self, serializer):
+        try:
+            with transaction.atomic():
+                serializer.save()
+        except IntegrityError:
+            raise ValidationError("A serving size with this amount and unit already exists.")
+
+    # Deleting a serving size would delete every item that uses it (and their consumption), so only unused ones can be deleted
+    def perform_destroy(self, instance):
+        if instance.item_set.exists():
+            raise ValidationError("This serving size is used by items and can't be deleted.")
+        instance.delete()
 
 class ItemViewSet(viewsets.ModelViewSet):
     queryset = Item.objects.all()
     serializer_class = serializers.ItemSerializer
     permission_classes = [IsAuthenticated]
 
+    def list(self, request): # Don't remove 'request'
+        barcode = self.request.query_params.get('barcode', None)
+        name = self.request.query_params.get('name', None)
+        if barcode is None and name is not None:
+            # Rank by relevance to the search if requested, then by shortest name and most nutrients
+            ranked = self.request.query_params.get('ranked', '').lower() in ('true', '1')
+            queryset = searchItems(self.get_queryset(), name, ranked).prefetch_related('nutrients')[:10]
+
+            # Run the search once (plus the nutrient prefetch) and verify an item containing the name exists
+            items = list(queryset)
+            if not items:
+                raise NotFound('No matching items')
+
+            page = self.paginate_queryset(items)
+            serializer = self.get_serializer(page, many=True)
+            return self.get_paginated_response(serializer.data)
+        if barcode is None:
+            return super().list(request)
+
+        # Look up the barcode in the cache (unknown barcodes are cached too)
+        items = getItemsByBarcode(barcode)
+        if not items:
+            raise NotFound('No items match this barcode')
+
+        # The cached items are shared by all users, so add the user's favorite flags afterwards in one query
+        favoriteIds = set(self.request.user.favoriteitem_set.filter(item__in=[item['id'] for item in items]).values_list('item', flat=True))
+        items = [{**item, 'isFavorite': item['id'] in favoriteIds} for item in items]
+
+        page = self.paginate_queryset(items)
+        return self.get_paginated_response(page)
+
     def get_queryset(self):
         user = self.request.user
         queryset = super().get_queryset()
 
         barcode = self.request.query_params.get('barcode', None)
-        name = self.request.query_params.get('name', None)
+        isFavorite = Exists(FavoriteItem.objects.filter(user=user, item=OuterRef('id')))
         # Check if request contains barcode
         if barcode is not None:
             queryset = queryset.filter(barcode=barcode)
             # Verify an item with the barcode exists
             if not queryset.exists():
                 raise NotFound('No items match this barcode')
-        # Check if request contains name
-        elif name is not None:
-            words = name.split()
-            for word in words:
-                queryset = queryset.filter(name__icontains=word)
-            # Verify an item containing the name exists
-            if not queryset.exists():
-                raise NotFound('No matching items')
-            queryset = queryset.annotate(nameLength=functions.Length('name'), nutrientCount=Count('nutrients')).order_by('nameLength', '-nutrientCount')[:10]
 
-        queryset = queryset.annotate(isFavorite=Exists(FavoriteItem.objects.filter(user=user, item=OuterRef('id'))))
+        queryset = queryset.annotate(isFavorite=isFavorite)
 
         return queryset
 
+    # An item's calories count towards every consumption of it and of the combined items containing it, so update the ledger for those
+    def perform_update(self, serializer):
+        with ledgerUpdate(consumedOfItems([serializer.instance.id])):
+            serializer.save()
+
+    # Deleting an item deletes its consumptions and removes it from combined items, so take both out of the ledger
+    def perform_destroy(self, instance):
+        with ledgerUpdate(consumedOfItems([instance.id])):
+            instance.delete()
+
 class CombinedItemViewSet(viewsets.ModelViewSet):
-    queryset = CombinedItem.objects.all()
+    queryset = CombinedItem.objects.prefetch_related('combineditemtotal_set')
     serializer_class = serializers.CombinedItemSerializer
     permission_classes = [IsAuthenticated]
 
+    # Deleting a combined item deletes its consumptions, so take them out of the ledger
+    def perform_destroy(self, instance):
+        with ledgerUpdate(Consumed.objects.filter(combinedItem=instance)):
+            instance.delete()
+
 class ConsumedViewSet(viewsets.ModelViewSet):
     queryset = Consumed.objects.all()
     serializer_class = serializers.ConsumedSerializer
     permission_classes = [IsAuthenticated]
 
+    # Keep the daily nutrient ledger in sync with every write
+    def perform_create(self, serializer):
+        with transaction.atomic():
+            consumed = serializer.save()
+            applyToLedger(Consumed.objects.filter(pk=consumed.pk))
+
+    def perform_update(self, serializer):
+        with ledgerUpdate(Consumed.objects.filter(pk=serializer.instance.pk)):
+            serializer.save()
+
+    def perform_destroy(self, instance):
+        with ledgerUpdate(Consumed.objects.filter(pk=instance.pk)):
+            instance.delete()
+
 class CombinedItemElementViewSet(viewsets.ModelViewSet):
     queryset = CombinedItemElement.objects.all()
     serializer_class = serializers.CombinedItemElementSerializer
     permission_classes = [IsAuthenticated]
 
+    # Changing a combined item's elements changes the totals of every consumption of it, so update the ledger for those
+    def perform_create(self, serializer):
+        with ledgerUpdate(Consumed.objects.filter(combinedItem=serializer.validated_data['combinedItem'])):
+            serializer.save()
+
+    def perform_update(self, serializer):
+        combinedItems = [serializer.instance.combinedItem, serializer.validated_data.get('combinedItem', serializer.instance.combinedItem)]
+        with ledgerUpdate(Consumed.objects.filter(combinedItem__in=combinedItems)):
+            serializer.save()
+
+    def perform_destroy(self, instance):
+        with ledgerUpdate(Consumed.objects.filter(combinedItem=instance.combinedItem)):
+            instance.delete()
+
 class ItemNutrientViewSet(viewsets.ModelViewSet):
     queryset = ItemNutrient.objects.all()
     serializer_class = serializers.ItemNutrientSerializer
     permission_classes = [IsAuthenticated]
 
+    # Changing an item's nutrients changes the totals of every consumption of it, so update the ledger for those
+    def perform_create(self, serializer):
+        with ledgerUpdate(consumedOfItems([serializer.validated_data['item'].id])):
+            serializer.save()
+
+    def perform_update(self, serializer):
+        items = [serializer.instance.item, serializer.validated_data.get('item', serializer.instance.item)]
+        with ledgerUpdate(consumedOfItems([item.id for item in items])):
+            serializer.save()
+
+    def perform_destroy(self, instance):
+        with ledgerUpdate(consumedOfItems([instance.item_id])):
+            instance.delete()
+
 class ItemBioactiveViewSet(viewsets.ModelViewSet):
     queryset = ItemBioactive.objects.all()
     serializer_class = serializers.ItemBioactiveSerializer
@@ -531,13 +736,15 @@ class FavoriteItemViewSet(viewsets.ModelViewSet):
     serializer_class = serializers.FavoriteItemSerializer
     permission_classes = [IsAuthenticated]
 
-class GoalTemplateViewSet(viewsets.ModelViewSet):
+class GoalTemplateViewSet(CachedResponseMixin, viewsets.ModelViewSet):
     queryset = GoalTemplate.objects.all()
+    cacheVersions = ['goaltemplates']
     serializer_class = serializers.GoalTemplateSerializer
     permission_classes = [permissions.IsAdminUserOrReadOnly]
 
-class GoalTemplateNutrientViewSet(viewsets.ModelViewSet):
+class GoalTemplateNutrientViewSet(CachedResponseMixin, viewsets.ModelViewSet):
     queryset = GoalTemplateNutrient.objects.all()
+    cacheVersions = ['goaltemplatenutrients']
     serializer_class = serializers.GoalTemplateNutrientSerializer
     permission_classes = [permissions.IsAdminUserOrReadOnly]
 
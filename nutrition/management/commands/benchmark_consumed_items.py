@@ -0,0 +1,66 @@
+import statistics
+import time
+from datetime import datetime, timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils import timezone
+from nutrition.models import Consumed, Item, ServingSize, Unit, User
+from nutrition.utils.nutrition_utils import consumedOnDays
+
+# Length of history (in days) at which the queries are timed
+HISTORY_DAYS = [30, 365, 2 * 365, 5 * 365]
+
+# Time a query a number of times, returning the median in milliseconds
+def timeQuery(query, repeat):
+    timings = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        list(query())
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+class Command(BaseCommand):
+    help = "Time listing a user's consumed items for today as their history grows from a month to years (nothing is saved)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--per-day', type=int, default=10, help='Number of consumed items logged each day')
+        parser.add_argument('--others', type=int, default=20, help='Number of other users with the same history, so the table is larger than one user')
+        parser.add_argument('--repeat', type=int, default=50, help='Number of times each query is timed')
+
+    def handle(self, *args, **options):
+        perDay = options['per_day']
+        today = timezone.localdate()
+        table = connection.ops.quote_name(Consumed._meta.db_table)
+
+        # Everything is created in a transaction that is rolled back at the end
+        with transaction.atomic():
+            unit = Unit.objects.create(name='benchmark unit', abbreviation='benchmark unit')
+            item = Item.objects.create(name='Benchmark Item', calories=100, servingSize=ServingSize.objects.create(amount=1, unit=unit))
+            users = [User.objects.create(username=f'consumed-benchmark-{i}') for i in range(options['others'] + 1)]
+            user = users[0]
+
+            self.stdout.write(f'{"Days":>6} {"Rows":>10} {"Range (ms)":>12} {"Date cast (ms)":>15}')
+            loggedDays = 0
+            for days in HISTORY_DAYS:
+                # Log each day back from today until the history is this long, spreading the items over the day
+                for day in range(loggedDays, days):
+                    dayStart = timezone.make_aware(datetime.combine(today - timedelta(days=day), datetime.min.time()))
+                    Consumed.objects.bulk_create([
+                        Consumed(user=other, item=item, portion=1, consumedAt=dayStart + timedelta(hours=8 + i))
+                        for other in users
+                        for i in range(perDay)
+                    ])
+                loggedDays = days
+                with connection.cursor() as cursor:
+                    cursor.execute(f'ANALYZE {table}')
+
+                # The half-open range the views use, and the date cast it replaced
+                rangeMs = timeQuery(lambda: consumedOnDays(user.consumed_set, today, today).values_list('id', 'portion', 'consumedAt'), options['repeat'])
+                castMs = timeQuery(lambda: user.consumed_set.filter(consumedAt__date=today).values_list('id', 'portion', 'consumedAt'), options['repeat'])
+                self.stdout.write(f'{days:>6} {Consumed.objects.count():>10} {rangeMs:>12.2f} {castMs:>15.2f}')
+
+            transaction.set_rollback(True)
+
+        self.stdout.write(self.style.SUCCESS('Done, the benchmark data was rolled back.'))
@@ -0,0 +1,33 @@
+import json
+import os
+from django.core.management.base import BaseCommand
+from tqdm import tqdm
+from nutrition.utils.columnar_utils import writeColumnar
+
+
+# Yield the products of a massaged JSONL file
+def read_products(jsonl_file):
+    with open(jsonl_file, 'r', encoding='utf-8') as file:
+        for line in tqdm(file, disable=None):
+            yield json.loads(line)
+
+
+class Command(BaseCommand):
+    help = 'Convert a massaged JSONL file to the compressed columnar format finalimporter3 can load'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--file', default=os.path.join("data", "fixedData3.jsonl"), help='Path of the massaged JSONL file')
+        parser.add_argument('--output', default=os.path.join("data", "fixedData3.npz"), help='Path of the .npz file to write')
+
+    def handle(self, *args, **options):
+        jsonl_file = os.path.normpath(options['file'])
+        try:
+            count = writeColumnar(options['output'], read_products(jsonl_file))
+            self.stdout.write(self.style.SUCCESS(f'Wrote {count} items to {options["output"]}.'))
+
+        except ImportError:
+            self.stdout.write(self.style.ERROR('The columnar format needs numpy. Install it with pip install numpy.'))
+        except FileNotFoundError:
+            self.stdout.write(self.style.ERROR('JSONL file not found. Please check the file path.'))
+        except Exception as e:
+            self.stdout.write(self.style.ERROR(f'An error occurred: {e}'))
@@ -4,6 +4,7 @@ import csv
 from django.core.management.base import BaseCommand
 from django.db import transaction
 from nutrition.models import Item, ServingSize, Nutrient, Unit, ItemNutrient
+from nutrition.utils.item_utils import internItemServingSizes
 import re
 from tqdm import tqdm
 from langdetect import detect
@@ -173,7 +174,8 @@ class Command(BaseCommand):
             counter = 1
             for items, item_nutrients, serving_sizes in read_items(jsonl_file):
                 with transaction.atomic():
-                    ServingSize.objects.bulk_create(serving_sizes)
+                    # Serving sizes are shared, so use the existing row for each amount and unit
+                    internItemServingSizes(items)
                     Item.objects.bulk_create(items)
                     ItemNutrient.objects.bulk_create(item_nutrients)
                     self.stdout.write(self.style.NOTICE("Batch " + str(counter) + " of 206 imported."))
@@ -1,174 +1,213 @@
 import os
-import json
-import csv
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from django.core.management.base import BaseCommand
-from django.db import transaction
+from django.db import connection, transaction
+from django.utils import timezone
 from nutrition.models import Item, ServingSize, Nutrient, Unit, ItemNutrient
-import re
-from tqdm import tqdm
-from langdetect import detect
-
-
-
-
-
+from nutrition.utils.cache_utils import invalidateBarcodes
+from nutrition.utils.columnar_utils import readColumnar
+from nutrition.utils.copy_utils import copyRows, reserveIds
+from nutrition.utils.import_utils import batchWriter, importBatches, parseChunk, readChunks, recordHash
+from nutrition.utils.item_utils import servingKey
+from nutrition.utils.ledger_utils import consumedOfItems, ledgerUpdate
+from nutrition.utils.rollup_utils import refreshCombinedItemTotalsForItems
+
+# Number of barcodes or IDs the upsert puts in one IN (...) list, well below every database's bind parameter limit
+LOOKUP_CHUNK_SIZE = 500
+
+# Lookups of units by lowercase name or abbreviation and of nutrients by name, loaded once per import
 def getUnits():
-    units = Unit.objects.all()
-    unitList = []
-    for unit in units:
-        unitList.append(unit)
-    return unitList
+    units = {}
+    for unit in Unit.objects.all():
+        for key in (unit.name, unit.abbreviation):
+            if key:
+                units.setdefault(key.lower(), unit)
+    return units
 
 def getNutrients():
-    nutrients = Nutrient.objects.all()
-    nutrientList = []
-    for nutrient in nutrients:
-        nutrientList.append(nutrient)
-    return nutrientList
-
-def parseServings(servingSize):
-    numPart = ""
-    unitPart = ""
-    for i in range(len(servingSize)):
-        if servingSize[i].isalpha():
-            unitPart += servingSize[i]
-        else:
-            numPart += servingSize[i]
-    return numPart, unitPart
-
-def checkUnitsForMatch(unit, unitList):
-    unit_lower = unit.lower()
-    for unitObj in unitList:
-        if unitObj.name.lower()  == unit_lower or unitObj.abbreviation.lower() == unit_lower:
-            return unitObj
-    return None
-
-def checkNutrientsForMatch(nutrient, nutrientList):
-    for nutrientObj in nutrientList:
-        if nutrientObj.name == nutrient:
-            return nutrientObj
-
-
-def read_items(jsonl_file,batch_size=1000):
+    return {nutrient.name: nutrient for nutrient in Nutrient.objects.all()}
+
+# Lookup of the shared serving sizes by amount and unit ID, loaded once per import
+# Serving sizes are interned: items with the same amount and unit all point at the same row
+def getServingSizes():
+    return {servingKey(servingSize.amount, servingSize.unit_id): servingSize for servingSize in ServingSize.objects.all()}
+
+#if the unit is not in the unit table already we will need to create a new entry for that unit otherwise we will just use the existing one
+def getUnit(unit, units):
+    unitObj = units.get(unit.lower())
+    if unitObj is None:
+        unitObj, created = Unit.objects.get_or_create(
+            name=unit,
+            abbreviation=unit
+        )
+        units[unit.lower()] = unitObj
+    return unitObj
+
+# Reuse the serving size with the same amount and unit, creating it the first time it is seen
+def getServingSize(amount, unit, servingSizes):
+    key = servingKey(amount, unit.id)
+    servingSize = servingSizes.get(key)
+    if servingSize is None:
+        servingSize, created = ServingSize.objects.get_or_create(amount=key[0], unit=unit)
+        servingSizes[key] = servingSize
+    return servingSize
+
+# Turn parsed item records into model objects, resolving units, serving sizes and nutrients from the preloaded lookups
+def build_items(records, units, nutrients, servingSizes):
     items = []
     item_nutrients = []
-    serving_sizes = []
-    nutrients = getNutrients()
-    units = getUnits()
-    with open(jsonl_file,'r',encoding='utf-8') as file:
-        for food_item in file:
-            #load item into dictionary
-            data = json.loads(food_item)
-            #get the two options for serving size
-            serving_size,unit = "",""
-            serving_size_grams = data.get('serving_size_grams')
-            serving_size_other = data.get('serving_size_other')
-            #determine if the alternate serving size exists and if it does use that one otherwise use grams
-            if serving_size_other == None:
-                serving_size = serving_size_grams
-                serving_size,unit = parseServings(serving_size)
-            else:
-                serving_size = serving_size_other
-                if "kcal" in serving_size:
-                    serving_size = serving_size_grams
-                serving_size,unit = parseServings(serving_size)
-            #if the unit is not in the unit table already we will need to create a new entry for that unit otherwise we will just use the existing one
-            unitAbbreviation = ""
-            # if unit in units:
-            #     unitAbbreviation = units.get(unit)
-            # else:
-            #     unitAbbreviation = unit
-            unitObj = checkUnitsForMatch(unit, units)
-            if unitObj is None:
-                unitObj, created = Unit.objects.get_or_create(
-                    name=unit,
-                    abbreviation=unit
-                )
-                units.append(unitObj)
-            #if unit is already in the table we will just use that one otherwise we will create a new entry for that unit
-            #create the serving size and add it to the list of serving sizes
-            if serving_size == "" or serving_size == None:
-                continue
-            try:
-                serving_size = round(float(serving_size),2)
-                if serving_size >= 10**5:
-                    continue
-            except:
-                continue
-            servingSize = ServingSize(
-                amount=serving_size,
-                unit=unitObj
-            )
-            serving_sizes.append(servingSize)
-            #create the item and add it to the list of items
-            calories=data.get('calories')
-            if calories is None:
+    for record in records:
+        barcode, name, calories, servingAmount, servingUnit, itemNutrients = record
+        item = Item(
+            barcode=barcode,
+            name=name,
+            servingSize=getServingSize(servingAmount, getUnit(servingUnit, units), servingSizes),
+            calories=calories,
+            importHash=recordHash(record)
+        )
+        items.append(item)
+        for nutrient_name, amountPerServing, unit in itemNutrients:
+            # Nutrient units aren't stored on ItemNutrient, but are added to the unit table like the serving units
+            if unit:
+                getUnit(unit, units)
+            nutrient = nutrients.get(nutrient_name)
+            if nutrient is None:
                 continue
-            item = Item(
-                barcode=data.get('barcode'),
-                name=data.get('name'),
-                servingSize=servingSize,
-                calories=data.get('calories')
-            )
-            items.append(item)
-            #parse the nutrients and add them to the list of item nutrients (units should already be in the unit table)
-            #nutrients is a dictionary whose key is a nutrient name and value is another dictionary containing the amount per serving and the unit
-            nutrientsDic = data.get('nutrients')
-            for nutrient_name in nutrientsDic.keys():
-                #forgot to remove these two from the data cleaning script
-                values = nutrientsDic.get(nutrient_name)
-                amountPerServing = values.get('amount_per_serving')
-                unit = values.get('unit')
-                if amountPerServing > 10**5:
+            item_nutrients.append(ItemNutrient(
+                item=item,
+                nutrient=nutrient,
+                amount=amountPerServing
+            ))
+    return items, item_nutrients
+
+# Parse the JSONL file in worker processes and yield the parsed records in file order, one batch at a time
+# At most twice as many batches as workers are read ahead of the writer, which keeps memory use flat
+def read_items(jsonl_file, workers, batch_size=1000):
+    with open(jsonl_file, 'r', encoding='utf-8') as file, ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for chunk in readChunks(file, batch_size):
+            pending.append(executor.submit(parseChunk, chunk))
+            if len(pending) >= workers * 2:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+# Write a batch of records with bulk_create, returning the number of items and rows written
+def write_batch_orm(records, units, nutrients, servingSizes):
+    with transaction.atomic():
+        items, item_nutrients = build_items(records, units, nutrients, servingSizes)
+        Item.objects.bulk_create(items)
+        ItemNutrient.objects.bulk_create(item_nutrients)
+    return len(items), len(items) + len(item_nutrients)
+
+# Write a batch of records with COPY (PostgreSQL only), returning the number of items and rows written
+# Item IDs are reserved up front so item nutrients can reference them without reading them back
+def write_batch_copy(records, units, nutrients, servingSizes):
+    with transaction.atomic(), connection.cursor() as cursor:
+        itemIds = reserveIds(cursor, Item, len(records))
+
+        items = []
+        item_nutrients = []
+        for itemId, record in zip(itemIds, records):
+            barcode, name, calories, servingAmount, servingUnit, itemNutrients = record
+            servingSize = getServingSize(servingAmount, getUnit(servingUnit, units), servingSizes)
+            items.append((itemId, name, barcode, int(calories), servingSize.id, False, recordHash(record)))
+            for nutrient_name, amountPerServing, unit in itemNutrients:
+                if unit:
+                    getUnit(unit, units)
+                nutrient = nutrients.get(nutrient_name)
+                if nutrient is None:
                     continue
-                #same as the last creation of unit objects, if its in there well use it otherwise we will create a new one
-                unitObj = checkUnitsForMatch(unit, units)
-                if unitObj is None:
-                    unitObj, created = Unit.objects.get_or_create(
-                        name=unit,
-                        abbreviation=unit
-                    )
-                    units.append(unitObj)
-                #another example of checking for an object and creating it otherwise (sort of defeats the purpose of the generator but oh well)
-                if nutrient_name == "Carbohydrates":
-                    nutrient_name = "Carbohydrate"
-                nutrient = Nutrient.objects.get(name=nutrient_name)
-
-                item_nutrient = ItemNutrient(
-                    item=item,  # This will be set after saving items
-                    nutrient=nutrient,
-                    amount=amountPerServing
-                )
-                item_nutrients.append(item_nutrient)
-            #yielding items will significantly reduce the memory usage (generator)
-            if(len(items) >= batch_size):
-                yield items, item_nutrients, serving_sizes
-                items = []
-                item_nutrients = []
-                serving_sizes = []
-        if items:
-            yield items, item_nutrients, serving_sizes
+                item_nutrients.append((itemId, nutrient.id, amountPerServing))
+
+        copyRows(cursor, Item, ['id', 'name', 'barcode', 'calories', 'servingSize', 'isCustom', 'importHash'], items)
+        copyRows(cursor, ItemNutrient, ['item', 'nutrient', 'amount'], item_nutrients)
+    return len(items), len(items) + len(item_nutrients)
+
+# Insert or update a batch of records keyed by barcode, returning the number of items and rows written
+# Unchanged products (same record hash) are skipped, records without a barcode are skipped, and custom items are never touched
+def write_batch_upsert(records, units, nutrients, servingSizes):
+    # If a barcode appears more than once, the last record wins
+    recordsByBarcode = {record[0]: record for record in records if record[0]}
+    hashes = {barcode: recordHash(record) for barcode, record in recordsByBarcode.items()}
+
+    with transaction.atomic():
+        existing = {}
+        barcodes = list(recordsByBarcode)
+        for start in range(0, len(barcodes), LOOKUP_CHUNK_SIZE):
+            for item in Item.objects.filter(barcode__in=barcodes[start:start + LOOKUP_CHUNK_SIZE], isCustom=False):
+                existing.setdefault(item.barcode, []).append(item)
+
+        newRecords = [record for barcode, record in recordsByBarcode.items() if barcode not in existing]
+        itemCount, rowCount = write_batch_orm(newRecords, units, nutrients, servingSizes) if newRecords else (0, 0)
+
+        # Update every imported item with a changed barcode record in place, replacing its nutrients
+        # Serving sizes are shared, so a changed serving size points the item at another one rather than editing it
+        changedItems = [item for barcode, items in existing.items() for item in items if item.importHash != hashes[barcode]]
+        item_nutrients = []
+        now = timezone.now()
+        for item in changedItems:
+            barcode, name, calories, servingAmount, servingUnit, itemNutrients = recordsByBarcode[item.barcode]
+            item.name = name
+            item.calories = calories
+            item.importHash = hashes[barcode]
+            item.nutrientsChangedAt = now
+            item.servingSize = getServingSize(servingAmount, getUnit(servingUnit, units), servingSizes)
+            for nutrient_name, amountPerServing, unit in itemNutrients:
+                if unit:
+                    getUnit(unit, units)
+                nutrient = nutrients.get(nutrient_name)
+                if nutrient is not None:
+                    item_nutrients.append(ItemNutrient(item=item, nutrient=nutrient, amount=amountPerServing))
+
+        if changedItems:
+            itemIds = [item.id for item in changedItems]
+            # The new calories and nutrients change past consumption of the items and of combined items containing them,
+            # so update the daily nutrient ledger around the writes (and the combined item totals, which bulk writes don't refresh)
+            with ledgerUpdate(consumedOfItems(itemIds)):
+                Item.objects.bulk_update(changedItems, ['name', 'calories', 'importHash', 'servingSize', 'nutrientsChangedAt'])
+                # Delete with plain statements rather than loading each row to send delete signals (the barcode cache is cleared below instead)
+                quote = connection.ops.quote_name
+                with connection.cursor() as cursor:
+                    for start in range(0, len(itemIds), LOOKUP_CHUNK_SIZE):
+                        chunk = itemIds[start:start + LOOKUP_CHUNK_SIZE]
+                        cursor.execute(
+                            f'DELETE FROM {quote(ItemNutrient._meta.db_table)} WHERE {quote(ItemNutrient._meta.get_field("item").column)} IN ({", ".join(["%s"] * len(chunk))})',
+                            chunk)
+                ItemNutrient.objects.bulk_create(item_nutrients)
+                refreshCombinedItemTotalsForItems(itemIds)
+
+    # Bulk writes skip the item signals, so drop cached lookups for every new or changed barcode
+    invalidateBarcodes([record[0] for record in newRecords] + [item.barcode for item in changedItems])
+
+    return itemCount + len(changedItems), rowCount + len(changedItems) + len(item_nutrients)
 
 
 class Command(BaseCommand):
     help = 'Import item data from a JSONL file'
 
+    def add_arguments(self, parser):
+        parser.add_argument('--file', default=os.path.join("data", "fixedData3.jsonl"), help='Path of the JSONL file (or .npz columnar file, see columnardata) to import')
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Number of processes used to parse the file')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Number of lines parsed and written at a time')
+        parser.add_argument('--method', choices=['orm', 'copy'], default='orm', help='Write rows with bulk_create or with COPY (PostgreSQL with psycopg 3 only)')
+        parser.add_argument('--upsert', action='store_true', help='Update existing items with the same barcode instead of inserting duplicates, skipping unchanged items')
+
     def handle(self, *args, **options):
+        write_batch = batchWriter(self, options)
+
         # Define the relative path to JSONL file
         self.stdout.write(self.style.NOTICE('Starting import...'))
-        jsonl_file = os.path.normpath(os.path.join("data", "fixedData3.jsonl"))
+        jsonl_file = os.path.normpath(options['file'])
         try:
-            counter = 1
-            for items, item_nutrients, serving_sizes in read_items(jsonl_file):
-                with transaction.atomic():
-                    ServingSize.objects.bulk_create(serving_sizes)
-                    Item.objects.bulk_create(items)
-                    ItemNutrient.objects.bulk_create(item_nutrients)
-                    self.stdout.write(self.style.NOTICE("Batch " + str(counter) + " of 206 imported."))
-                    counter += 1
-
-
-            self.stdout.write(self.style.SUCCESS('Successfully imported data.'))
+            # Columnar files are read in the main process, parsing them in workers wouldn't be any faster
+            if jsonl_file.endswith('.npz'):
+                batches = readColumnar(jsonl_file, options['batch_size'])
+            else:
+                batches = read_items(jsonl_file, options['workers'], options['batch_size'])
+            importBatches(self, write_batch, batches)
 
         except FileNotFoundError:
             self.stdout.write(self.style.ERROR('JSONL file not found. Please check the file path.'))
@@ -4,6 +4,7 @@ import csv
 from django.core.management.base import BaseCommand
 from django.db import transaction
 from nutrition.models import Item, ServingSize, Nutrient, Unit, ItemNutrient
+from nutrition.utils.item_utils import internItemServingSizes
 import re
 from tqdm import tqdm
 from langdetect import detect
@@ -30,10 +31,6 @@ def parseServingSize(servingSize):
         else:
             numPart += servingSize[i]
 
-def parseNutrientsDict(nutrientsDict):
-    for key,value in nutrientsDict.items():
-        
-
 class Command(BaseCommand):
     help = 'Import item data from a JSONL file'
 
@@ -78,8 +75,9 @@ class Command(BaseCommand):
                         item_nutrients.append(item_nutrient)
             with transaction.atomic():
                 print('Writing serving sizes to database...')
-                # Bulk create all the serving sizes
-                ServingSize.objects.bulk_create(serving_sizes, batch_size=1000)
+                # Serving sizes are shared, so use the existing row for each amount and unit (a batch at a time)
+                for start in range(0, len(items), 1000):
+                    internItemServingSizes(items[start:start + 1000])
                 print('Done.')
                 print('Writing items to database...')
                 # Bulk create all the items and save the returned objects
@@ -1,75 +1,58 @@
-import os
 import json
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from django.core.management.base import BaseCommand
-from django.db import transaction
-from nutrition.models import Item, ServingSize, Nutrient, Unit, ItemNutrient
-import re
 from tqdm import tqdm
-from langdetect import detect
-
+from nutrition.utils.import_utils import byteRanges, massageRange
 
-def isAllZero(code):
-    for i in code:
-        if i != '0':
-            return False
-    return True
 
-def isServing(size):
-    return None
+# Massage byte ranges of the file in worker processes and yield each range's results in file order
+# At most twice as many ranges as workers are read ahead of the writer, which keeps memory use flat
+def massage_file(jsonl_file, workers, chunk_size):
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for start, end in byteRanges(jsonl_file, chunk_size):
+            pending.append((end - start, executor.submit(massageRange, jsonl_file, start, end)))
+            if len(pending) >= workers * 2:
+                size, future = pending.popleft()
+                yield (size,) + future.result()
+        while pending:
+            size, future = pending.popleft()
+            yield (size,) + future.result()
 
-def parse_float_from_string(input_string):
-    match = re.match(r'^\d*\.?\d+', input_string)
-    if match:
-        return float(match.group())
-    else:
-        raise ValueError("No leading number found in string")
 
 class Command(BaseCommand):
-    help = 'Import item data from a JSONL file'
+    help = 'Massage the OpenFoodFacts JSONL dump into a smaller file of English products with the data we use'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--file', default=os.path.join("data", "openfoodfacts-products.jsonl"), help='Path of the OpenFoodFacts JSONL dump')
+        parser.add_argument('--output', default="massagedData.jsonl", help='Path of the massaged JSONL file to write')
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Number of processes used to massage the file')
+        parser.add_argument('--chunk-size', type=int, default=16, help='Size in MB of the part of the file each worker reads at a time')
 
     def handle(self, *args, **options):
-        # Define the relative path to CSV file
-        jsonl_file = os.path.normpath(os.path.join("data", "openfoodfacts-products.jsonl"))
-        dataFile = open("massagedData.jsonl", "w")
+        jsonl_file = os.path.normpath(options['file'])
 
         try:
-            # Open the CSV file and read its contents
-            with open(jsonl_file,'r',encoding='utf-8') as file:
-                for food_item in tqdm(file,total=2980745):
-                    # Load the JSON data from each line
-                    data = json.loads(food_item)
-                    product_name = data.get('product_name')
-                    if product_name:
-                        try:
-                            language = detect(product_name)
-                        except:
-                            continue
-                        if language != 'en':
-                            continue
-                    # Skip items with missing data
-                    if isAllZero(data.get('code')) or data.get('product_name') is None or data.get('product_name') == '' or data.get('nutriments') is None or data.get('serving_size') is None or data.get('nutriments').get('energy-kcal_100g') is None:
-                        continue
-                    serving_size_amount = data.get('serving_size')
-                    massaged_data = {}
-                    massaged_data['code'] = data.get('code')
-                    massaged_data['product_name'] = data.get('product_name')
-                    nutrients = data.get('nutriments')
-                    nutrientsDict = {}
-                    for key,value in nutrients.items():
-                        nutrient_name = key  # e.g., 'sugar'
-                        v = value
-                        nutrientsDict[nutrient_name] = v
-                    massaged_data['nutrients'] = nutrientsDict
-                    massaged_data['calories'] = data.get('nutriments').get('energy-kcal_100g')
-                    massaged_data['serving_size'] = serving_size_amount
-                    dataFile.write(json.dumps(massaged_data))
-                    dataFile.write("\n")
+            lineCount = 0
+            keptCount = 0
+            start = time.monotonic()
+            with open(options['output'], 'w', encoding='utf-8') as dataFile, tqdm(total=os.path.getsize(jsonl_file), unit='B', unit_scale=True) as progress:
+                for size, products, rangeLineCount in massage_file(jsonl_file, options['workers'], options['chunk_size'] * 1024 * 1024):
+                    for product in products:
+                        dataFile.write(json.dumps(product))
+                        dataFile.write("\n")
+                    lineCount += rangeLineCount
+                    keptCount += len(products)
+                    progress.update(size)
+                    progress.set_postfix(lines=lineCount, kept=keptCount, rate=f'{lineCount / (time.monotonic() - start):.0f} lines/s')
+
+            elapsed = time.monotonic() - start
+            self.stdout.write(self.style.SUCCESS(f'Kept {keptCount} of {lineCount} products in {elapsed:.0f} seconds ({lineCount / max(elapsed, 1e-9):.0f} lines/sec).'))
 
         except FileNotFoundError:
             self.stdout.write(self.style.ERROR('JSONL file not found. Please check the file path.'))
         except Exception as e:
             self.stdout.write(self.style.ERROR(f'An error occurred: {e}'))
-        finally:
-            dataFile.close()
-
-    print("Done")
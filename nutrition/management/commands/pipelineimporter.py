@@ -0,0 +1,71 @@
+import os
+from contextlib import ExitStack
+from django.core.management.base import BaseCommand, CommandError
+from nutrition.management.commands.massagedata import massage_file
+from nutrition.models import Nutrient
+from nutrition.utils.import_utils import batchWriter, importBatches, normalizeNutrients, parseProducts, splitServingSizes, teeStage
+
+# Stages whose products can be written to disk with --tee, in pipeline order
+STAGES = ['massaged', 'servings', 'normalized']
+
+
+# Yield the massaged products of the dump in file order, massaging byte ranges in worker processes
+def massaged_products(jsonl_file, workers, chunk_size):
+    for size, products, lineCount in massage_file(jsonl_file, workers, chunk_size):
+        yield from products
+
+# Group records into lists of batch_size for the writers
+def batches(records, batch_size):
+    batch = []
+    for record in records:
+        batch.append(record)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class Command(BaseCommand):
+    help = 'Massage, clean, and import the OpenFoodFacts JSONL dump in one pass, without writing intermediate files'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--file', default=os.path.join("data", "openfoodfacts-products.jsonl"), help='Path of the OpenFoodFacts JSONL dump')
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Number of processes used to massage the dump')
+        parser.add_argument('--chunk-size', type=int, default=16, help='Size in MB of the part of the dump each worker reads at a time')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Number of items written at a time')
+        parser.add_argument('--method', choices=['orm', 'copy'], default='orm', help='Write rows with bulk_create or with COPY (PostgreSQL with psycopg 3 only)')
+        parser.add_argument('--upsert', action='store_true', help='Update existing items with the same barcode instead of inserting duplicates, skipping unchanged items')
+        parser.add_argument('--tee', action='append', default=[], metavar='STAGE=PATH', help=f'Also write the products of a stage ({", ".join(STAGES)}) to a JSONL file, can be repeated')
+
+    def handle(self, *args, **options):
+        write_batch = batchWriter(self, options)
+
+        tees = {}
+        for tee in options['tee']:
+            stage, sep, path = tee.partition('=')
+            if stage not in STAGES or not path:
+                raise CommandError(f'Invalid --tee "{tee}", expected STAGE=PATH with STAGE one of {", ".join(STAGES)}.')
+            tees[stage] = path
+
+        self.stdout.write(self.style.NOTICE('Starting import...'))
+        jsonl_file = os.path.normpath(options['file'])
+        try:
+            nutrientUnits = dict(Nutrient.objects.values_list('name', 'unit__abbreviation'))
+
+            with ExitStack() as stack:
+                # Chain the stages, teeing any requested ones to disk as they pass through
+                def tee(stage, products):
+                    if stage not in tees:
+                        return products
+                    return teeStage(products, stack.enter_context(open(tees[stage], 'w', encoding='utf-8')))
+
+                products = tee('massaged', massaged_products(jsonl_file, options['workers'], options['chunk_size'] * 1024 * 1024))
+                products = tee('servings', splitServingSizes(products))
+                products = tee('normalized', normalizeNutrients(products, nutrientUnits))
+                importBatches(self, write_batch, batches(parseProducts(products), options['batch_size']))
+
+        except FileNotFoundError:
+            self.stdout.write(self.style.ERROR('JSONL file not found. Please check the file path.'))
+        except Exception as e:
+            self.stdout.write(self.style.ERROR(f'An error occurred: {e}'))
@@ -0,0 +1,51 @@
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from nutrition.models import Consumed, DailyNutrientTotal
+from nutrition.utils.ledger_utils import calculateDailyTotals, ledgerKey
+from nutrition.utils.nutrition_utils import CALORIES_ID
+
+# Ledger amounts that differ from the recomputed totals by less than this are not counted as drift
+TOLERANCE = Decimal('0.01')
+
+class Command(BaseCommand):
+    help = 'Rebuild the daily nutrient ledger from consumption history and report any drift'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true', help='Only report drift, do not rewrite the ledger')
+
+    def handle(self, *args, **options):
+        driftedUsers = 0
+        driftedRows = 0
+
+        # Rebuild one user at a time to keep memory flat
+        userIds = set(Consumed.objects.values_list('user', flat=True).distinct()) | set(DailyNutrientTotal.objects.values_list('user', flat=True).distinct())
+
+        for userId in sorted(userIds):
+            expected = calculateDailyTotals(Consumed.objects.filter(user_id=userId))
+            ledger = {ledgerKey(dailyTotal): dailyTotal.amount for dailyTotal in DailyNutrientTotal.objects.filter(user_id=userId)}
+
+            # Compare every key in either set, treating a missing row as zero
+            drift = [key for key in expected.keys() | ledger.keys() if abs(expected.get(key, 0) - ledger.get(key, 0)) >= TOLERANCE]
+            if not drift:
+                continue
+
+            driftedUsers += 1
+            driftedRows += len(drift)
+            self.stdout.write(self.style.WARNING(f'User {userId}: {len(drift)} ledger rows drifted'))
+
+            if not options['check']:
+                with transaction.atomic():
+                    DailyNutrientTotal.objects.filter(user_id=userId).delete()
+                    DailyNutrientTotal.objects.bulk_create([
+                        DailyNutrientTotal(user_id=userId, date=day, nutrient_id=(None if nutrientId == CALORIES_ID else nutrientId), amount=amount)
+                        for (_, day, nutrientId), amount in expected.items()
+                    ])
+
+        if not driftedRows:
+            self.stdout.write(self.style.SUCCESS('Ledger matches consumption history.'))
+        elif options['check']:
+            self.stdout.write(self.style.ERROR(f'Found {driftedRows} drifted rows for {driftedUsers} users. Run without --check to rebuild.'))
+        else:
+            self.stdout.write(self.style.SUCCESS(f'Rebuilt ledger for {driftedUsers} users ({driftedRows} drifted rows).'))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from nutrition.utils.vector_utils import buildVectors, vectorDir
+
+class Command(BaseCommand):
+    help = 'Build the dense nutrient vector of every item (needs numpy)'
+
+    def handle(self, *args, **options):
+        try:
+            itemCount = buildVectors()
+        except ImportError:
+            self.stdout.write(self.style.ERROR('Nutrient vectors need numpy. Install it with pip install numpy.'))
+            return
+
+        self.stdout.write(self.style.SUCCESS(f'Built nutrient vectors for {itemCount} items in {vectorDir()}.'))
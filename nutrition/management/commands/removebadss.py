@@ -6,6 +6,7 @@ from nutrition.models import Item, ServingSize, Nutrient, Unit, ItemNutrient
 import re
 from tqdm import tqdm
 from langdetect import detect
+from nutrition.utils.import_utils import parse_serving_size
 
 
 def isAllZero(code):
@@ -26,19 +27,7 @@ def parse_float_from_string(input_string):
         return float(match.group())
     else:
         raise ValueError("No leading number found in string")
-    
-def parse_serving_size(serving_size_str):
-    # Regex pattern to match serving size in grams and in parentheses
-    pattern = r'(\d+g) \(([^)]+)\)'
-    match = re.search(pattern, serving_size_str)
-    print(match)
-    if match:
-        serving_size_grams = match.group(1)
-        serving_size_parentheses = match.group(2)
-        return serving_size_grams, serving_size_parentheses
-    else:
-        return None, None
-    
+
 
 class Command(BaseCommand):
     help = 'Import item data from a JSONL file'
@@ -0,0 +1,33 @@
+# Generated by Django 4.2.5 on 2026-10-18 11:47
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('nutrition', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyNutrientTotal',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('amount', models.DecimalField(decimal_places=4, default=0, max_digits=14)),
+                ('nutrient', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='nutrition.nutrient')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='dailynutrienttotal',
+            constraint=models.UniqueConstraint(fields=('user', 'date', 'nutrient'), name='unique_daily_nutrient_total'),
+        ),
+        migrations.AddConstraint(
+            model_name='dailynutrienttotal',
+            constraint=models.UniqueConstraint(condition=models.Q(('nutrient__isnull', True)), fields=('user', 'date'), name='unique_daily_calorie_total'),
+        ),
+    ]
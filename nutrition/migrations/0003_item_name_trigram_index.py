@@ -0,0 +1,27 @@
+from django.db import migrations
+
+
+# Item name searches filter with icontains, which PostgreSQL runs as UPPER(name::text) LIKE UPPER(...)
+# A trigram GIN index on that expression lets those filters use an index instead of scanning every item
+# The index needs pg_trgm, so other databases (e.g., SQLite for local tests) skip it
+def createNameTrigramIndex(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    schema_editor.execute('CREATE INDEX IF NOT EXISTS nutrition_item_name_trgm ON nutrition_item USING gin (UPPER(name::text) gin_trgm_ops)')
+
+def dropNameTrigramIndex(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('DROP INDEX IF EXISTS nutrition_item_name_trgm')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('nutrition', '0002_dailynutrienttotal'),
+    ]
+
+    operations = [
+        migrations.RunPython(createNameTrigramIndex, dropNameTrigramIndex),
+    ]
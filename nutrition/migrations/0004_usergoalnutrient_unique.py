@@ -0,0 +1,25 @@
+# Generated by Django 4.2.5 on 2026-10-18 11:52
+
+from django.db import migrations, models
+from django.db.models import Max
+
+
+# Keep only the most recent UserGoalNutrient for each goal and nutrient so the unique constraint can be added
+def removeDuplicateGoalNutrients(apps, schema_editor):
+    UserGoalNutrient = apps.get_model('nutrition', 'UserGoalNutrient')
+    latestIds = UserGoalNutrient.objects.values('goal', 'nutrient').annotate(latestId=Max('id')).values('latestId')
+    UserGoalNutrient.objects.exclude(id__in=latestIds).delete()
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('nutrition', '0003_item_name_trigram_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(removeDuplicateGoalNutrients, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='usergoalnutrient',
+            constraint=models.UniqueConstraint(fields=('goal', 'nutrient'), name='unique_user_goal_nutrient'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.5 on 2026-10-18 11:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('nutrition', '0004_usergoalnutrient_unique'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='item',
+            name='importHash',
+            field=models.CharField(blank=True, max_length=64, null=True),
+        ),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 4.2.5 on 2026-10-18 12:07
+
+from django.db import migrations, models
+from django.db.models import DecimalField, F, Sum
+import django.db.models.deletion
+
+
+# Store the totals of every existing combined item, a batch at a time
+# They are computed here from the historical models, since rollup_utils works with the current ones
+def addCombinedItemTotals(apps, schema_editor):
+    CombinedItem = apps.get_model('nutrition', 'CombinedItem')
+    CombinedItemElement = apps.get_model('nutrition', 'CombinedItemElement')
+    CombinedItemTotal = apps.get_model('nutrition', 'CombinedItemTotal')
+    totalField = DecimalField(max_digits=20, decimal_places=4)
+
+    combinedItemIds = list(CombinedItem.objects.values_list('id', flat=True))
+    for start in range(0, len(combinedItemIds), 1000):
+        elements = CombinedItemElement.objects.filter(combinedItem__in=combinedItemIds[start:start + 1000])
+        calories = elements.values('combinedItem').annotate(total=Sum(F('portion') * F('item__calories'), output_field=totalField))
+        nutrients = elements.filter(item__itemnutrient__isnull=False).values('combinedItem', 'item__itemnutrient__nutrient').annotate(
+            total=Sum(F('portion') * F('item__itemnutrient__amount'), output_field=totalField))
+
+        # Calories are stored with a null nutrient
+        totals = [CombinedItemTotal(combinedItem_id=row['combinedItem'], nutrient=None, amount=row['total']) for row in calories]
+        totals += [CombinedItemTotal(combinedItem_id=row['combinedItem'], nutrient_id=row['item__itemnutrient__nutrient'], amount=row['total']) for row in nutrients]
+        CombinedItemTotal.objects.bulk_create(totals)
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('nutrition', '0005_item_importhash'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CombinedItemTotal',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('amount', models.DecimalField(decimal_places=4, default=0, max_digits=14)),
+                ('combinedItem', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='nutrition.combineditem')),
+                ('nutrient', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='nutrition.nutrient')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='combineditemtotal',
+            constraint=models.UniqueConstraint(fields=('combinedItem', 'nutrient'), name='unique_combined_item_total'),
+        ),
+        migrations.AddConstraint(
+            model_name='combineditemtotal',
+            constraint=models.UniqueConstraint(condition=models.Q(('nutrient__isnull', True)), fields=('combinedItem',), name='unique_combined_item_calorie_total'),
+        ),
+        migrations.RunPython(addCombinedItemTotals, migrations.RunPython.noop),
+    ]
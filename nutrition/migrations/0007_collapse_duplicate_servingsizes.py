@@ -0,0 +1,27 @@
+# Generated by Django 4.2.5 on 2026-10-18 16:05
+
+from django.db import migrations
+from django.db.models import Count, Min
+
+
+# Point the items of every duplicate serving size at the oldest one with the same amount and unit, then delete the rest
+def collapseDuplicateServingSizes(apps, schema_editor):
+    ServingSize = apps.get_model('nutrition', 'ServingSize')
+    Item = apps.get_model('nutrition', 'Item')
+    duplicates = ServingSize.objects.values('amount', 'unit').annotate(keptId=Min('id'), count=Count('id')).filter(count__gt=1)
+    for duplicate in duplicates.iterator():
+        Item.objects.filter(servingSize__amount=duplicate['amount'], servingSize__unit=duplicate['unit']).exclude(servingSize=duplicate['keptId']).update(servingSize=duplicate['keptId'])
+    # Nothing points at the duplicates anymore, so the cascade to items deletes nothing
+    keptIds = ServingSize.objects.values('amount', 'unit').annotate(keptId=Min('id')).values('keptId')
+    ServingSize.objects.exclude(id__in=keptIds).delete()
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('nutrition', '0006_combineditemtotal'),
+    ]
+
+    # The unique constraint is added by the next migration, since PostgreSQL can't alter the table in the transaction that repointed its rows
+    operations = [
+        migrations.RunPython(collapseDuplicateServingSizes, migrations.RunPython.noop),
+    ]
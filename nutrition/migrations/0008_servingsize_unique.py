@@ -0,0 +1,17 @@
+# Generated by Django 4.2.5 on 2026-10-18 16:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('nutrition', '0007_collapse_duplicate_servingsizes'),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name='servingsize',
+            constraint=models.UniqueConstraint(fields=('amount', 'unit'), name='unique_serving_size'),
+        ),
+    ]
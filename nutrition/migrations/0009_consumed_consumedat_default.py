@@ -0,0 +1,19 @@
+# Generated by Django 4.2.5 on 2026-10-18 12:18
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('nutrition', '0008_servingsize_unique'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='consumed',
+            name='consumedAt',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.5 on 2026-10-18 12:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('nutrition', '0009_consumed_consumedat_default'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='consumed',
+            index=models.Index(fields=['user', 'consumedAt'], name='consumed_user_consumedat_idx'),
+        ),
+    ]
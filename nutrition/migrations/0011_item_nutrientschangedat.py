@@ -0,0 +1,18 @@
+# Generated by Django 4.2.5 on 2026-10-18 12:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('nutrition', '0010_consumed_user_consumedat_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='item',
+            name='nutrientsChangedAt',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -1,6 +1,7 @@
 from django.contrib.auth.models import AbstractUser, Group, Permission
 from django.core import exceptions, validators
 from django.db import models
+from django.utils import timezone
 
 class User(AbstractUser):
     # age is in years
@@ -45,6 +46,11 @@ class ServingSize(models.Model):
     amount = models.DecimalField(max_digits=8, decimal_places=2, validators=[validators.MinValueValidator(0.01)])
     unit = models.ForeignKey(Unit, on_delete=models.CASCADE)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['amount', 'unit'], name='unique_serving_size'),
+        ]
+
     def __str__(self):
         return f"{self.amount} {self.unit}"
 
@@ -66,6 +72,8 @@ class Item(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True) # Creator of item (if applicable)
     favoritedBy = models.ManyToManyField(User, through='FavoriteItem', related_name='favorites')
     isCustom = models.BooleanField(default=False)
+    importHash = models.CharField(max_length=64, null=True, blank=True) # Hash of the imported record, used to skip unchanged items when re-importing
+    nutrientsChangedAt = models.DateTimeField(null=True, blank=True) # Last change to the item's nutrients, used to skip nutrient vectors built before it
 
     def save(self, *args, **kwargs): # Need args and kwargs for save to work when called elsewhere (e.g., within create() method)
         if self.user:
@@ -86,9 +94,14 @@ class Consumed(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     item = models.ForeignKey(Item, on_delete=models.CASCADE, null=True, blank=True)
     combinedItem = models.ForeignKey(CombinedItem, on_delete=models.CASCADE, null=True, blank=True)
-    consumedAt = models.DateTimeField(auto_now_add=True)
+    consumedAt = models.DateTimeField(default=timezone.now) # Set by clients when logging offline
     portion = models.DecimalField(max_digits=8, decimal_places=2, validators=[validators.MinValueValidator(0)])
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'consumedAt'], name='consumed_user_consumedat_idx'),
+        ]
+
     def clean(self):
         if not self.item and not self.combinedItem:
             raise exceptions.ValidationError("At least one of item or combinedItem must be populated.")
@@ -110,6 +123,35 @@ class CombinedItemElement(models.Model):
     def __str__(self):
         return f"Element: {self.item.name} in Combined Item: {self.combinedItem.name}"
 
+class CombinedItemTotal(models.Model):
+    combinedItem = models.ForeignKey(CombinedItem, on_delete=models.CASCADE)
+    nutrient = models.ForeignKey(Nutrient, on_delete=models.CASCADE, null=True, blank=True) # Null nutrient holds the combined item's calories
+    amount = models.DecimalField(max_digits=14, decimal_places=4, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['combinedItem', 'nutrient'], name='unique_combined_item_total'),
+            models.UniqueConstraint(fields=['combinedItem'], condition=models.Q(nutrient__isnull=True), name='unique_combined_item_calorie_total'),
+        ]
+
+    def __str__(self):
+        return f"{self.combinedItem.name}'s total {self.nutrient.name if self.nutrient else 'Calories'}"
+
+class DailyNutrientTotal(models.Model):
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    date = models.DateField()
+    nutrient = models.ForeignKey(Nutrient, on_delete=models.CASCADE, null=True, blank=True) # Null nutrient holds the day's calories
+    amount = models.DecimalField(max_digits=14, decimal_places=4, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'date', 'nutrient'], name='unique_daily_nutrient_total'),
+            models.UniqueConstraint(fields=['user', 'date'], condition=models.Q(nutrient__isnull=True), name='unique_daily_calorie_total'),
+        ]
+
+    def __str__(self):
+        return f"{self.user.username}'s {self.nutrient.name if self.nutrient else 'Calories'} on {self.date}"
+
 class ItemNutrient(models.Model):
     item = models.ForeignKey(Item, on_delete=models.CASCADE)
     nutrient = models.ForeignKey(Nutrient, on_delete=models.CASCADE)
@@ -186,5 +228,10 @@ class UserGoalNutrient(models.Model):
     goal = models.ForeignKey(UserGoal, on_delete=models.CASCADE)
     targetValue = models.DecimalField(max_digits=8, decimal_places=2, validators=[validators.MinValueValidator(0)])
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['goal', 'nutrient'], name='unique_user_goal_nutrient'),
+        ]
+
     def __str__(self):
         return f"{self.goal.user.username}'s {self.goal.name} Goal - {self.nutrient.name}"
\ No newline at end of file
@@ -0,0 +1,158 @@
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from rest_framework.authtoken.models import Token
+
+from nutrition.api.authentication import invalidateToken
+from nutrition.models import CombinedItem, CombinedItemElement, Consumed, FavoriteItem, GoalTemplate, GoalTemplateNutrient, Item, ItemNutrient, Nutrient, Unit, User, UserGoal, UserGoalNutrient
+from nutrition.utils.autocomplete_utils import itemNameIndex
+from nutrition.utils.cache_utils import invalidateBarcode
+from nutrition.utils.rollup_utils import deletingCombinedItemIds, refreshCombinedItemTotals, refreshCombinedItemTotalsForItems
+from nutrition.utils.template_utils import goalTemplateResolver
+from nutrition.utils.vector_utils import markChanged
+from nutrition.utils.version_utils import bumpVersion, userVersion
+
+
+# Drop cached barcode lookups when an item (or its list of nutrients) changes
+# Bulk imports skip these signals; cached misses for newly imported barcodes expire on their own
+
+@receiver(pre_save, sender=Item)
+def invalidatePreviousBarcode(sender, instance, **kwargs):
+    # If the barcode is being changed, the item must also disappear from the old barcode's lookup
+    if instance.pk:
+        invalidateBarcode(Item.objects.filter(pk=instance.pk).values_list('barcode', flat=True).first())
+
+@receiver(post_save, sender=Item)
+@receiver(post_delete, sender=Item)
+def invalidateItemBarcode(sender, instance, **kwargs):
+    invalidateBarcode(instance.barcode)
+
+@receiver(post_save, sender=ItemNutrient)
+@receiver(post_delete, sender=ItemNutrient)
+def invalidateItemNutrientBarcode(sender, instance, **kwargs):
+    # Use the item loaded with the nutrient if there is one, otherwise look up just its barcode
+    if ItemNutrient.item.is_cached(instance):
+        invalidateBarcode(instance.item.barcode)
+    else:
+        invalidateBarcode(Item.objects.filter(pk=instance.item_id).values_list('barcode', flat=True).first())
+
+
+# Read the item's nutrient vector from the database until vectors are rebuilt
+
+@receiver(post_save, sender=ItemNutrient)
+@receiver(post_delete, sender=ItemNutrient)
+def markItemVectorChanged(sender, instance, **kwargs):
+    markChanged([instance.item_id])
+
+
+# Keep the autocomplete index in step with renamed and deleted items (created items are added where their nutrients are known)
+# Bulk imports skip these signals; the index picks up their changes when it is next rebuilt
+
+@receiver(post_save, sender=Item)
+def renameIndexedItem(sender, instance, created, **kwargs):
+    if not created:
+        itemNameIndex.rename(instance)
+
+@receiver(post_delete, sender=Item)
+def removeIndexedItem(sender, instance, **kwargs):
+    itemNameIndex.remove(instance.pk)
+
+
+# Reload goal templates after any change, whether from the admin page, the API, or import_goal_templates
+
+@receiver(post_save, sender=GoalTemplate)
+@receiver(post_delete, sender=GoalTemplate)
+@receiver(post_save, sender=GoalTemplateNutrient)
+@receiver(post_delete, sender=GoalTemplateNutrient)
+def invalidateGoalTemplates(sender, **kwargs):
+    goalTemplateResolver.invalidate()
+
+
+# Keep the stored combined item totals in sync with their elements, and with the calories and nutrients of their items
+
+@receiver(pre_save, sender=CombinedItemElement)
+def rememberPreviousCombinedItem(sender, instance, **kwargs):
+    # If the element is moved to another combined item, the old one's totals must also be recomputed
+    instance._previousCombinedItemId = None
+    if instance.pk:
+        instance._previousCombinedItemId = CombinedItemElement.objects.filter(pk=instance.pk).values_list('combinedItem', flat=True).first()
+
+@receiver(post_save, sender=CombinedItemElement)
+def refreshElementTotals(sender, instance, **kwargs):
+    refreshCombinedItemTotals([instance.combinedItem_id, instance._previousCombinedItemId])
+
+@receiver(post_delete, sender=CombinedItemElement)
+def refreshDeletedElementTotals(sender, instance, **kwargs):
+    refreshCombinedItemTotals([instance.combinedItem_id])
+
+@receiver(post_save, sender=Item)
+def refreshItemTotals(sender, instance, created, **kwargs):
+    # A new item isn't in any combined item yet
+    if not created:
+        refreshCombinedItemTotalsForItems([instance.pk])
+
+@receiver(post_save, sender=ItemNutrient)
+@receiver(post_delete, sender=ItemNutrient)
+def refreshItemNutrientTotals(sender, instance, **kwargs):
+    refreshCombinedItemTotalsForItems([instance.item_id])
+
+# Deleting a combined item deletes its elements first, which must not store new totals for it
+@receiver(pre_delete, sender=CombinedItem)
+def rememberDeletingCombinedItem(sender, instance, **kwargs):
+    deletingCombinedItemIds().add(instance.pk)
+
+@receiver(post_delete, sender=CombinedItem)
+def forgetDeletingCombinedItem(sender, instance, **kwargs):
+    deletingCombinedItemIds().discard(instance.pk)
+
+
+# Replace cached reference data responses (units, nutrients, and goal templates) after any change
+
+REFERENCE_VERSIONS = {
+    Unit: 'units',
+    Nutrient: 'nutrients',
+    GoalTemplate: 'goaltemplates',
+    GoalTemplateNutrient: 'goaltemplatenutrients',
+}
+
+@receiver(post_save, sender=Unit)
+@receiver(post_delete, sender=Unit)
+@receiver(post_save, sender=Nutrient)
+@receiver(post_delete, sender=Nutrient)
+@receiver(post_save, sender=GoalTemplate)
+@receiver(post_delete, sender=GoalTemplate)
+@receiver(post_save, sender=GoalTemplateNutrient)
+@receiver(post_delete, sender=GoalTemplateNutrient)
+def bumpReferenceVersion(sender, **kwargs):
+    bumpVersion(REFERENCE_VERSIONS[sender])
+
+
+# Let clients know a user's consumption, favorites, or goals changed (ledger and goal target bulk writes bump it themselves)
+
+@receiver(post_save, sender=Consumed)
+@receiver(post_delete, sender=Consumed)
+@receiver(post_save, sender=FavoriteItem)
+@receiver(post_delete, sender=FavoriteItem)
+@receiver(post_save, sender=UserGoal)
+@receiver(post_delete, sender=UserGoal)
+def bumpUserVersion(sender, instance, **kwargs):
+    bumpVersion(userVersion(instance.user_id))
+
+@receiver(post_save, sender=UserGoalNutrient)
+@receiver(post_delete, sender=UserGoalNutrient)
+def bumpGoalUserVersion(sender, instance, **kwargs):
+    bumpVersion(userVersion(UserGoal.objects.filter(pk=instance.goal_id).values_list('user', flat=True).first()))
+
+
+# Drop cached token authentication when a token is deleted (logout) or replaced, or when its user changes
+
+@receiver(post_save, sender=Token)
+@receiver(post_delete, sender=Token)
+def invalidateCachedToken(sender, instance, **kwargs):
+    invalidateToken(instance.key)
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidateUserTokens(sender, instance, **kwargs):
+    for key in Token.objects.filter(user_id=instance.pk).values_list('key', flat=True):
+        invalidateToken(key)
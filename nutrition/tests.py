@@ -1,3 +1,948 @@
-from django.test import TestCase
+import importlib.util
+import json
+import os
+import tempfile
+import threading
+import time as time_module
+import unittest
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.http import parse_http_date
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from nutrition.api.authentication import tokenCacheKey
+from nutrition.management.commands.massagedata import massage_file
+from nutrition.utils.autocomplete_utils import MAX_AGE, itemNameIndex
+from nutrition.utils.copy_utils import supportsCopy
+from nutrition.utils.import_utils import massageLine
+from nutrition.utils.template_utils import goalTemplateResolver
+from nutrition.utils.vector_utils import NutrientVectorStore
+from nutrition.utils.version_utils import LOCAL_CACHE_TIMEOUT
+
+from nutrition.models import User, Unit, Nutrient, ServingSize, Item, CombinedItem, Consumed, CombinedItemElement, CombinedItemTotal, ItemNutrient, DailyNutrientTotal, GoalTemplate, GoalTemplateNutrient, UserGoal, UserGoalNutrient
+
+# A cache shared by every process (like Redis), which the per-user validators need
+SHARED_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': os.path.join(tempfile.gettempdir(), 'nutrition-test-cache')}}
+
+
+class NutritionTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='tester', password='password')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+        self.unit = Unit.objects.create(name='gram', abbreviation='g')
+        template = GoalTemplate.objects.create(name='Template')
+        self.goal = UserGoal.objects.create(user=self.user, template=template, calories=2000)
+
+        servingSize = ServingSize.objects.create(amount=100, unit=self.unit)
+        self.apple = Item.objects.create(name='Apple', calories=50, servingSize=servingSize)
+        self.bread = Item.objects.create(name='Bread', calories=200, servingSize=servingSize)
+        self.sandwich = CombinedItem.objects.create(user=self.user, name='Sandwich')
+        CombinedItemElement.objects.create(combinedItem=self.sandwich, item=self.bread, portion=2)
+
+    def addGoalNutrients(self, count):
+        nutrients = []
+        for i in range(count):
+            nutrient = Nutrient.objects.create(name=f'Nutrient {Nutrient.objects.count()}', unit=self.unit)
+            UserGoalNutrient.objects.create(goal=self.goal, nutrient=nutrient, targetValue=10)
+            ItemNutrient.objects.create(item=self.apple, nutrient=nutrient, amount=1)
+            ItemNutrient.objects.create(item=self.bread, nutrient=nutrient, amount=3)
+            nutrients.append(nutrient)
+        return nutrients
+
+    def consume(self, **data):
+        response = self.client.post(reverse('consumed-create'), data)
+        self.assertEqual(response.status_code, 201)
+        return Consumed.objects.latest('id')
+
+    def getStatus(self):
+        response = self.client.get(reverse('goal-nutrient-status'))
+        self.assertEqual(response.status_code, 200)
+        return {row['nutrient_id']: Decimal(row['total_consumed']) for row in response.data}
+
+
+class GoalNutrientStatusViewTests(NutritionTestCase):
+
+    def test_totals_include_items_and_combined_item_portions(self):
+        nutrient = self.addGoalNutrients(1)[0]
+        self.consume(item=self.apple.id, portion=2)
+        self.consume(combinedItem=self.sandwich.id, portion='0.5')
+
+        status = self.getStatus()
+
+        # 2 apples plus half a sandwich made of 2 slices of bread
+        self.assertEqual(status[-1], Decimal('2') * 50 + Decimal('0.5') * 2 * 200)
+        self.assertEqual(status[nutrient.id], Decimal('2') * 1 + Decimal('0.5') * 2 * 3)
+
+    def test_query_count_does_not_grow_with_goal_nutrients(self):
+        self.addGoalNutrients(2)
+        self.consume(item=self.apple.id, portion=1)
+        self.consume(combinedItem=self.sandwich.id, portion=1)
+
+        with self.assertNumQueries(3):
+            self.getStatus()
+
+        self.addGoalNutrients(40)
+        with self.assertNumQueries(3):
+            self.getStatus()
+
+
+class NutrientTrendViewTests(NutritionTestCase):
+
+    def consumeOn(self, day, **data):
+        consumedAt = timezone.make_aware(datetime.combine(day, time(12)))
+        return self.consume(consumedAt=consumedAt.isoformat(), **data)
+
+    def getTrend(self, **params):
+        response = self.client.get(reverse('nutrient-trend'), params)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_weekly_totals_of_selected_nutrients_in_one_query(self):
+        selected, other = self.addGoalNutrients(2)
+        self.consumeOn(date(2024, 3, 2), item=self.apple.id, portion=5) # Before the range
+        self.consumeOn(date(2024, 3, 3), item=self.apple.id, portion=1) # Sunday
+        self.consumeOn(date(2024, 3, 4), item=self.apple.id, portion=2) # Monday
+        self.consumeOn(date(2024, 3, 10), combinedItem=self.sandwich.id, portion=1)
+
+        with self.assertNumQueries(1):
+            trend = self.getTrend(start='2024-03-03', end='2024-03-11', period='week', nutrients=[selected.id])
+
+        self.assertEqual(trend['count'], 3)
+        self.assertEqual([(row['start'], Decimal(row['calories'])) for row in trend['results']], [('2024-02-26', 50), ('2024-03-04', 2 * 50 + 2 * 200), ('2024-03-11', 0)])
+        self.assertEqual([row['nutrients'] for row in trend['results']], [{str(selected.id): '1.00'}, {str(selected.id): '8.00'}, {str(selected.id): '0.00'}])
+
+    def test_long_ranges_are_paginated(self):
+        start = date(2024, 1, 1)
+        self.consumeOn(start + timedelta(days=55), item=self.bread.id, portion=1)
+
+        trend = self.getTrend(start=start, end=start + timedelta(days=59))
+        self.assertEqual((trend['count'], len(trend['results'])), (60, 50))
+        trend = self.getTrend(start=start, end=start + timedelta(days=59), page=2)
+        self.assertEqual([(row['start'], row['calories'], row['nutrients']) for row in trend['results'] if row['calories'] != '0.00'], [('2024-02-25', '200.00', {})])
+
+
+@override_settings(CACHES=SHARED_CACHES)
+class UserVersionTests(NutritionTestCase):
+
+    def test_unchanged_status_returns_304_without_queries(self):
+        self.addGoalNutrients(1)
+        url = reverse('goal-nutrient-status')
+        etag = self.client.get(url)['ETag']
+
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        # Recording consumption changes the user's version
+        self.consume(item=self.apple.id, portion=1)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Decimal(response.data[0]['total_consumed']), 50)
+
+    def test_favorites_etag_changes_when_favorites_change(self):
+        self.client.post(reverse('toggle-favorite', args=[self.apple.id]))
+        url = reverse('favorites')
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        self.client.post(reverse('toggle-favorite', args=[self.bread.id]))
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_batch_logging_an_empty_combined_item_changes_the_etag(self):
+        url = reverse('consumed-items')
+        etag = self.client.get(url)['ETag']
+
+        empty = CombinedItem.objects.create(user=self.user, name='Empty')
+        response = self.client.post(reverse('consumed-batch-create'), {'entries': [{'combinedItem': empty.id, 'portion': 1}]}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    # Other server processes can't see a version replaced in this one's memory, so none are sent
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_local_memory_cache_sends_no_etag(self):
+        url = reverse('goal-nutrient-status')
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('ETag', response)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH='"x"').status_code, 200)
+
+    def test_last_modified_is_only_sent_once_its_second_is_over(self):
+        url = reverse('consumed-items')
+        now = time_module.time()
+        # Consumption recorded later in the same second must not be hidden by a 304
+        self.assertNotIn('Last-Modified', self.client.get(url))
+
+        with mock.patch('time.time', return_value=now + 2):
+            response = self.client.get(url)
+            lastModified = response['Last-Modified']
+            self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE=lastModified).status_code, 304)
+            # If-None-Match takes precedence
+            self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE=lastModified, HTTP_IF_NONE_MATCH='"x"').status_code, 200)
+
+            self.consume(item=self.apple.id, portion=1)
+            response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=lastModified)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotIn('Last-Modified', response)
+
+        with mock.patch('time.time', return_value=now + 4):
+            response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=lastModified)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual([row['name'] for row in response.data], ['Apple'])
+            self.assertGreater(parse_http_date(response['Last-Modified']), parse_http_date(lastModified))
+
+
+@override_settings(CACHES=SHARED_CACHES)
+class TokenAuthenticationTests(NutritionTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.token = Token.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    def test_cached_token_skips_the_user_query_until_logout(self):
+        url = reverse('active-goal')
+        self.goal.isActive = True
+        self.goal.save()
+        with self.assertNumQueries(2):
+            self.assertEqual(self.client.get(url).status_code, 200)
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get(url).status_code, 200)
+
+        # Profile updates reload the user
+        self.client.put(reverse('user_update'), {'age': 30}, format='json')
+        self.assertEqual(self.client.get(reverse('user_update')).data['age'], 30)
+
+        self.assertEqual(self.client.post(reverse('logout')).status_code, 200)
+        self.assertEqual(self.client.get(url).status_code, 401)
+
+    def test_password_hash_is_not_cached(self):
+        self.assertEqual(self.client.get(reverse('user_update')).status_code, 200)
+        cached = cache.get(tokenCacheKey(self.token.key))
+        self.assertEqual(cached['user']['id'], self.user.id)
+        self.assertNotIn('password', cached['user'])
+        self.assertNotIn(self.user.password, str(cached))
+
+    # Logging out in another server process can't drop a token from this one's memory, so tokens aren't cached there
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_local_memory_cache_checks_every_token(self):
+        url = reverse('active-goal')
+        self.goal.isActive = True
+        self.goal.save()
+        for i in range(2):
+            with self.assertNumQueries(2):
+                self.assertEqual(self.client.get(url).status_code, 200)
+        self.assertIsNone(cache.get(tokenCacheKey(self.token.key)))
+
+
+class DailyNutrientLedgerTests(NutritionTestCase):
+
+    def test_ledger_follows_consumed_updates_and_deletes(self):
+        nutrient = self.addGoalNutrients(1)[0]
+        consumed = self.consume(item=self.apple.id, portion=1)
+
+        url = reverse('consumed-detail', args=[consumed.id])
+        response = self.client.patch(url, {'item': self.apple.id, 'portion': 3})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.getStatus()[nutrient.id], 3)
+
+        self.client.delete(url)
+        self.assertEqual(self.getStatus()[nutrient.id], 0)
+
+    def test_ledger_follows_combined_item_element_edits(self):
+        nutrient = self.addGoalNutrients(1)[0]
+        self.consume(combinedItem=self.sandwich.id, portion=1)
+
+        response = self.client.post(reverse('combineditemelement-list'), {'combinedItem': self.sandwich.id, 'item': self.apple.id, 'portion': 1})
+        self.assertEqual(response.status_code, 201)
+        status = self.getStatus()
+        self.assertEqual(status[-1], 2 * 200 + 50)
+        self.assertEqual(status[nutrient.id], 2 * 3 + 1)
+
+    def test_ledger_follows_item_and_combined_item_deletes(self):
+        nutrient = self.addGoalNutrients(1)[0]
+        self.consume(item=self.apple.id, portion=1)
+        self.consume(item=self.bread.id, portion=1)
+        self.consume(combinedItem=self.sandwich.id, portion=1)
+        self.assertEqual(self.getStatus()[nutrient.id], 1 + 3 + 2 * 3)
+
+        # Deleting bread deletes its consumption and empties the sandwich
+        response = self.client.delete(reverse('item-detail', args=[self.bread.id]))
+        self.assertEqual(response.status_code, 204)
+        status = self.getStatus()
+        self.assertEqual(status[-1], 50)
+        self.assertEqual(status[nutrient.id], 1)
+
+        response = self.client.post(reverse('combineditemelement-list'), {'combinedItem': self.sandwich.id, 'item': self.apple.id, 'portion': 2})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.getStatus()[nutrient.id], 1 + 2)
+
+        response = self.client.delete(reverse('combineditem-detail', args=[self.sandwich.id]))
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.getStatus()[nutrient.id], 1)
+
+    def test_ledger_follows_item_and_item_nutrient_edits(self):
+        nutrient = self.addGoalNutrients(1)[0]
+        apple = self.consume(item=self.apple.id, portion=1)
+        self.consume(combinedItem=self.sandwich.id, portion=1)
+
+        response = self.client.patch(reverse('item-detail', args=[self.apple.id]), {'calories': 100})
+        self.assertEqual(response.status_code, 200)
+        response = self.client.patch(reverse('item-detail', args=[self.bread.id]), {'calories': 300})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.getStatus()[-1], 100 + 2 * 300)
+
+        breadNutrient = ItemNutrient.objects.get(item=self.bread, nutrient=nutrient)
+        response = self.client.patch(reverse('itemnutrient-detail', args=[breadNutrient.id]), {'amount': 5})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.getStatus()[nutrient.id], 1 + 2 * 5)
+
+        self.client.delete(reverse('itemnutrient-detail', args=[breadNutrient.id]))
+        self.assertEqual(self.getStatus()[nutrient.id], 1)
+        response = self.client.post(reverse('itemnutrient-list'), {'item': self.bread.id, 'nutrient': nutrient.id, 'amount': 4})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.getStatus()[nutrient.id], 1 + 2 * 4)
+
+        # Deleting the consumption takes out what its item counts for now
+        self.client.delete(reverse('consumed-detail', args=[apple.id]))
+        status = self.getStatus()
+        self.assertEqual(status[-1], 2 * 300)
+        self.assertEqual(status[nutrient.id], 2 * 4)
+        output = StringIO()
+        call_command('rebuild_nutrient_ledger', '--check', stdout=output)
+        self.assertIn('Ledger matches', output.getvalue())
+
+    def test_ledger_follows_item_edits_on_the_admin_page(self):
+        nutrient = self.addGoalNutrients(1)[0]
+        self.consume(item=self.apple.id, portion=2)
+        appleNutrient = ItemNutrient.objects.get(item=self.apple, nutrient=nutrient)
+        admin = APIClient()
+        admin.force_login(User.objects.create_superuser(username='admin', password='password'))
+
+        data = {
+            'name': 'Apple', 'barcode': '', 'calories': 60, 'servingSize': self.apple.servingSize.id, 'user': '', 'importHash': '', 'nutrientsChangedAt_0': '', 'nutrientsChangedAt_1': '',
+            'itemnutrient_set-TOTAL_FORMS': 1, 'itemnutrient_set-INITIAL_FORMS': 1, 'itemnutrient_set-MIN_NUM_FORMS': 0, 'itemnutrient_set-MAX_NUM_FORMS': 1000,
+            'itemnutrient_set-0-id': appleNutrient.id, 'itemnutrient_set-0-item': self.apple.id, 'itemnutrient_set-0-nutrient': nutrient.id, 'itemnutrient_set-0-amount': 4,
+            'itembioactive_set-TOTAL_FORMS': 0, 'itembioactive_set-INITIAL_FORMS': 0, 'itembioactive_set-MIN_NUM_FORMS': 0, 'itembioactive_set-MAX_NUM_FORMS': 1000,
+        }
+        response = admin.post(reverse('admin:nutrition_item_change', args=[self.apple.id]), data)
+        self.assertEqual(response.status_code, 302)
+        status = self.getStatus()
+        self.assertEqual(status[-1], 2 * 60)
+        self.assertEqual(status[nutrient.id], 2 * 4)
+
+        response = admin.post(reverse('admin:nutrition_item_delete', args=[self.apple.id]), {'post': 'yes'})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(self.getStatus()[nutrient.id], 0)
+
+    def test_batch_logging_updates_the_ledger_for_each_day(self):
+        nutrient = self.addGoalNutrients(1)[0]
+        yesterday = timezone.localtime() - timedelta(days=1)
+        before = self.getStatus()[nutrient.id]
+        entries = [
+            {'item': self.apple.id, 'portion': 2},
+            {'combinedItem': self.sandwich.id, 'portion': 1},
+            {'item': self.bread.id, 'portion': 1, 'consumedAt': yesterday.isoformat()},
+        ]
+
+        response = self.client.post(reverse('consumed-batch-create'), {'entries': entries}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(response.data['consumed']), 3)
+        self.assertEqual(Consumed.objects.get(id=response.data['consumed'][2]).consumedAt, yesterday)
+        # The status reflects the batch even though bulk_create skips the save signals that mark it changed
+        self.assertEqual(self.getStatus()[nutrient.id], before + 2 * 1 + 2 * 3)
+        self.assertEqual(DailyNutrientTotal.objects.get(user=self.user, date=yesterday.date(), nutrient=nutrient).amount, 3)
+
+    def test_batch_with_unknown_items_logs_nothing(self):
+        entries = [{'item': self.apple.id, 'portion': 1}, {'item': 999999, 'portion': 1}, {'combinedItem': 999999, 'portion': 1}]
+        with self.assertNumQueries(2):
+            response = self.client.post(reverse('consumed-batch-create'), {'entries': entries}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(set(response.data), {'item', 'combinedItem'})
+        self.assertFalse(Consumed.objects.exists())
+
+    def test_rebuild_command_repairs_drift(self):
+        nutrient = self.addGoalNutrients(1)[0]
+        self.consume(item=self.apple.id, portion=1)
+        DailyNutrientTotal.objects.filter(nutrient=nutrient).update(amount=99)
+
+        output = StringIO()
+        call_command('rebuild_nutrient_ledger', '--check', stdout=output)
+        self.assertIn('1 drifted rows', output.getvalue())
+        self.assertEqual(self.getStatus()[nutrient.id], 99)
+
+        call_command('rebuild_nutrient_ledger', stdout=StringIO())
+        self.assertEqual(self.getStatus()[nutrient.id], 1)
+
+
+class CombinedItemTotalTests(NutritionTestCase):
+
+    def getCombinedItem(self):
+        response = self.client.get(reverse('combineditem-detail', args=[self.sandwich.id]))
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_totals_follow_elements_and_item_nutrients(self):
+        nutrient = self.addGoalNutrients(1)[0]
+        data = self.getCombinedItem()
+        self.assertEqual(data['calories'], 2 * 200)
+        self.assertEqual(data['nutrients'], [{'nutrient': nutrient.id, 'amount': 2 * 3}])
+
+        CombinedItemElement.objects.create(combinedItem=self.sandwich, item=self.apple, portion=1)
+        ItemNutrient.objects.filter(item=self.bread).get().delete()
+        self.bread.calories = 100
+        self.bread.save()
+        data = self.getCombinedItem()
+        self.assertEqual(data['calories'], 2 * 100 + 50)
+        self.assertEqual(data['nutrients'], [{'nutrient': nutrient.id, 'amount': 1}])
+
+        # Deleting the combined item deletes its totals with it
+        self.sandwich.delete()
+        self.assertFalse(CombinedItemTotal.objects.exists())
+
+
+class ReferenceResponseCacheTests(NutritionTestCase):
+
+    def test_units_are_cached_with_validators_until_they_change(self):
+        url = reverse('unit-list')
+        response = self.client.get(url)
+        etag = response['ETag']
+        self.assertEqual(response.data['count'], 1)
+        # The version started this second, so there is no Last-Modified yet
+        self.assertNotIn('Last-Modified', response)
+        with mock.patch('time.time', return_value=time_module.time() + 2):
+            lastModified = self.client.get(url)['Last-Modified']
+            self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE=lastModified).status_code, 304)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+            self.assertEqual(self.client.get(url).data['count'], 1)
+
+        # Changes made outside the viewset (e.g., from the admin page) replace the cached response
+        Unit.objects.create(name='milligram', abbreviation='mg')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['count'], 2)
+        self.assertNotEqual(response['ETag'], etag)
+
+
+class ItemSearchTests(NutritionTestCase):
+
+    def search(self, **params):
+        return self.client.get(reverse('item-list'), params)
+
+    def test_name_search_orders_by_shortest_name_without_extra_queries(self):
+        Item.objects.create(name='Apple Pie', calories=300, servingSize=self.apple.servingSize)
+        self.addGoalNutrients(2)
+
+        # One query for the search and one for the nutrient prefetch
+        with self.assertNumQueries(2):
+            response = self.search(name='apple')
+        self.assertEqual([item['name'] for item in response.data['results']], ['Apple', 'Apple Pie'])
+
+        # Ranked mode falls back to the default ordering outside PostgreSQL
+        response = self.search(name='pie apple', ranked='true')
+        self.assertEqual([item['name'] for item in response.data['results']], ['Apple Pie'])
+
+    def test_name_search_without_matches_returns_404(self):
+        self.assertEqual(self.search(name='pear').status_code, 404)
+
+    def test_name_search_only_applies_to_listing(self):
+        response = self.client.get(reverse('item-detail', args=[self.bread.id]), {'name': 'apple'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['name'], 'Bread')
+
+
+class ItemAutocompleteTests(NutritionTestCase):
+
+    def setUp(self):
+        super().setUp()
+        itemNameIndex.invalidate()
+
+    def suggest(self, name):
+        response = self.client.get(reverse('item-autocomplete'), {'name': name})
+        self.assertEqual(response.status_code, 200)
+        return [suggestion['name'] for suggestion in response.data]
+
+    def test_suggestions_match_word_prefixes_in_item_search_order(self):
+        Item.objects.create(name='Apple Pie', calories=300, servingSize=self.apple.servingSize)
+        Item.objects.create(name='Pineapple', calories=40, servingSize=self.apple.servingSize)
+
+        self.assertEqual(self.suggest('ap'), ['Apple', 'Apple Pie'])
+        self.assertEqual(self.suggest('pi ap'), ['Apple Pie'])
+        self.assertEqual(self.suggest('x'), [])
+
+        # Served from memory once built
+        with self.assertNumQueries(0):
+            self.suggest('pine')
+
+    def test_created_items_are_added_without_rebuilding(self):
+        nutrient = self.addGoalNutrients(1)[0]
+        self.suggest('apple')
+
+        data = {'name': 'Apple Crisp', 'calories': 200, 'serving_amount': 1, 'serving_unit': self.unit.id, 'nutrients': {str(nutrient.id): 2}}
+        response = self.client.post(reverse('item-create'), data, format='json')
+        self.assertEqual(response.status_code, 201)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(self.suggest('apple'), ['Apple', 'Apple Crisp'])
+
+    def test_expired_index_is_rebuilt_once_in_the_background(self):
+        self.suggest('apple')
+        itemNameIndex.builtAt -= MAX_AGE + 1
+
+        builds = []
+        release = threading.Event()
+        def slowBuild():
+            builds.append(1)
+            release.wait(5)
+
+        # Concurrent requests keep getting the old index while a single rebuild runs
+        with mock.patch.object(itemNameIndex, 'build', slowBuild):
+            suggestions = []
+            threads = [threading.Thread(target=lambda: suggestions.append(itemNameIndex.suggest('apple', 10))) for i in range(5)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            release.set()
+            itemNameIndex.refreshThread.join()
+
+        self.assertEqual(len(builds), 1)
+        self.assertEqual([[suggestion['name'] for suggestion in result] for result in suggestions], [['Apple']] * 5)
+
+    def test_renamed_and_deleted_items_are_updated_without_rebuilding(self):
+        pie = Item.objects.create(name='Apple Pie', calories=300, servingSize=self.apple.servingSize)
+        crisp = Item.objects.create(name='Apple Crisp', calories=200, servingSize=self.apple.servingSize)
+        self.assertEqual(self.suggest('apple'), ['Apple', 'Apple Pie', 'Apple Crisp'])
+
+        pie.name = 'Cherry Pie'
+        pie.save()
+        crisp.delete()
+
+        with self.assertNumQueries(0):
+            self.assertEqual(self.suggest('apple'), ['Apple'])
+            self.assertEqual(self.suggest('pie'), ['Cherry Pie'])
+            self.assertEqual(self.suggest('ch pi'), ['Cherry Pie'])
+
+    def test_requests_wait_for_the_startup_build(self):
+        builds = []
+        release = threading.Event()
+        def slowBuild():
+            release.wait(5)
+            builds.append(1)
+            itemNameIndex.builtAt = time_module.monotonic()
+
+        # A request made while the startup build runs waits for it rather than building again
+        with mock.patch.object(itemNameIndex, 'build', slowBuild):
+            itemNameIndex.startBuild()
+            request = threading.Thread(target=itemNameIndex.suggest, args=('apple',))
+            request.start()
+            release.set()
+            request.join()
+            itemNameIndex.refreshThread.join()
+
+        self.assertEqual(len(builds), 1)
+
+
+class ItemBulkCreateTests(NutritionTestCase):
+
+    def bulkCreate(self, count, nutrients):
+        items = [{'name': f'Recipe {i}', 'calories': 100 + i, 'serving_amount': 50, 'serving_unit': self.unit.id, 'nutrients': nutrients} for i in range(count)]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse('item-bulk-create'), {'items': items}, format='json')
+        return response, len(queries)
+
+    def test_query_count_does_not_grow_with_items(self):
+        nutrients = {str(nutrient.id): 2 for nutrient in self.addGoalNutrients(2)}
+        # The first request also creates the shared serving size
+        self.assertEqual(self.bulkCreate(1, nutrients)[0].status_code, 201)
+        response, fewQueries = self.bulkCreate(2, nutrients)
+        self.assertEqual(response.status_code, 201)
+        response, manyQueries = self.bulkCreate(20, nutrients)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(fewQueries, manyQueries)
+
+        created = response.data['items']
+        self.assertEqual([data['item']['name'] for data in created], [f'Recipe {i}' for i in range(20)])
+        self.assertEqual(created[-1]['item']['calories'], 119)
+        self.assertEqual(len(created[0]['item']['nutrients']), 2)
+        self.assertEqual(created[0]['nutrients'][0]['amount'], '2.00')
+        self.assertEqual(Item.objects.filter(user=self.user, isCustom=True).values('servingSize').distinct().count(), 1)
+
+    def test_unknown_nutrient_creates_nothing(self):
+        nutrient = self.addGoalNutrients(1)[0]
+        items = [
+            {'name': 'Soup', 'calories': 80, 'serving_amount': 250, 'serving_unit': self.unit.id, 'nutrients': {str(nutrient.id): 1}},
+            {'name': 'Stew', 'calories': 90, 'serving_amount': 250, 'serving_unit': self.unit.id, 'nutrients': {str(nutrient.id): 1, '999999': 1}},
+        ]
+        itemCount = Item.objects.count()
+
+        response = self.client.post(reverse('item-bulk-create'), {'items': items}, format='json')
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response.data['nutrients'], [999999])
+        self.assertEqual(Item.objects.count(), itemCount)
+        self.assertFalse(ServingSize.objects.filter(amount=250).exists())
+
+
+class BarcodeLookupTests(NutritionTestCase):
+
+    def lookup(self, barcode):
+        return self.client.get(reverse('item-list'), {'barcode': barcode})
+
+    def test_lookups_are_cached_with_per_user_favorites(self):
+        self.apple.barcode = '0001'
+        self.apple.save()
+        self.lookup('0001')
+
+        # Only the favorite flags are queried once the barcode is cached
+        self.client.post(reverse('toggle-favorite', args=[self.apple.id]))
+        with self.assertNumQueries(1):
+            response = self.lookup('0001')
+        self.assertEqual(response.data['results'][0]['name'], 'Apple')
+        self.assertTrue(response.data['results'][0]['isFavorite'])
+
+    # Another process's changes (e.g., an import) can't invalidate a local memory cache, so its lookups expire sooner
+    def test_local_memory_cache_keeps_found_barcodes_briefly(self):
+        Item.objects.filter(id=self.apple.id).update(barcode='0005')
+        self.lookup('0005')
+        Item.objects.filter(id=self.apple.id).update(name='Green Apple')
+
+        with mock.patch('time.time', return_value=time_module.time() + LOCAL_CACHE_TIMEOUT - 10):
+            self.assertEqual(self.lookup('0005').data['results'][0]['name'], 'Apple')
+        with mock.patch('time.time', return_value=time_module.time() + LOCAL_CACHE_TIMEOUT + 10):
+            self.assertEqual(self.lookup('0005').data['results'][0]['name'], 'Green Apple')
+
+    def test_unknown_barcodes_are_cached(self):
+        self.assertEqual(self.lookup('0002').status_code, 404)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.lookup('0002').status_code, 404)
+
+    def test_item_changes_invalidate_the_cache(self):
+        self.assertEqual(self.lookup('0003').status_code, 404)
+
+        self.bread.barcode = '0003'
+        self.bread.save()
+        self.assertEqual(self.lookup('0003').data['results'][0]['name'], 'Bread')
+
+        self.bread.barcode = '0004'
+        self.bread.save()
+        self.assertEqual(self.lookup('0003').status_code, 404)
+
+    def test_batch_lookup_resolves_all_barcodes_at_once(self):
+        Item.objects.filter(id=self.apple.id).update(barcode='0005')
+        Item.objects.filter(id=self.bread.id).update(barcode='0006')
+        self.client.post(reverse('toggle-favorite', args=[self.bread.id]))
+
+        # One query for the barcodes and one for the favorite flags, plus the nutrient prefetch
+        with self.assertNumQueries(3):
+            response = self.client.post(reverse('item-barcodes'), {'barcodes': ['0005', '0006', '0007', '0005']}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([(item['name'], item['isFavorite']) for item in response.data['items']], [('Apple', False), ('Bread', True)])
+        self.assertEqual(response.data['not_found'], ['0007'])
+
+        # Every barcode is cached afterwards
+        with self.assertNumQueries(1):
+            self.client.post(reverse('item-barcodes'), {'barcodes': ['0005', '0007']}, format='json')
+
+
+class UserConsumedItemsViewTests(NutritionTestCase):
+
+    def listConsumed(self, **params):
+        response = self.client.get(reverse('consumed-items'), params)
+        self.assertEqual(response.status_code, 200)
+        return [(row['type'], row['name']) for row in response.data]
+
+    def test_lists_items_and_combined_items_in_one_query(self):
+        self.consume(item=self.apple.id, portion=1)
+        self.consume(combinedItem=self.sandwich.id, portion=1)
+
+        with self.assertNumQueries(1):
+            self.assertEqual(self.listConsumed(), [('Item', 'Apple'), ('CombinedItem', 'Sandwich')])
+
+    def test_lists_a_date_range(self):
+        lastWeek = self.consume(item=self.apple.id, portion=1)
+        Consumed.objects.filter(id=lastWeek.id).update(consumedAt=timezone.now() - timedelta(days=7))
+        self.consume(item=self.bread.id, portion=1)
+
+        weekAgo = timezone.localdate() - timedelta(days=7)
+        self.assertEqual(self.listConsumed(), [('Item', 'Bread')])
+        self.assertEqual(self.listConsumed(date=weekAgo), [('Item', 'Apple')])
+        self.assertEqual(self.listConsumed(start=weekAgo), [('Item', 'Apple'), ('Item', 'Bread')])
+        self.assertEqual(self.client.get(reverse('consumed-items'), {'start': timezone.localdate(), 'end': weekAgo}).status_code, 400)
+
+    def test_days_follow_the_local_time_zone(self):
+        # Just before and just after local midnight, which are on the same day in UTC
+        day = date(2024, 3, 1)
+        midnight = timezone.make_aware(datetime.combine(day, time.min))
+        self.consume(item=self.apple.id, portion=1, consumedAt=(midnight - timedelta(minutes=1)).isoformat())
+        self.consume(item=self.bread.id, portion=1, consumedAt=midnight.isoformat())
+
+        self.assertEqual(self.listConsumed(date=day - timedelta(days=1)), [('Item', 'Apple')])
+        self.assertEqual(self.listConsumed(date=day), [('Item', 'Bread')])
+
+
+class UserGoalGenerateViewTests(NutritionTestCase):
+
+    def generate(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse('goal-generate'))
+        self.assertEqual(response.status_code, 201)
+        return response, len(queries)
+
+    def addTemplateNutrients(self, template, count):
+        for i in range(count):
+            nutrient = Nutrient.objects.create(name=f'Template Nutrient {Nutrient.objects.count()}', unit=self.unit)
+            GoalTemplateNutrient.objects.create(template=template, nutrient=nutrient, recommendedValue=5)
+
+    def test_generation_runs_a_constant_number_of_queries(self):
+        for name in ('Fat', 'Carbohydrate', 'Protein'):
+            Nutrient.objects.create(name=name, unit=self.unit)
+        template = GoalTemplate.objects.create(name='Adult Male', sex='Male', ageMin=19, ageMax=50)
+        self.addTemplateNutrients(template, 3)
+
+        response, _ = self.generate()
+        self.assertEqual(len(response.data['nutrients']), 6)
+
+        # Regenerating updates the existing goal nutrients in place
+        response, smallCount = self.generate()
+        self.addTemplateNutrients(template, 40)
+        goalTemplateResolver.ensureLoaded()
+        response, largeCount = self.generate()
+        self.assertEqual(len(response.data['nutrients']), 46)
+        self.assertEqual(UserGoalNutrient.objects.filter(goal__user=self.user).count(), 46)
+        self.assertEqual(largeCount, smallCount)
+
+    def test_templates_are_resolved_from_memory(self):
+        child = GoalTemplate.objects.create(name='Child', sex='Male', ageMin=1, ageMax=18)
+        adult = GoalTemplate.objects.create(name='Adult Male', sex='Male', ageMin=19, ageMax=50)
+        self.assertEqual(goalTemplateResolver.resolve('Male', False, False, 30)[0], adult)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(goalTemplateResolver.resolve('Male', False, False, 10)[0], child)
+            self.assertEqual(goalTemplateResolver.resolve('Male', False, False, 60), (None, None))
+            self.assertEqual(goalTemplateResolver.resolve('Female', False, False, 30), (None, None))
+
+        # Editing a template reloads the templates
+        adult.ageMax = 120
+        adult.save()
+        self.assertEqual(goalTemplateResolver.resolve('Male', False, False, 60)[0], adult)
+
+
+class ItemImportTests(NutritionTestCase):
+
+    def writeItems(self, items, servingSize='30g'):
+        path = os.path.join(self.directory.name, 'items.jsonl')
+        with open(path, 'w') as file:
+            for barcode, name, protein in items:
+                file.write(json.dumps({'barcode': barcode, 'name': name, 'calories': 100, 'serving_size_grams': servingSize, 'serving_size_other': None, 'nutrients': {'Protein': {'amount_per_serving': protein, 'unit': 'g'}}}) + '\n')
+        return path
+
+    def setUp(self):
+        super().setUp()
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.protein = Nutrient.objects.create(name='Protein', unit=self.unit)
+
+    def test_upsert_updates_changed_items_and_skips_custom_items(self):
+        call_command('finalimporter3', '--file', self.writeItems([('100', 'Oats', 5), ('200', 'Rice', 3)]), '--workers', '1', stdout=StringIO())
+        Item.objects.create(name='My Rice', barcode='200', calories=10, servingSize=self.apple.servingSize, user=self.user)
+
+        call_command('finalimporter3', '--file', self.writeItems([('100', 'Oats', 5), ('200', 'Brown Rice', 4), ('300', 'Corn', 2)]), '--workers', '1', '--upsert', stdout=StringIO())
+
+        imported = Item.objects.filter(isCustom=False, barcode__isnull=False)
+        self.assertEqual(sorted(imported.values_list('barcode', 'name')), [('100', 'Oats'), ('200', 'Brown Rice'), ('300', 'Corn')])
+        self.assertEqual(ItemNutrient.objects.get(item__name='Brown Rice').amount, 4)
+        self.assertEqual(ItemNutrient.objects.filter(item__in=imported).count(), 3)
+        self.assertTrue(Item.objects.filter(name='My Rice', barcode='200', isCustom=True).exists())
+
+        for command in ('finalimporter3', 'pipelineimporter'):
+            with self.assertRaises(CommandError):
+                call_command(command, '--file', self.writeItems([('100', 'Oats', 6)]), '--upsert', '--method', 'copy', stdout=StringIO())
+        self.assertEqual(ItemNutrient.objects.get(item__name='Oats').amount, 5)
+
+    def test_upsert_updates_the_ledger_in_chunks(self):
+        call_command('finalimporter3', '--file', self.writeItems([('100', 'Oats', 5), ('200', 'Rice', 3), ('300', 'Corn', 2)]), '--workers', '1', stdout=StringIO())
+        UserGoalNutrient.objects.create(goal=self.goal, nutrient=self.protein, targetValue=10)
+        for barcode in ('100', '200'):
+            self.consume(item=Item.objects.get(barcode=barcode).id, portion=1)
+        self.assertEqual(self.getStatus()[self.protein.id], 5 + 3)
+
+        # A tiny chunk size splits the lookups and deletes of one batch
+        with mock.patch('nutrition.management.commands.finalimporter3.LOOKUP_CHUNK_SIZE', 2):
+            call_command('finalimporter3', '--file', self.writeItems([('100', 'Oats', 6), ('200', 'Rice', 4), ('300', 'Corn', 1)]), '--workers', '1', '--upsert', stdout=StringIO())
+
+        self.assertEqual(sorted(ItemNutrient.objects.filter(item__barcode__isnull=False).values_list('item__barcode', 'amount')), [('100', 6), ('200', 4), ('300', 1)])
+        self.assertEqual(self.getStatus()[self.protein.id], 6 + 4)
+        output = StringIO()
+        call_command('rebuild_nutrient_ledger', '--check', stdout=output)
+        self.assertIn('Ledger matches', output.getvalue())
+
+    def test_serving_sizes_are_shared_by_imported_and_created_items(self):
+        call_command('finalimporter3', '--file', self.writeItems([('100', 'Oats', 5), ('200', 'Rice', 3)]), '--workers', '1', stdout=StringIO())
+        thirtyGrams = ServingSize.objects.get(amount=30)
+        self.assertEqual(list(Item.objects.filter(barcode__isnull=False).values_list('servingSize', flat=True).distinct()), [thirtyGrams.id])
+
+        # A changed serving size points the item at another row instead of editing the shared one
+        call_command('finalimporter3', '--file', self.writeItems([('200', 'Rice', 3)], servingSize='100g'), '--workers', '1', '--upsert', stdout=StringIO())
+        self.assertEqual(Item.objects.get(barcode='200').servingSize, self.apple.servingSize)
+        self.assertEqual(Item.objects.get(barcode='100').servingSize, thirtyGrams)
+        self.assertEqual(ServingSize.objects.get(id=thirtyGrams.id).amount, 30)
+
+        data = {'name': 'Granola', 'calories': 120, 'serving_amount': 30, 'serving_unit': self.unit.id, 'nutrients': {}}
+        response = self.client.post(reverse('item-create'), data, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['item']['servingSize'], thirtyGrams.id)
+        self.assertEqual(ServingSize.objects.count(), 2)
+
+    def test_shared_serving_sizes_are_only_changed_by_admins(self):
+        thirtyGrams = ServingSize.objects.create(amount=30, unit=self.unit)
+        url = reverse('servingsize-detail', args=[self.apple.servingSize.id])
+        self.assertEqual(self.client.patch(url, {'amount': 50}).status_code, 403)
+        self.assertEqual(self.client.delete(url).status_code, 403)
+
+        self.user.is_staff = True
+        self.user.save()
+        # Changing "100 g" into the existing "30 g", or deleting it while items use it, is rejected
+        self.assertEqual(self.client.patch(url, {'amount': 30}).status_code, 400)
+        self.assertEqual(self.client.delete(url).status_code, 400)
+        self.assertTrue(Item.objects.filter(id=self.apple.id).exists())
+        self.assertEqual(self.client.delete(reverse('servingsize-detail', args=[thirtyGrams.id])).status_code, 204)
+
+    @unittest.skipUnless(importlib.util.find_spec('numpy'), 'numpy is not installed')
+    def test_columnar_file_imports_the_same_items(self):
+        path = self.writeItems([('100', 'Oats', 5), ('200', 'Rice', 10**6)])
+        columnar = os.path.join(self.directory.name, 'items.npz')
+        call_command('columnardata', '--file', path, '--output', columnar, stdout=StringIO())
+        call_command('finalimporter3', '--file', columnar, stdout=StringIO())
+
+        imported = Item.objects.filter(isCustom=False, barcode__isnull=False)
+        self.assertEqual(sorted(imported.values_list('barcode', 'name', 'calories', 'servingSize__amount')), [('100', 'Oats', 100, 30), ('200', 'Rice', 100, 30)])
+        self.assertEqual(list(ItemNutrient.objects.filter(item__in=imported).values_list('item__barcode', 'amount')), [('100', 5)])
+
+        # Re-importing the same products from JSONL finds nothing changed
+        output = StringIO()
+        call_command('finalimporter3', '--file', path, '--workers', '1', '--upsert', stdout=output)
+        self.assertIn('Successfully imported 0 items', output.getvalue())
+
+    def test_pipeline_imports_the_dump_in_one_pass(self):
+        Nutrient.objects.create(name='Sodium', unit=Unit.objects.create(name='milligram', abbreviation='mg'))
+        path = os.path.join(self.directory.name, 'dump.jsonl')
+        with open(path, 'w') as file:
+            for code, name, servingSize in [('100', 'Chocolate chip cookies', '30g (2 cookies)'), ('200', 'Biscuits au chocolat et aux noisettes', '30g (2 biscuits)'), ('000', 'Peanut butter cookies', '30g (2 cookies)')]:
+                file.write(json.dumps({'code': code, 'product_name': name, 'serving_size': servingSize, 'nutriments': {'energy-kcal_100g': 500, 'proteins_serving': 1.5, 'sodium_serving': 0.12}}) + '\n')
+        normalized = os.path.join(self.directory.name, 'normalized.jsonl')
+
+        output = StringIO()
+        call_command('pipelineimporter', '--file', path, '--workers', '1', '--tee', f'normalized={normalized}', stdout=output)
+        self.assertIn('Successfully imported 1 items', output.getvalue())
+
+        item = Item.objects.get(barcode='100')
+        self.assertEqual((item.name, item.calories, item.servingSize.amount, item.servingSize.unit.name), ('Chocolate chip cookies', 150, 2, 'cookies'))
+        self.assertEqual(dict(item.itemnutrient_set.values_list('nutrient__name', 'amount')), {'Protein': Decimal('1.5'), 'Sodium': Decimal('120')})
+        self.assertFalse(Item.objects.filter(barcode__in=['200', '000']).exists())
+        with open(normalized) as file:
+            self.assertEqual([json.loads(line)['barcode'] for line in file], ['100'])
+
+    def test_massaging_in_tiny_chunks_matches_a_serial_run(self):
+        path = os.path.join(self.directory.name, 'dump.jsonl')
+        names = ['Chocolate chip cookies', 'Crème brûlée with caramelised sugar', 'Biscuits au chocolat et aux noisettes', 'Peanut butter', 'Smoked salmon fillets']
+        with open(path, 'w', encoding='utf-8') as file:
+            for i in range(40):
+                product = {'code': '000' if i % 7 == 0 else str(1000 + i), 'product_name': names[i % len(names)] + ' x' * (i % 5), 'serving_size': '30g', 'nutriments': {'energy-kcal_100g': i}}
+                if i % 6 == 0:
+                    del product['serving_size']
+                file.write(json.dumps(product, ensure_ascii=False) + '\n')
+
+        with open(path, encoding='utf-8') as file:
+            lines = file.readlines()
+        expected = [product for product in map(massageLine, lines) if product is not None]
+        self.assertTrue(expected)
+
+        # Chunks smaller than a line, so lines (and multibyte characters) cross range boundaries
+        lineLength = len(lines[0].encode('utf-8'))
+        for chunkSize in (1, 37, lineLength, lineLength + 1):
+            results = list(massage_file(path, 2, chunkSize))
+            self.assertEqual([product for size, products, lineCount in results for product in products], expected)
+            self.assertEqual(sum(lineCount for size, products, lineCount in results), len(lines))
+            self.assertEqual(sum(size for size, products, lineCount in results), os.path.getsize(path))
+
+
+# COPY commits its own transaction (which drops the staging tables), so this can't run inside a TestCase
+@unittest.skipUnless(supportsCopy(), 'COPY needs PostgreSQL and psycopg 3')
+class ItemCopyImportTests(TransactionTestCase):
+
+    def test_copied_nutrients_reference_the_reserved_item_ids(self):
+        unit = Unit.objects.create(name='gram', abbreviation='g')
+        protein = Nutrient.objects.create(name='Protein', unit=unit)
+        servingSize = ServingSize.objects.create(amount=100, unit=unit)
+        before = Item.objects.create(name='Apple', calories=50, servingSize=servingSize)
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'items.jsonl')
+            with open(path, 'w') as file:
+                for barcode, name, amount in [('100', 'Oats', 5), ('200', 'Rice', 3), ('300', 'Corn', 2)]:
+                    file.write(json.dumps({'barcode': barcode, 'name': name, 'calories': 100, 'serving_size_grams': '30g', 'serving_size_other': None, 'nutrients': {'Protein': {'amount_per_serving': amount, 'unit': 'g'}}}) + '\n')
+            call_command('finalimporter3', '--file', path, '--workers', '1', '--batch-size', '2', '--method', 'copy', stdout=StringIO())
+
+        imported = Item.objects.filter(barcode__isnull=False)
+        importedIds = list(imported.values_list('id', flat=True))
+        self.assertEqual(sorted(imported.values_list('barcode', 'name')), [('100', 'Oats'), ('200', 'Rice'), ('300', 'Corn')])
+        self.assertGreater(min(importedIds), before.id)
+        self.assertEqual(sorted(ItemNutrient.objects.values_list('item__barcode', 'nutrient', 'amount')), [('100', protein.id, 5), ('200', protein.id, 3), ('300', protein.id, 2)])
+        # The sequence moved past the reserved ids
+        self.assertGreater(Item.objects.create(name='Pear', calories=60, servingSize=servingSize).id, max(importedIds))
+
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT to_regclass('staging_nutrition_item'), to_regclass('staging_nutrition_itemnutrient')")
+            self.assertEqual(cursor.fetchone(), (None, None))
+
+
+@unittest.skipUnless(importlib.util.find_spec('numpy'), 'numpy is not installed')
+class NutrientVectorTests(NutritionTestCase):
+
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings = override_settings(NUTRIENT_VECTOR_DIR=os.path.join(directory.name, 'vectors'))
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.store = NutrientVectorStore()
+
+    def test_vectors_follow_nutrient_order_and_later_changes(self):
+        first, second = self.addGoalNutrients(2)
+        ItemNutrient.objects.filter(item=self.bread, nutrient=second).update(amount=7)
+        call_command('rebuild_nutrient_vectors', stdout=StringIO())
+
+        nutrientIds, vectors = self.store.getVectors([self.bread.id, self.apple.id, self.bread.id])
+        self.assertEqual(nutrientIds, [first.id, second.id])
+        self.assertEqual(vectors.tolist(), [[3, 7], [1, 1], [3, 7]])
+
+        # Items changed or created after the build are read from the database
+        ItemNutrient.objects.filter(item=self.apple, nutrient=first).get().delete()
+        banana = Item.objects.create(name='Banana', calories=90, servingSize=self.apple.servingSize)
+        ItemNutrient.objects.create(item=banana, nutrient=second, amount=4)
+        with self.assertNumQueries(2):
+            nutrientIds, vectors = self.store.getVectors([self.apple.id, banana.id, self.bread.id])
+        self.assertEqual(vectors.tolist(), [[0, 1], [0, 4], [3, 7]])
+
+        # Changes are recorded in the database, so they aren't lost when the cache is cleared
+        ItemNutrient.objects.filter(item=self.bread, nutrient=second).update(amount=9)
+        ItemNutrient.objects.get(item=self.bread, nutrient=second).save()
+        cache.clear()
+        self.assertEqual(self.store.getVectors([self.bread.id])[1].tolist(), [[3, 9]])
@@ -0,0 +1,227 @@
+import bisect
+import heapq
+import re
+import threading
+import time
+from array import array
+from itertools import islice
+
+from django.db import connection
+from django.db.models import Count
+
+from nutrition.models import Item
+
+# Rebuild the index from the database after this many seconds so items added by other processes show up
+MAX_AGE = 60 * 60
+
+TOKEN_PATTERN = re.compile(r'\w+')
+
+# Prefixes up to this length match thousands of tokens, so each one's merged posting array is kept instead
+SHORT_PREFIX_LENGTH = 2
+
+# Stop after checking this many candidates, so a query whose words rarely appear together still returns quickly
+MAX_CANDIDATES = 5000
+
+# Split a name into lowercase word tokens
+def tokenize(name):
+    return TOKEN_PATTERN.findall(name.lower())
+
+# Pack the item search ordering (shortest name, then most nutrients, then lowest id) into one sortable integer
+def rankKey(itemId, name, nutrientCount):
+    return (min(len(name), 0x7FFF) << 48) | ((0xFFFF - min(nutrientCount, 0xFFFF)) << 32) | (itemId & 0xFFFFFFFF)
+
+# Get the nutrient count packed into a rank key
+def rankNutrientCount(key):
+    return 0xFFFF - ((key >> 32) & 0xFFFF)
+
+
+# In-memory prefix index of item names
+# Distinct tokens are kept in a sorted list; each token maps to an array of item positions sorted by rank,
+# so the best suggestions for a prefix are found by merging the posting arrays of the matching tokens
+# Short prefixes have their own posting arrays, already merged when the index is built
+class ItemNameIndex:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # Held while the index is built, so only one thread reads every item at a time
+        self.buildLock = threading.Lock()
+        self.refreshThread = None
+        self.invalidate()
+
+    def invalidate(self):
+        self.builtAt = None
+        self.changesDuringBuild = None
+        self.tokens = []
+        self.postings = []
+        self.shortPrefixes = {}
+        self.ids = array('q')
+        self.names = []
+        self.rankKeys = array('q')
+        self.positions = {}
+        # Positions of deleted items and of the old names of renamed items
+        self.removed = set()
+
+    # Load every item name and nutrient count in one query and build the index
+    def build(self):
+        with self.lock:
+            self.changesDuringBuild = []
+        rows = Item.objects.annotate(nutrientCount=Count('nutrients')).values_list('id', 'name', 'nutrientCount').order_by()
+        rows = sorted(((rankKey(*row), row[0], row[1]) for row in rows.iterator(chunk_size=10000)))
+
+        ids = array('q')
+        names = []
+        rankKeys = array('q')
+        positions = {}
+        postingsByToken = {}
+        shortPrefixes = {}
+        for position, (key, itemId, name) in enumerate(rows):
+            ids.append(itemId)
+            names.append(name)
+            rankKeys.append(key)
+            positions[itemId] = position
+            # Items are visited in rank order, so every posting array is built already sorted
+            itemTokens = set(tokenize(name))
+            for token in itemTokens:
+                postingsByToken.setdefault(token, array('l')).append(position)
+            for prefix in {token[:length] for token in itemTokens for length in range(1, SHORT_PREFIX_LENGTH + 1)}:
+                shortPrefixes.setdefault(prefix, array('l')).append(position)
+
+        tokens = sorted(postingsByToken)
+        with self.lock:
+            changes = self.changesDuringBuild
+            self.changesDuringBuild = None
+            self.tokens = tokens
+            self.postings = [postingsByToken[token] for token in tokens]
+            self.shortPrefixes = shortPrefixes
+            self.ids = ids
+            self.names = names
+            self.rankKeys = rankKeys
+            self.positions = positions
+            self.removed = set()
+            self.builtAt = time.monotonic()
+
+        # Items created, renamed, or deleted while the rows were being read may not match them
+        for change, args in changes:
+            change(*args)
+
+    # Build the index in a background thread, unless a build is already running
+    # Requests that need the index before it is built wait for that build in ensureBuilt
+    def startBuild(self):
+        if self.buildLock.acquire(blocking=False):
+            self.refreshThread = threading.Thread(target=self.refresh, daemon=True)
+            self.refreshThread.start()
+
+    # Build the index if it hasn't been (normally it is started when the server starts), with other requests waiting for that one build
+    # Once built, an index older than MAX_AGE is rebuilt in the background while requests keep using the old one
+    def ensureBuilt(self):
+        if self.builtAt is None:
+            with self.buildLock:
+                if self.builtAt is None:
+                    self.build()
+        elif time.monotonic() - self.builtAt > MAX_AGE:
+            self.startBuild()
+
+    def refresh(self):
+        try:
+            self.build()
+        finally:
+            self.buildLock.release()
+            # The thread's database connection isn't closed by the request cycle
+            connection.close()
+
+    # Record a change made while the index is being built so it is applied to the new index too
+    # Returns whether the index has been built, since changes before then are already in the database it is built from
+    def recordChange(self, change, *args):
+        if self.changesDuringBuild is not None:
+            self.changesDuringBuild.append((change, args))
+        return self.builtAt is not None
+
+    # Add a newly created item without rebuilding
+    def add(self, item, nutrientCount):
+        with self.lock:
+            if self.recordChange(self.add, item, nutrientCount) and item.id not in self.positions:
+                self.insert(item.id, item.name, rankKey(item.id, item.name, nutrientCount))
+
+    # Move an item to its new name without rebuilding
+    def rename(self, item):
+        with self.lock:
+            if not self.recordChange(self.rename, item):
+                return
+            position = self.positions.get(item.id)
+            if position is not None and self.names[position] != item.name:
+                self.removed.add(position)
+                self.insert(item.id, item.name, rankKey(item.id, item.name, rankNutrientCount(self.rankKeys[position])))
+
+    # Drop a deleted item without rebuilding
+    def remove(self, itemId):
+        with self.lock:
+            if self.recordChange(self.remove, itemId) and itemId in self.positions:
+                self.removed.add(self.positions.pop(itemId))
+
+    # Append an item at a new position and insert it into the posting arrays of its tokens and short prefixes
+    def insert(self, itemId, name, key):
+        position = len(self.ids)
+        self.ids.append(itemId)
+        self.names.append(name)
+        self.rankKeys.append(key)
+        self.positions[itemId] = position
+
+        itemTokens = set(tokenize(name))
+        for token in itemTokens:
+            i = bisect.bisect_left(self.tokens, token)
+            if i == len(self.tokens) or self.tokens[i] != token:
+                self.tokens.insert(i, token)
+                self.postings.insert(i, array('l'))
+            bisect.insort(self.postings[i], position, key=self.rankKeys.__getitem__)
+        for prefix in {token[:length] for token in itemTokens for length in range(1, SHORT_PREFIX_LENGTH + 1)}:
+            bisect.insort(self.shortPrefixes.setdefault(prefix, array('l')), position, key=self.rankKeys.__getitem__)
+
+    # Posting arrays of every token that starts with the prefix
+    def prefixPostings(self, prefix):
+        if len(prefix) <= SHORT_PREFIX_LENGTH:
+            postings = self.shortPrefixes.get(prefix)
+            return [postings] if postings else []
+
+        postings = []
+        i = bisect.bisect_left(self.tokens, prefix)
+        while i < len(self.tokens) and self.tokens[i].startswith(prefix):
+            postings.append(self.postings[i])
+            i += 1
+        return postings
+
+    # Get the top items whose names have a token starting with each word of the query, in item search order
+    def suggest(self, query, limit=10):
+        words = tokenize(query)
+        if not words:
+            return []
+
+        self.ensureBuilt()
+
+        with self.lock:
+            matches = [(word, self.prefixPostings(word)) for word in set(words)]
+            if not all(postings for word, postings in matches):
+                return []
+
+            # Walk the rarest word's postings in rank order and keep items whose names also match every other word
+            matches.sort(key=lambda match: sum(map(len, match[1])))
+            otherWords = [word for word, postings in matches[1:]]
+            candidates = heapq.merge(*matches[0][1], key=self.rankKeys.__getitem__)
+
+            suggestions = []
+            previous = None
+            for position in islice(candidates, MAX_CANDIDATES):
+                # An item with several tokens matching the same prefix appears once per token
+                if position == previous or position in self.removed:
+                    continue
+                previous = position
+
+                nameTokens = tokenize(self.names[position]) if otherWords else []
+                if all(any(token.startswith(word) for token in nameTokens) for word in otherWords):
+                    suggestions.append({'id': self.ids[position], 'name': self.names[position]})
+                    if len(suggestions) == limit:
+                        break
+
+            return suggestions
+
+
+itemNameIndex = ItemNameIndex()
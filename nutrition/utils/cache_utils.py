@@ -0,0 +1,47 @@
+from urllib.parse import quote
+
+from django.core.cache import cache
+
+from nutrition.api import serializers
+from nutrition.models import Item
+from nutrition.utils.version_utils import cacheTimeout
+
+# How long (in seconds) to cache the items for a barcode, and how long to remember that a barcode has no items
+# (both kept for at most LOCAL_CACHE_TIMEOUT in a local memory cache, see version_utils)
+BARCODE_TIMEOUT = 60 * 60 * 24
+MISSING_BARCODE_TIMEOUT = 60 * 5
+
+# Get the cache key for a barcode (quoted so any query string value makes a valid key)
+def barcodeKey(barcode):
+    return f'barcode:{quote(barcode, safe="")}'
+
+# Get the serialized items with a barcode, without the per-user isFavorite flag
+# Barcodes with no items are cached as an empty list for a shorter time so repeated scans of unknown codes skip the database
+def getItemsByBarcode(barcode):
+    return getItemsByBarcodes([barcode])[barcode]
+
+# Get a dict of each barcode to its serialized items, reading the cache in one call and loading any misses in one query
+def getItemsByBarcodes(barcodes):
+    keys = {barcode: barcodeKey(barcode) for barcode in barcodes}
+    cached = cache.get_many(keys.values())
+    itemsByBarcode = {barcode: cached[key] for barcode, key in keys.items() if key in cached}
+
+    uncached = [barcode for barcode in keys if barcode not in itemsByBarcode]
+    if uncached:
+        loaded = {barcode: [] for barcode in uncached}
+        queryset = Item.objects.filter(barcode__in=uncached).prefetch_related('nutrients')
+        for item in serializers.ItemSerializer(queryset, many=True).data:
+            loaded[item['barcode']].append(dict(item))
+
+        cache.set_many({keys[barcode]: items for barcode, items in loaded.items() if items}, cacheTimeout(BARCODE_TIMEOUT))
+        cache.set_many({keys[barcode]: items for barcode, items in loaded.items() if not items}, cacheTimeout(MISSING_BARCODE_TIMEOUT))
+        itemsByBarcode.update(loaded)
+
+    return itemsByBarcode
+
+def invalidateBarcode(barcode):
+    if barcode:
+        cache.delete(barcodeKey(barcode))
+
+def invalidateBarcodes(barcodes):
+    cache.delete_many([barcodeKey(barcode) for barcode in barcodes if barcode])
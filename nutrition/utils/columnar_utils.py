@@ -0,0 +1,117 @@
+from nutrition.utils.import_utils import MAX_AMOUNT, productServing
+
+# Compressed columnar copy of a massaged item file (NumPy .npz), which loads much faster than parsing JSONL line by line
+# Strings are stored as one NUL separated UTF-8 blob per column, and the nutrients as a sparse matrix with one row per item
+# (the amounts of row i are nutrientAmounts[nutrientRows[i]:nutrientRows[i + 1]], in the columns nutrientColumns of the same slice)
+# Values are stored unfiltered, so the MAX_AMOUNT checks are applied to whole columns when the file is read
+# This module needs numpy, which is an optional dependency only used by this format
+
+# Store a list of strings (or None) as a blob and a mask of which are missing
+def encodeStrings(np, values):
+    missing = np.array([value is None for value in values], dtype=bool)
+    blob = '\0'.join(value or '' for value in values).encode('utf-8')
+    return np.frombuffer(blob, dtype=np.uint8), missing
+
+def decodeStrings(blob, missing=None):
+    values = blob.tobytes().decode('utf-8').split('\0')
+    if missing is not None:
+        values = [None if isMissing else value for value, isMissing in zip(values, missing.tolist())]
+    return values
+
+# Number strings by their position in table (adding new ones to it), with None as -1
+def indexStrings(np, values, table):
+    return np.array([-1 if value is None else table.setdefault(value, len(table)) for value in values], dtype=np.int32)
+
+# Write massaged products (the JSONL format finalimporter3 reads) to a compressed columnar file
+def writeColumnar(path, products):
+    import numpy as np
+
+    barcodes = []
+    names = []
+    calories = []
+    servingAmounts = []
+    servingUnits = []
+    nutrientRows = [0]
+    nutrientColumns = []
+    nutrientAmounts = []
+    nutrientUnits = []
+    nutrientNames = {}
+    for product in products:
+        servingAmount, servingUnit = productServing(product)
+        barcodes.append(product.get('barcode'))
+        names.append(product.get('name'))
+        calories.append(product.get('calories'))
+        servingAmounts.append(servingAmount)
+        servingUnits.append(servingUnit)
+        for nutrientName, values in (product.get('nutrients') or {}).items():
+            amountPerServing = values.get('amount_per_serving')
+            if amountPerServing is None:
+                continue
+            if nutrientName == "Carbohydrates":
+                nutrientName = "Carbohydrate"
+            nutrientColumns.append(nutrientNames.setdefault(nutrientName, len(nutrientNames)))
+            nutrientAmounts.append(amountPerServing)
+            nutrientUnits.append(values.get('unit'))
+        nutrientRows.append(len(nutrientColumns))
+
+    unitNames = {}
+    barcodeBlob, barcodeMissing = encodeStrings(np, barcodes)
+    nameBlob, nameMissing = encodeStrings(np, names)
+    servingUnits = indexStrings(np, servingUnits, unitNames)
+    nutrientUnits = indexStrings(np, nutrientUnits, unitNames)
+    np.savez_compressed(
+        path,
+        barcodes=barcodeBlob,
+        barcodeMissing=barcodeMissing,
+        names=nameBlob,
+        nameMissing=nameMissing,
+        calories=np.array(calories, dtype=np.float64),
+        servingAmounts=np.array(servingAmounts, dtype=np.float64),
+        servingUnits=servingUnits,
+        unitNames=encodeStrings(np, list(unitNames))[0],
+        nutrientNames=encodeStrings(np, list(nutrientNames))[0],
+        nutrientRows=np.array(nutrientRows, dtype=np.int64),
+        nutrientColumns=np.array(nutrientColumns, dtype=np.int32),
+        nutrientAmounts=np.array(nutrientAmounts, dtype=np.float64),
+        nutrientUnits=nutrientUnits,
+    )
+    return len(barcodes)
+
+# Read a columnar file as batches of item records (the same records parseItem makes from JSONL), skipping the same items
+def readColumnar(path, batchSize=1000):
+    import numpy as np
+
+    with np.load(path) as data:
+        barcodes = decodeStrings(data['barcodes'], data['barcodeMissing'])
+        names = decodeStrings(data['names'], data['nameMissing'])
+        # Unit number -1 (None) picks the None at the end
+        unitNames = decodeStrings(data['unitNames']) + [None]
+        nutrientNames = decodeStrings(data['nutrientNames'])
+        calories = data['calories']
+        servingAmounts = np.round(data['servingAmounts'], 2)
+        servingUnits = data['servingUnits']
+        nutrientRows = data['nutrientRows']
+        nutrientColumns = data['nutrientColumns']
+        nutrientAmounts = data['nutrientAmounts']
+        nutrientUnits = data['nutrientUnits']
+
+    # Drop items without a usable serving size or calories, then out of range nutrient amounts and the nutrients of dropped items
+    keepItems = ~np.isnan(calories) & (servingAmounts < MAX_AMOUNT)
+    rowNumbers = np.repeat(np.arange(len(calories)), np.diff(nutrientRows))
+    keepNutrients = (nutrientAmounts <= MAX_AMOUNT) & keepItems[rowNumbers]
+    nutrientRows = np.concatenate(([0], np.cumsum(np.bincount(rowNumbers[keepNutrients], minlength=len(calories))))).tolist()
+    nutrients = list(zip(
+        [nutrientNames[column] for column in nutrientColumns[keepNutrients].tolist()],
+        nutrientAmounts[keepNutrients].tolist(),
+        [unitNames[unit] for unit in nutrientUnits[keepNutrients].tolist()],
+    ))
+    keepItems = np.flatnonzero(keepItems).tolist()
+
+    calories = calories.tolist()
+    servingAmounts = servingAmounts.tolist()
+    servingUnits = [unitNames[unit] for unit in servingUnits.tolist()]
+    for start in range(0, len(keepItems), batchSize):
+        yield [
+            (barcodes[i], names[i], calories[i], servingAmounts[i], servingUnits[i], nutrients[nutrientRows[i]:nutrientRows[i + 1]])
+            for i in keepItems[start:start + batchSize]
+        ]
@@ -0,0 +1,29 @@
+from django.db import connection
+
+# Helpers for loading rows into PostgreSQL with COPY FROM STDIN (psycopg 3 only)
+
+# Check whether the database connection can load rows with COPY
+def supportsCopy():
+    if connection.vendor != 'postgresql':
+        return False
+    from django.db.backends.postgresql.psycopg_any import is_psycopg3
+    return is_psycopg3
+
+# Reserve count primary keys from a model table's id sequence, so rows in other tables can reference them before they are loaded
+def reserveIds(cursor, model, count):
+    cursor.execute("SELECT nextval(pg_get_serial_sequence(%s, 'id')) FROM generate_series(1, %s)", [model._meta.db_table, count])
+    return [row[0] for row in cursor.fetchall()]
+
+# Copy rows (tuples of the given model fields) into a staging table, then move them into the model's table in one statement
+# The staging table only has the copied columns and no constraints, and is dropped when the transaction commits
+def copyRows(cursor, model, fields, rows):
+    quote = connection.ops.quote_name
+    table = quote(model._meta.db_table)
+    staging = quote(f'staging_{model._meta.db_table}')
+    columns = ', '.join(quote(model._meta.get_field(field).column) for field in fields)
+
+    cursor.execute(f'CREATE TEMPORARY TABLE {staging} ON COMMIT DROP AS SELECT {columns} FROM {table} WITH NO DATA')
+    with cursor.copy(f'COPY {staging} ({columns}) FROM STDIN') as copy:
+        for row in rows:
+            copy.write_row(row)
+    cursor.execute(f'INSERT INTO {table} ({columns}) SELECT {columns} FROM {staging}')
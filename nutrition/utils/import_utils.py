@@ -0,0 +1,322 @@
+import functools
+import hashlib
+import json
+import os
+import re
+import time
+
+from langdetect import DetectorFactory, detect
+from langdetect.lang_detect_exception import LangDetectException
+
+# Pure parsing helpers for the OpenFoodFacts importers
+# This module must not import Django models: it is imported by importer worker processes, which don't set up Django
+
+# langdetect is random unless seeded, which would make memoized and repeated runs disagree
+DetectorFactory.seed = 0
+
+# Amounts at or above this are treated as data entry errors and skipped
+MAX_AMOUNT = 10**5
+
+def parseServings(servingSize):
+    numPart = ""
+    unitPart = ""
+    for i in range(len(servingSize)):
+        if servingSize[i].isalpha():
+            unitPart += servingSize[i]
+        else:
+            numPart += servingSize[i]
+    return numPart, unitPart
+
+# Get the serving amount and unit of a product, or (None, None) if it has no usable serving size
+def productServing(data):
+    # Use the alternate serving size if it exists (and isn't in kcal), otherwise use grams
+    servingSize = data.get('serving_size_other')
+    if servingSize is None or "kcal" in servingSize:
+        servingSize = data.get('serving_size_grams')
+    if not servingSize:
+        return None, None
+    servingAmount, servingUnit = parseServings(servingSize)
+
+    try:
+        return float(servingAmount), servingUnit
+    except ValueError:
+        return None, None
+
+# Parse one massaged JSONL line into an item record, or None if the item should be skipped
+# A record is (barcode, name, calories, servingAmount, servingUnit, [(nutrientName, amountPerServing, unit), ...])
+def parseItem(line):
+    return parseProduct(json.loads(line))
+
+def parseProduct(data):
+    servingAmount, servingUnit = productServing(data)
+    if servingAmount is None:
+        return None
+    servingAmount = round(servingAmount, 2)
+    if servingAmount >= MAX_AMOUNT:
+        return None
+
+    calories = data.get('calories')
+    if calories is None:
+        return None
+
+    nutrients = []
+    for nutrientName, values in (data.get('nutrients') or {}).items():
+        amountPerServing = values.get('amount_per_serving')
+        if amountPerServing is None or amountPerServing > MAX_AMOUNT:
+            continue
+        if nutrientName == "Carbohydrates":
+            nutrientName = "Carbohydrate"
+        nutrients.append((nutrientName, amountPerServing, values.get('unit')))
+
+    return (data.get('barcode'), data.get('name'), calories, servingAmount, servingUnit, nutrients)
+
+# Hash the content of an item record, so re-imports can tell whether a product changed
+# Numbers and the nutrient order are normalized, so the same product hashes the same when read from JSONL or a columnar file
+def recordHash(record):
+    barcode, name, calories, servingAmount, servingUnit, nutrients = record
+    nutrients = sorted((nutrientName, float(amount), unit or '') for nutrientName, amount, unit in nutrients)
+    return hashlib.sha256(json.dumps((barcode, name, float(calories), float(servingAmount), servingUnit, nutrients)).encode()).hexdigest()
+
+# Parse a chunk of lines in a worker process, dropping skipped items
+def parseChunk(lines):
+    records = []
+    for line in lines:
+        record = parseItem(line)
+        if record is not None:
+            records.append(record)
+    return records
+
+# Read a file in chunks of lines so each chunk can be parsed by a worker
+def readChunks(file, chunkSize):
+    chunk = []
+    for line in file:
+        chunk.append(line)
+        if len(chunk) >= chunkSize:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+# Massaging the raw OpenFoodFacts dump (massagedata)
+
+# Substrings every usable raw line contains, checked before parsing so most of the dump is never decoded as JSON
+REQUIRED_KEYS = ('"energy-kcal_100g"', '"serving_size"', '"product_name"')
+
+def isAllZero(code):
+    for i in code:
+        if i != '0':
+            return False
+    return True
+
+# Detect the language of a product name, or None if it can't be detected
+# Many products share a name, so results are memoized per worker process
+@functools.lru_cache(maxsize=2**18)
+def detectLanguage(name):
+    try:
+        return detect(name)
+    except LangDetectException:
+        return None
+
+# Turn one raw OpenFoodFacts line into a massaged product dict, or None if the product is skipped
+# The cheap checks on missing data run before language detection, which is by far the slowest step
+def massageLine(line):
+    if not all(key in line for key in REQUIRED_KEYS):
+        return None
+    data = json.loads(line)
+
+    code = data.get('code')
+    productName = data.get('product_name')
+    nutrients = data.get('nutriments')
+    servingSize = data.get('serving_size')
+    if not code or isAllZero(code) or not productName or nutrients is None or servingSize is None or nutrients.get('energy-kcal_100g') is None:
+        return None
+    if detectLanguage(productName) != 'en':
+        return None
+
+    return {
+        'code': code,
+        'product_name': productName,
+        'nutrients': nutrients,
+        'calories': nutrients.get('energy-kcal_100g'),
+        'serving_size': servingSize,
+    }
+
+# Split a file into byte ranges of about chunkSize bytes, so workers can each read their own part of it
+def byteRanges(path, chunkSize):
+    size = os.path.getsize(path)
+    return [(start, min(start + chunkSize, size)) for start in range(0, size, chunkSize)]
+
+# Massage the lines that start within a byte range of a file, returning the massaged products and the number of lines read
+# A line that crosses the end of the range belongs to this range, and is skipped by the range that contains the rest of it
+def massageRange(path, start, end):
+    products = []
+    lineCount = 0
+    with open(path, 'rb') as file:
+        if start > 0:
+            file.seek(start - 1)
+            file.readline()
+        while file.tell() < end:
+            line = file.readline()
+            if not line:
+                break
+            lineCount += 1
+            product = massageLine(line.decode('utf-8'))
+            if product is not None:
+                products.append(product)
+    return products, lineCount
+
+
+# Preprocessing stages (pipelineimporter)
+# Each stage is a generator over the products of the previous one, so the dump is read once and nothing is held in memory
+
+# OpenFoodFacts nutriment keys of the nutrients in data/nutrients.csv
+OFF_NUTRIENTS = {
+    'carbohydrates': 'Carbohydrate',
+    'fiber': 'Total Fiber',
+    'fat': 'Fat',
+    'linoleic-acid': 'Linoleic Acid',
+    'alpha-linolenic-acid': 'α-Linolenic Acid',
+    'proteins': 'Protein',
+    'vitamin-a': 'Vitamin A',
+    'vitamin-c': 'Vitamin C',
+    'vitamin-d': 'Vitamin D',
+    'vitamin-e': 'Vitamin E',
+    'vitamin-k': 'Vitamin K',
+    'vitamin-b1': 'Thiamin',
+    'vitamin-b2': 'Riboflavin',
+    'vitamin-pp': 'Niacin',
+    'vitamin-b6': 'Vitamin B6',
+    'vitamin-b9': 'Folate',
+    'vitamin-b12': 'Vitamin B12',
+    'pantothenic-acid': 'Pantothenic Acid',
+    'biotin': 'Biotin',
+    'choline': 'Choline',
+    'calcium': 'Calcium',
+    'chromium': 'Chromium',
+    'copper': 'Copper',
+    'fluoride': 'Fluoride',
+    'iodine': 'Iodine',
+    'iron': 'Iron',
+    'magnesium': 'Magnesium',
+    'manganese': 'Manganese',
+    'molybdenum': 'Molybdenum',
+    'phosphorus': 'Phosphorus',
+    'selenium': 'Selenium',
+    'zinc': 'Zinc',
+    'potassium': 'Potassium',
+    'sodium': 'Sodium',
+    'chloride': 'Chloride',
+}
+
+# OpenFoodFacts stores per serving amounts in grams, these convert them to the nutrient's unit
+GRAM_FACTORS = {
+    'g': 1,
+    'mg': 1000,
+    'μg': 1000000,
+}
+
+def parse_serving_size(serving_size_str):
+    # Regex pattern to match serving size in grams and in parentheses
+    pattern = r'(\d+g) \(([^)]+)\)'
+    match = re.search(pattern, serving_size_str)
+    if match:
+        serving_size_grams = match.group(1)
+        serving_size_parentheses = match.group(2)
+        return serving_size_grams, serving_size_parentheses
+    else:
+        return None, None
+
+# Split each massaged product's serving size into its gram and alternate parts (what removebadss did)
+def splitServingSizes(products):
+    for product in products:
+        product['serving_size_grams'], product['serving_size_other'] = parse_serving_size(product.pop('serving_size'))
+        yield product
+
+# Turn each product into the item format finalimporter3 reads: nutrients are renamed to our names, converted from grams
+# to each nutrient's unit (nutrientUnits maps names to unit abbreviations), and calories are per serving instead of per 100g
+def normalizeNutrients(products, nutrientUnits):
+    for product in products:
+        offNutrients = product['nutrients']
+        try:
+            if offNutrients.get('energy-kcal_serving') is not None:
+                calories = float(offNutrients['energy-kcal_serving'])
+            else:
+                calories = float(product['calories']) * float(parseServings(product['serving_size_grams'])[0]) / 100
+        except (TypeError, ValueError):
+            calories = None
+
+        nutrients = {}
+        for key, name in OFF_NUTRIENTS.items():
+            amount = offNutrients.get(f'{key}_serving')
+            factor = GRAM_FACTORS.get(nutrientUnits.get(name))
+            if isinstance(amount, (int, float)) and factor is not None:
+                nutrients[name] = {'amount_per_serving': round(amount * factor, 4), 'unit': nutrientUnits[name]}
+
+        yield {
+            'barcode': product['code'],
+            'name': product['product_name'],
+            'calories': None if calories is None else round(calories),
+            'serving_size_grams': product['serving_size_grams'],
+            'serving_size_other': product['serving_size_other'],
+            'nutrients': nutrients,
+        }
+
+# Turn each normalized product into an item record, dropping the ones parseItem would skip
+def parseProducts(products):
+    for product in products:
+        record = parseProduct(product)
+        if record is not None:
+            yield record
+
+# Pass a stage's products through unchanged while writing each one to a JSONL file
+def teeStage(products, file):
+    for product in products:
+        file.write(json.dumps(product))
+        file.write("\n")
+        yield product
+
+
+# Writing item records (finalimporter3 and pipelineimporter)
+# Django and the writers are imported when called, since worker processes import this module without setting up Django
+
+# Get the batch writer selected by the importer's --method and --upsert options
+def batchWriter(command, options):
+    from django.core.management.base import CommandError
+    from nutrition.management.commands.finalimporter3 import write_batch_copy, write_batch_orm, write_batch_upsert
+    from nutrition.utils.copy_utils import supportsCopy
+
+    # Upserting updates existing rows, which COPY can't do
+    if options['upsert'] and options['method'] == 'copy':
+        raise CommandError('--upsert writes with the ORM and can\'t be combined with --method=copy.')
+
+    if options['upsert']:
+        return write_batch_upsert
+    if options['method'] == 'copy':
+        if supportsCopy():
+            return write_batch_copy
+        command.stdout.write(command.style.WARNING('COPY needs PostgreSQL and psycopg 3, using bulk_create instead.'))
+    return write_batch_orm
+
+# Write batches of item records, reporting progress and throughput, then rebuild the nutrient vectors if they are in use
+def importBatches(command, write_batch, batches):
+    from nutrition.management.commands.finalimporter3 import getNutrients, getServingSizes, getUnits
+    from nutrition.utils.vector_utils import buildVectors, vectorDir
+
+    units = getUnits()
+    nutrients = getNutrients()
+    servingSizes = getServingSizes()
+    itemCount = 0
+    rowCount = 0
+    start = time.monotonic()
+    for records in batches:
+        batchItems, batchRows = write_batch(records, units, nutrients, servingSizes)
+        itemCount += batchItems
+        rowCount += batchRows
+        elapsed = time.monotonic() - start
+        command.stdout.write(command.style.NOTICE(f"Imported {itemCount} items ({rowCount / elapsed:.0f} rows/sec)."))
+
+    command.stdout.write(command.style.SUCCESS(f'Successfully imported {itemCount} items ({rowCount} rows) in {time.monotonic() - start:.0f} seconds.'))
+
+    # Nutrient vectors are optional, rebuild them only if they have been built before
+    if os.path.exists(vectorDir()):
+        command.stdout.write(command.style.SUCCESS(f'Rebuilt nutrient vectors for {buildVectors()} items.'))
@@ -0,0 +1,63 @@
+from decimal import Decimal
+
+from django.db import transaction
+
+from nutrition.models import Item, ItemNutrient, ServingSize
+from nutrition.utils.autocomplete_utils import itemNameIndex
+
+
+# Round amounts the way the serving size amount column stores them, so parsed floats match the stored decimals
+def servingKey(amount, unitId):
+    return round(Decimal(str(amount)), 2), unitId
+
+# Get a dict of servingKey to the shared serving size for each (amount, unit ID) pair, creating the missing ones
+# Uses one query when every pair exists and three otherwise, however many pairs are asked for
+def internServingSizes(pairs):
+    keys = {servingKey(amount, unitId) for amount, unitId in pairs}
+    existing = ServingSize.objects.filter(amount__in={amount for amount, unitId in keys}, unit__in={unitId for amount, unitId in keys})
+    servingSizes = {servingKey(servingSize.amount, servingSize.unit_id): servingSize for servingSize in existing}
+
+    missing = [key for key in keys if key not in servingSizes]
+    if missing:
+        # Another request may create the same pairs meanwhile, so skip conflicts and read the rows back
+        ServingSize.objects.bulk_create([ServingSize(amount=amount, unit_id=unitId) for amount, unitId in missing], ignore_conflicts=True)
+        created = ServingSize.objects.filter(amount__in={amount for amount, unitId in missing}, unit__in={unitId for amount, unitId in missing})
+        servingSizes.update({servingKey(servingSize.amount, servingSize.unit_id): servingSize for servingSize in created})
+
+    return {key: servingSizes[key] for key in keys}
+
+# Point items built with unsaved serving sizes at the shared serving sizes of the same amounts and units
+def internItemServingSizes(items):
+    servingSizes = internServingSizes([(item.servingSize.amount, item.servingSize.unit_id) for item in items])
+    for item in items:
+        item.servingSize = servingSizes[servingKey(item.servingSize.amount, item.servingSize.unit_id)]
+
+# Create custom items for a user from validated ItemCreateSerializer data, all in one transaction
+# nutrients maps every nutrient ID the items use to its Nutrient; returns a list of each item with its ItemNutrients
+# bulk_create skips the save signals, which new items without barcodes or combined items don't need
+def createItems(user, itemsData, nutrients):
+    with transaction.atomic():
+        servingSizes = internServingSizes([(data['serving_amount'], data['serving_unit'].id) for data in itemsData])
+        items = [
+            Item(
+                name=data['name'],
+                calories=data['calories'],
+                servingSize=servingSizes[servingKey(data['serving_amount'], data['serving_unit'].id)],
+                user=user,
+                isCustom=True
+            )
+            for data in itemsData
+        ]
+        Item.objects.bulk_create(items)
+
+        itemNutrients = [
+            [ItemNutrient(item=item, nutrient=nutrients[nutrientId], amount=amount) for nutrientId, amount in data['nutrients'].items()]
+            for item, data in zip(items, itemsData)
+        ]
+        ItemNutrient.objects.bulk_create([itemNutrient for nutrientList in itemNutrients for itemNutrient in nutrientList])
+
+    # Make the new items available to autocomplete
+    for item, nutrientList in zip(items, itemNutrients):
+        itemNameIndex.add(item, len(nutrientList))
+
+    return list(zip(items, itemNutrients))
@@ -0,0 +1,71 @@
+from contextlib import contextmanager
+
+from django.db import transaction
+from django.db.models import F, Q
+from django.db.models.functions import TruncDate
+
+from nutrition.models import CombinedItemElement, Consumed, DailyNutrientTotal
+from nutrition.utils.nutrition_utils import CALORIES_ID, nutrientTotalsQuery
+from nutrition.utils.version_utils import bumpVersion, userVersion
+
+
+# Total calories and nutrients of consumed rows in one query, as a dict of (userId, date, nutrientId) to amount
+def calculateDailyTotals(consumed):
+    totals = {}
+
+    for row in nutrientTotalsQuery(consumed, userId=F('user'), day=TruncDate('consumedAt')):
+        # Items without any nutrients produce an empty row
+        if row['nutrientId'] is None or row['total'] is None:
+            continue
+        key = (row['userId'], row['day'], row['nutrientId'])
+        totals[key] = totals.get(key, 0) + row['total']
+
+    return totals
+
+# Get the ledger key of a DailyNutrientTotal (calories are stored with a null nutrient)
+def ledgerKey(dailyTotal):
+    return (dailyTotal.user_id, dailyTotal.date, dailyTotal.nutrient_id or CALORIES_ID)
+
+# Add the contribution of consumed rows to the daily nutrient ledger (or remove it if sign is -1)
+def applyToLedger(consumed, sign=1):
+    deltas = calculateDailyTotals(consumed)
+    if not deltas:
+        return
+
+    with transaction.atomic():
+        # Create the missing ledger rows empty first, so concurrent first logs of a day add to the same row instead of both inserting it
+        DailyNutrientTotal.objects.bulk_create([
+            DailyNutrientTotal(user_id=userId, date=day, nutrient_id=(None if nutrientId == CALORIES_ID else nutrientId), amount=0)
+            for userId, day, nutrientId in deltas
+        ], ignore_conflicts=True)
+
+        # Lock the ledger rows that will change so concurrent updates don't lose deltas
+        userIds = {userId for userId, day, nutrientId in deltas}
+        days = {day for userId, day, nutrientId in deltas}
+        existing = {ledgerKey(dailyTotal): dailyTotal for dailyTotal in DailyNutrientTotal.objects.select_for_update().filter(user_id__in=userIds, date__in=days)}
+
+        toUpdate = []
+        for key, amount in deltas.items():
+            dailyTotal = existing[key]
+            dailyTotal.amount += sign * amount
+            toUpdate.append(dailyTotal)
+
+        DailyNutrientTotal.objects.bulk_update(toUpdate, ['amount'])
+
+    for userId in userIds:
+        bumpVersion(userVersion(userId))
+
+# Consumption whose totals come from the given items, directly or through the combined items that contain them
+# The combined items are looked up now, so the queryset still selects the same rows after the items are removed from them
+def consumedOfItems(itemIds):
+    combinedItemIds = list(CombinedItemElement.objects.filter(item__in=itemIds).values_list('combinedItem', flat=True).distinct())
+    return Consumed.objects.filter(Q(item__in=itemIds) | Q(combinedItem__in=combinedItemIds))
+
+# Keep the ledger in sync while consumed rows (or the combined items they reference) are changed inside the block
+# The queryset is evaluated before and after the block, so it should select the affected rows by a stable key
+@contextmanager
+def ledgerUpdate(consumed):
+    with transaction.atomic():
+        applyToLedger(consumed, -1)
+        yield
+        applyToLedger(consumed)
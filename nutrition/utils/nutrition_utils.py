@@ -1,4 +1,11 @@
-from nutrition.models import UserGoalNutrient
+from datetime import datetime, time, timedelta
+
+from django.db.models import DecimalField, F, IntegerField, Q, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from nutrition.models import Nutrient, UserGoalNutrient
+from nutrition.utils.version_utils import bumpVersion, userVersion
 
 ACTIVITY_MULTIPLIERS = {
     'Sedentary': 1.2,
@@ -8,6 +15,18 @@ ACTIVITY_MULTIPLIERS = {
     'Extremely Active': 1.9,
 }
 
+# Arbitrary nutrient ID used for calories in nutrient totals and status lists
+CALORIES_ID = -1
+
+# Get the first moment of a day in the current time zone
+def startOfDay(day):
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+# Filter consumed rows to those from the start day through the end day in the current time zone
+# A half-open range on consumedAt lets the database use the (user, consumedAt) index, which casting consumedAt to a date prevents
+def consumedOnDays(consumed, start, end):
+    return consumed.filter(consumedAt__gte=startOfDay(start), consumedAt__lt=startOfDay(end + timedelta(days=1)))
+
 # Calculate BMR using Mifflin-St Jeor Equation
 def calculateBMR(user):
     bmr = (4.536 * user.weight) + (15.88 * user.height) - (5 * user.age)
@@ -60,9 +79,25 @@ def calculateMacronutrients(calories, age):
 
     return calorieDistribution
 
+# Get a dict of the named macronutrients, creating any that don't exist yet
+def getMacronutrients(names):
+    nutrients = {nutrient.name: nutrient for nutrient in Nutrient.objects.filter(name__in=names)}
+
+    for name in names:
+        if name not in nutrients:
+            nutrients[name] = Nutrient.objects.get_or_create(name=name)[0]
+
+    return nutrients
+
+# Create or update the goal's nutrient targets (a dict of nutrient ID to target value) in a single statement
+def setGoalNutrientTargets(goal, targets):
+    goalNutrients = [UserGoalNutrient(goal=goal, nutrient_id=nutrientId, targetValue=targetValue) for nutrientId, targetValue in targets.items()]
+    UserGoalNutrient.objects.bulk_create(goalNutrients, update_conflicts=True, unique_fields=['goal', 'nutrient'], update_fields=['targetValue'])
+    bumpVersion(userVersion(goal.user_id))
+
 # Format nutrient data for use in the frontend
 def serializeNutrients(goal):
-    goalNutrients = UserGoalNutrient.objects.filter(goal=goal)
+    goalNutrients = UserGoalNutrient.objects.filter(goal=goal).select_related('nutrient__unit')
     goalNutrientsList = []
 
     for goalNutrient in goalNutrients:
@@ -77,4 +112,40 @@ def serializeNutrients(goal):
         }
         goalNutrientsList.append(nutrientData)
 
-    return goalNutrientsList
\ No newline at end of file
+    return goalNutrientsList
+
+# Build a single query that totals calories and every nutrient in a set of consumed rows
+# Items and combined items are summed in separate branches of one UNION ALL; calories are returned under CALORIES_ID
+# Combined items are read from their stored totals (CombinedItemTotal), so they cost the same as items
+# Extra keyword expressions (e.g., day=TruncDate('consumedAt')) are added to the grouping of every branch
+# If nutrientIds is given, only calories and those nutrients are totalled
+def nutrientTotalsQuery(consumed, nutrientIds=None, **groupBy):
+    totalField = DecimalField(max_digits=20, decimal_places=4)
+    consumedItems = consumed.filter(item__isnull=False)
+    consumedCombinedItems = consumed.filter(combinedItem__isnull=False)
+
+    itemCalories = consumedItems.values(**groupBy, nutrientId=Value(CALORIES_ID, output_field=IntegerField())).annotate(
+        total=Sum(F('portion') * F('item__calories'), output_field=totalField))
+    # Filtering before values() makes the totals below use the filtered join
+    if nutrientIds is not None:
+        consumedItems = consumedItems.filter(item__itemnutrient__nutrient__in=nutrientIds)
+        consumedCombinedItems = consumedCombinedItems.filter(Q(combinedItem__combineditemtotal__nutrient__in=nutrientIds) | Q(combinedItem__combineditemtotal__nutrient__isnull=True))
+    itemNutrients = consumedItems.values(**groupBy, nutrientId=F('item__itemnutrient__nutrient')).annotate(
+        total=Sum(F('portion') * F('item__itemnutrient__amount'), output_field=totalField))
+    # Combined item calories are stored with a null nutrient
+    combinedItemTotals = consumedCombinedItems.values(**groupBy, nutrientId=Coalesce(F('combinedItem__combineditemtotal__nutrient'), Value(CALORIES_ID), output_field=IntegerField())).annotate(
+        total=Sum(F('portion') * F('combinedItem__combineditemtotal__amount'), output_field=totalField))
+
+    return itemCalories.union(itemNutrients, combinedItemTotals, all=True)
+
+# Total calories and nutrients for a set of consumed rows in one query, as a dict of nutrient ID to amount
+def calculateNutrientTotals(consumed):
+    totals = {}
+
+    for row in nutrientTotalsQuery(consumed):
+        # Items without any nutrients produce an empty row
+        if row['nutrientId'] is None or row['total'] is None:
+            continue
+        totals[row['nutrientId']] = totals.get(row['nutrientId'], 0) + row['total']
+
+    return totals
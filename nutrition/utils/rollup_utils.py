@@ -0,0 +1,51 @@
+import threading
+
+from django.db import transaction
+from django.db.models import DecimalField, F, IntegerField, Sum, Value
+
+from nutrition.models import CombinedItemElement, CombinedItemTotal
+from nutrition.utils.nutrition_utils import CALORIES_ID
+
+# IDs of the combined items this thread is deleting (see signals.py), whose totals are deleted with them instead of refreshed
+deleting = threading.local()
+
+def deletingCombinedItemIds():
+    if not hasattr(deleting, 'ids'):
+        deleting.ids = set()
+    return deleting.ids
+
+
+# Total calories and nutrients of combined item elements in one query, as a dict of (combinedItemId, nutrientId) to amount
+def calculateCombinedItemTotals(elements):
+    totalField = DecimalField(max_digits=20, decimal_places=4)
+    calories = elements.values(combinedItemId=F('combinedItem'), nutrientId=Value(CALORIES_ID, output_field=IntegerField())).annotate(
+        total=Sum(F('portion') * F('item__calories'), output_field=totalField))
+    nutrients = elements.values(combinedItemId=F('combinedItem'), nutrientId=F('item__itemnutrient__nutrient')).annotate(
+        total=Sum(F('portion') * F('item__itemnutrient__amount'), output_field=totalField))
+
+    totals = {}
+    for row in calories.union(nutrients, all=True):
+        # Items without any nutrients produce an empty row
+        if row['nutrientId'] is None or row['total'] is None:
+            continue
+        totals[(row['combinedItemId'], row['nutrientId'])] = row['total']
+
+    return totals
+
+# Recompute the stored totals of combined items from their current elements
+def refreshCombinedItemTotals(combinedItemIds):
+    combinedItemIds = {combinedItemId for combinedItemId in combinedItemIds if combinedItemId is not None} - deletingCombinedItemIds()
+    if not combinedItemIds:
+        return
+
+    totals = calculateCombinedItemTotals(CombinedItemElement.objects.filter(combinedItem__in=combinedItemIds))
+    with transaction.atomic():
+        CombinedItemTotal.objects.filter(combinedItem__in=combinedItemIds).delete()
+        CombinedItemTotal.objects.bulk_create([
+            CombinedItemTotal(combinedItem_id=combinedItemId, nutrient_id=(None if nutrientId == CALORIES_ID else nutrientId), amount=amount)
+            for (combinedItemId, nutrientId), amount in totals.items()
+        ])
+
+# Recompute the totals of every combined item that contains any of the items
+def refreshCombinedItemTotalsForItems(itemIds):
+    refreshCombinedItemTotals(CombinedItemElement.objects.filter(item__in=itemIds).values_list('combinedItem', flat=True).distinct())
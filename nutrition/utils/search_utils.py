@@ -0,0 +1,20 @@
+from django.contrib.postgres.search import TrigramWordSimilarity
+from django.db import connections
+from django.db.models import Count, functions
+
+
+# Filter items to those whose names contain every word of the search, ordered by shortest name and then most nutrients
+# The icontains filters are served by the trigram index on UPPER(name) in PostgreSQL (see migration 0003)
+# If ranked, order by trigram word similarity to the search first; this needs pg_trgm, so other databases keep the default order
+def searchItems(queryset, name, ranked=False):
+    for word in name.split():
+        queryset = queryset.filter(name__icontains=word)
+
+    queryset = queryset.annotate(nameLength=functions.Length('name'), nutrientCount=Count('nutrients'))
+    ordering = ['nameLength', '-nutrientCount']
+
+    if ranked and connections[queryset.db].vendor == 'postgresql':
+        queryset = queryset.annotate(relevance=TrigramWordSimilarity(name, 'name'))
+        ordering.insert(0, '-relevance')
+
+    return queryset.order_by(*ordering)
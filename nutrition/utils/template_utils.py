@@ -0,0 +1,77 @@
+import bisect
+import threading
+import time
+
+from django.core.cache import cache
+
+from nutrition.models import GoalTemplate, GoalTemplateNutrient
+
+# Reload the templates after this many seconds in case they were changed by another process and the cache is not shared
+MAX_AGE = 60 * 60
+
+# Shared cache key bumped whenever templates change, so every process with a shared cache reloads on its next lookup
+VERSION_KEY = 'goal-templates-version'
+
+
+# In-memory copy of every goal template and its nutrient targets
+# Templates are grouped by (sex, isPregnant, isLactating), and each group is sorted by minimum age so the templates
+# whose age range could contain an age are found with a binary search
+class GoalTemplateResolver:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.loadedAt = None
+        self.version = None
+        self.groups = {}
+        self.targets = {}
+
+    # Load all templates and their nutrient targets in two queries
+    def load(self):
+        version = cache.get(VERSION_KEY)
+        groups = {}
+        targets = {}
+
+        for template in GoalTemplate.objects.order_by('ageMin', 'id'):
+            group = groups.setdefault((template.sex, template.isPregnant, template.isLactating), ([], []))
+            group[0].append(template.ageMin)
+            group[1].append(template)
+            targets[template.id] = {}
+
+        for templateId, nutrientId, recommendedValue in GoalTemplateNutrient.objects.values_list('template', 'nutrient', 'recommendedValue'):
+            targets[templateId][nutrientId] = recommendedValue
+
+        with self.lock:
+            self.groups = groups
+            self.targets = targets
+            self.version = version
+            self.loadedAt = time.monotonic()
+
+    # Drop the loaded templates in this process and tell other processes to reload theirs
+    def invalidate(self):
+        with self.lock:
+            self.loadedAt = None
+        try:
+            cache.incr(VERSION_KEY)
+        except ValueError:
+            cache.set(VERSION_KEY, 1, None)
+
+    def ensureLoaded(self):
+        if self.loadedAt is None or time.monotonic() - self.loadedAt > MAX_AGE or cache.get(VERSION_KEY) != self.version:
+            self.load()
+
+    # Get the template that fits the user's info (the first one created if several do) and a dict of its nutrient IDs to recommended values
+    # Returns (None, None) if no template fits
+    def resolve(self, sex, isPregnant, isLactating, age):
+        self.ensureLoaded()
+
+        with self.lock:
+            ageMins, templates = self.groups.get((sex, isPregnant, isLactating), ([], []))
+            candidates = [template for template in templates[:bisect.bisect_right(ageMins, age)] if template.ageMax >= age]
+            if not candidates:
+                return None, None
+
+            template = min(candidates, key=lambda template: template.id)
+            return template, dict(self.targets[template.id])
+
+
+goalTemplateResolver = GoalTemplateResolver()
@@ -0,0 +1,132 @@
+import os
+import shutil
+import threading
+import time
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.utils import timezone
+
+from nutrition.models import Item, ItemNutrient, Nutrient
+
+# Optional dense copy of ItemNutrient: one float32 vector per item over every nutrient, ordered by nutrient ID
+# The vectors are kept in memory-mapped NumPy files under NUTRIENT_VECTOR_DIR, built by rebuild_nutrient_vectors after imports
+# Items added or changed after the last build are read from ItemNutrient instead, so results are always current
+# This module needs numpy, which is an optional dependency; it is only imported when vectors are built or read
+
+# Number of items whose nutrients are loaded from the database at a time while building
+BUILD_BATCH_SIZE = 10000
+
+# Record when items' nutrients last changed (called by signals), so vectors built before that are skipped
+# The time is stored on the item rather than in the cache, where it could be evicted and the old vector used again
+def markChanged(itemIds):
+    Item.objects.filter(id__in=itemIds).update(nutrientsChangedAt=timezone.now())
+
+def vectorDir():
+    return str(settings.NUTRIENT_VECTOR_DIR)
+
+# Write the vectors of every item to a new directory, then swap it in so readers never see a partly written set of files
+# Returns the number of items
+def buildVectors():
+    import numpy as np
+
+    path = vectorDir()
+    building = f'{path}.building'
+    shutil.rmtree(building, ignore_errors=True)
+    os.makedirs(building)
+
+    builtAt = time.time()
+    nutrientIds = np.array(Nutrient.objects.order_by('id').values_list('id', flat=True), dtype=np.int64)
+    itemIds = np.array(Item.objects.order_by('id').values_list('id', flat=True), dtype=np.int64)
+    np.save(os.path.join(building, 'nutrientIds.npy'), nutrientIds)
+    np.save(os.path.join(building, 'itemIds.npy'), itemIds)
+    np.save(os.path.join(building, 'builtAt.npy'), np.array(builtAt))
+
+    vectors = np.lib.format.open_memmap(os.path.join(building, 'vectors.npy'), mode='w+', dtype=np.float32, shape=(len(itemIds), len(nutrientIds)))
+    for start in range(0, len(itemIds), BUILD_BATCH_SIZE):
+        batchIds = itemIds[start:start + BUILD_BATCH_SIZE]
+        rows = np.array(ItemNutrient.objects.filter(item__in=batchIds.tolist()).values_list('item', 'nutrient', 'amount'), dtype=np.float64).reshape(-1, 3)
+        vectors[start + np.searchsorted(batchIds, rows[:, 0]), np.searchsorted(nutrientIds, rows[:, 1])] = rows[:, 2]
+    vectors.flush()
+    del vectors
+
+    if os.path.exists(path):
+        os.rename(path, f'{path}.old')
+    os.rename(building, path)
+    shutil.rmtree(f'{path}.old', ignore_errors=True)
+    return len(itemIds)
+
+
+# Reads item vectors from the memory-mapped files, reopening them after each rebuild
+class NutrientVectorStore:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.modifiedAt = None
+        self.builtAt = 0
+        self.itemIds = None
+        self.nutrientIds = None
+        self.vectors = None
+
+    def ensureLoaded(self):
+        import numpy as np
+
+        path = vectorDir()
+        try:
+            modifiedAt = os.stat(path).st_mtime
+        except FileNotFoundError:
+            modifiedAt = None
+        if self.itemIds is not None and modifiedAt == self.modifiedAt:
+            return
+
+        with self.lock:
+            if modifiedAt is None:
+                # Not built yet: every item is read from the database
+                self.itemIds = np.zeros(0, dtype=np.int64)
+                self.nutrientIds = np.array(Nutrient.objects.order_by('id').values_list('id', flat=True), dtype=np.int64)
+                self.vectors = np.zeros((0, len(self.nutrientIds)), dtype=np.float32)
+                self.builtAt = 0
+            else:
+                self.itemIds = np.load(os.path.join(path, 'itemIds.npy'))
+                self.nutrientIds = np.load(os.path.join(path, 'nutrientIds.npy'))
+                self.vectors = np.load(os.path.join(path, 'vectors.npy'), mmap_mode='r')
+                self.builtAt = float(np.load(os.path.join(path, 'builtAt.npy')))
+            self.modifiedAt = modifiedAt
+
+    # Get the nutrient IDs of the vector columns and a float32 matrix with one row per item ID, in the order given
+    # Nutrients added since the last build are not included until vectors are rebuilt
+    def getVectors(self, itemIds):
+        import numpy as np
+
+        self.ensureLoaded()
+        with self.lock:
+            storedIds, nutrientIds, vectors, builtAt = self.itemIds, self.nutrientIds, self.vectors, self.builtAt
+
+        itemIds = np.asarray(itemIds, dtype=np.int64)
+        result = np.zeros((len(itemIds), len(nutrientIds)), dtype=np.float32)
+        found = np.zeros(len(itemIds), dtype=bool)
+        if len(storedIds):
+            rows = np.minimum(np.searchsorted(storedIds, itemIds), len(storedIds) - 1)
+            found = storedIds[rows] == itemIds
+            result[found] = vectors[rows[found]]
+
+        # Items that weren't built, or whose nutrients changed since the build, are read from ItemNutrient
+        foundIds = itemIds[found].tolist()
+        changedIds = set(Item.objects.filter(id__in=foundIds, nutrientsChangedAt__gt=datetime.fromtimestamp(builtAt, dt_timezone.utc)).values_list('id', flat=True))
+        stale = ~found
+        stale[found] = [itemId in changedIds for itemId in foundIds]
+        if stale.any():
+            # An item ID can be asked for more than once, so fill every row that has it
+            staleRows = {}
+            for row, itemId in zip(np.flatnonzero(stale).tolist(), itemIds[stale].tolist()):
+                staleRows.setdefault(itemId, []).append(row)
+            columns = {nutrientId: column for column, nutrientId in enumerate(nutrientIds.tolist())}
+
+            result[stale] = 0
+            for itemId, nutrientId, amount in ItemNutrient.objects.filter(item__in=list(staleRows), nutrient__in=list(columns)).values_list('item', 'nutrient', 'amount'):
+                result[staleRows[itemId], columns[nutrientId]] = amount
+
+        return nutrientIds.tolist(), result
+
+
+nutrientVectors = NutrientVectorStore()
@@ -0,0 +1,75 @@
+import hashlib
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+
+# Change versions for conditional GETs and cached responses
+# Each name (e.g., 'units') has a random version and the time it last changed, replaced by signals whenever its data changes
+# Versions are random rather than counters so a version lost from the cache can never match an old ETag again
+
+# A local memory cache belongs to one process, so changes made by other processes (the import commands, or other server
+# workers) can't replace its versions; there versions and cached responses expire after this many seconds instead
+LOCAL_CACHE_TIMEOUT = 60 * 5
+
+# Whether every process reads and writes the same cache, so a version replaced by one is seen by all of them
+def sharedCache():
+    return not settings.CACHES['default']['BACKEND'].endswith('LocMemCache')
+
+def cacheTimeout(timeout):
+    if not sharedCache():
+        return LOCAL_CACHE_TIMEOUT if timeout is None else min(timeout, LOCAL_CACHE_TIMEOUT)
+    return timeout
+
+def versionKey(name):
+    return f'version:{name}'
+
+# Replace a version now and again when the current transaction commits, so a response made from data read before the
+# commit can't keep the new version
+def bumpVersion(name):
+    cache.set(versionKey(name), (uuid.uuid4().hex, int(time.time())), cacheTimeout(None))
+    if transaction.get_connection().in_atomic_block:
+        transaction.on_commit(lambda: cache.set(versionKey(name), (uuid.uuid4().hex, int(time.time())), cacheTimeout(None)))
+
+# Name of the version of a user's own data (consumption, favorites, and goals)
+def userVersion(userId):
+    return f'user:{userId}'
+
+# Get a combined version string and the latest change time of the named versions, starting any that don't exist yet
+def getVersions(names):
+    keys = {name: versionKey(name) for name in names}
+    versions = cache.get_many(keys.values())
+    for name, key in keys.items():
+        if key not in versions:
+            cache.add(key, (uuid.uuid4().hex, int(time.time())), cacheTimeout(None))
+            versions[key] = cache.get(key)
+
+    return ':'.join(versions[key][0] for key in keys.values()), max(versions[key][1] for key in keys.values())
+
+# Get the Last-Modified time to send for a change time, or None while it is still the current second
+# Times have one second granularity, so a client holding a Last-Modified from the second of the change could miss another
+# change made later in that second; once the second is over, every later change has a later time
+def lastModifiedTime(changedAt):
+    return changedAt if changedAt < int(time.time()) else None
+
+# Make a strong ETag from the parts of a response's identity (versions, path, accepted formats, ...)
+def makeEtag(*parts):
+    return '"' + hashlib.sha1('\0'.join(str(part) for part in parts).encode()).hexdigest() + '"'
+
+# Get a 304 response if the request's If-None-Match or If-Modified-Since headers show the client is up to date, otherwise None
+# If-None-Match takes precedence, and without a lastModified only If-None-Match is used
+def notModifiedResponse(request, etag, lastModified=None):
+    response = get_conditional_response(request, etag=etag, last_modified=lastModified)
+    if response is not None:
+        setValidators(response, etag, lastModified)
+    return response
+
+def setValidators(response, etag, lastModified=None):
+    response['ETag'] = etag
+    if lastModified is not None:
+        response['Last-Modified'] = http_date(lastModified)
+    return response